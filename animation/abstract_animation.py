@@ -21,9 +21,13 @@ This is the sceleton code for all animations.
 """
 
 import abc
+import queue
 import threading
 import time
 
+# seconds a frame may be late before frame_deadline gives up the schedule
+MAX_LAG = 0.1
+
 
 class AbstractAnimation(abc.ABC, threading.Thread):
     def __init__(self, width, height, frame_queue, repeat):
@@ -34,6 +38,14 @@ class AbstractAnimation(abc.ABC, threading.Thread):
         self.repeat = repeat  # 0: no repeat, -1: forever, > 0: x-times
 
         self._running = False  # query this often! exit self.animate quickly
+        self._stop_requested = threading.Event()
+        # time.time() until which the frame put last will not change, None:
+        # unknown. Lets the consumer of the frames sleep instead of polling.
+        self.static_until = None
+        # time.time() at which the first frame is due, None: right away. Set
+        # before start to begin together with other displays.
+        self.start_at = None
+        self._next_deadline = None
 
     def run(self):
         """This is the run method from threading.Thread"""
@@ -42,13 +54,60 @@ class AbstractAnimation(abc.ABC, threading.Thread):
 
         self.started = time.time()
         self._running = True
-        self.animate()
+        try:
+            if self.start_at is not None:
+                if self.wait(self.start_at - time.time()):
+                    return
+                # also when it is late, time based animations catch up
+                self.started = self.start_at
+            self._next_deadline = self.started
+            self.animate()
+        finally:
+            self.static_until = None
+            # None carries no frame, it only wakes up the consumer so that it
+            # notices that this animation has finished
+            if self.frame_queue is not None:
+                try:
+                    self.frame_queue.put_nowait(None)
+                except queue.Full:
+                    pass
 
     # def start(self):
     """We do not overwrite this. It is from threading.Thread"""
 
     def stop(self):
         self._running = False
+        self._stop_requested.set()
+
+    def wait(self, seconds):
+        """Sleep for seconds, but return early when the animation is stopped.
+        Returns True if it was stopped."""
+        if seconds <= 0:
+            return not self._running
+        return self._stop_requested.wait(seconds)
+
+    def hold_until(self, until):
+        """Keep the frame put last until time until (time.time() based) and
+        tell the consumer about it. Returns True if the animation was stopped
+        in the meantime."""
+        self.static_until = until
+        try:
+            return self.wait(until - time.time())
+        finally:
+            self.static_until = None
+
+    def frame_deadline(self, seconds):
+        """time.time() at which the frame put last is due to be replaced, when
+        it is shown for seconds. Deadlines follow on from each other, so the
+        time spent producing frames does not add up and displays started
+        together stay together. After falling behind by more than MAX_LAG
+        the schedule restarts from now."""
+        now = time.time()
+        deadline = (self._next_deadline or now) + seconds
+        if deadline < now - MAX_LAG:
+            deadline = now
+        self._next_deadline = deadline
+        return deadline
 
     @abc.abstractmethod
     def animate(self):
@@ -16,7 +16,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import numpy as np
 from pathlib import Path
 
@@ -24,6 +23,9 @@ from animation.abstract_animation import AbstractAnimation
 
 
 class BlmAnimation(AbstractAnimation):
+    # prefix of the name, set by subclasses for their format
+    kind = "blm"
+
     def __init__(self, width, height, frame_queue, repeat, path,
                  foregound_color=(255, 255, 255),
                  background_color=(10, 10, 10),
@@ -33,14 +35,14 @@ class BlmAnimation(AbstractAnimation):
         self.path = Path(path)
         if not self.path.is_file():
             raise FileNotFoundError
-        self.name = "blm.{}".format(self.path.stem)
-
-        self.load_frames()
+        self.name = "{}.{}".format(self.kind, self.path.stem)
 
         self.foregound_color = foregound_color
         self.background_color = background_color
         self.padding_color = padding_color
 
+        self.load_frames()
+
         print(self)
 
     def intrinsic_duration(self):
@@ -88,7 +90,7 @@ class BlmAnimation(AbstractAnimation):
                     self.frame_queue.put(frame["frame"].copy())
                 else:
                     break
-                time.sleep(frame["hold"]/1000)
+                self.hold_until(self.frame_deadline(frame["hold"]/1000))
             if self.repeat > 0:
                 self.repeat -= 1
             elif self.repeat == 0:
@@ -115,51 +117,35 @@ class BlmAnimation(AbstractAnimation):
             np.putmask(array, ones, self.foregound_color)
             np.putmask(array, zeros, self.background_color)
 
-            (h, w, b) = array.shape
-
-            diff_h = h - self.height
-
-            diff_w = w - self.width
-
-            diff_h_top = abs(diff_h//2)
-            diff_h_bottom = abs(diff_h) - diff_h_top
-
-            diff_w_left = abs(diff_w//2)
-            diff_w_right = abs(diff_w) - diff_w_left
-
-            # print(h, w, b, diff_h, diff_w, diff_h_top, diff_h_bottom,
-            #      diff_w_left, diff_w_right)
-
-            if diff_h < 0:
-                # padding
-                array = np.pad(array, ((diff_h_top, diff_h_bottom),
-                                       (0, 0),
-                                       (0, 0)),
-                               'constant',
-                               constant_values=((self.padding_color,
-                                                 self.padding_color),
-                                                (0, 0), (0, 0)))
-            elif diff_h > 0:
-                # cropping
-                array = array[diff_h_top:-diff_h_bottom, :, :]
-
-            if diff_w < 0:
-                # padding
-                array = np.pad(array, ((0, 0),
-                                       (diff_w_left, diff_w_right),
-                                       (0, 0)),
-                               'constant',
-                               constant_values=((0, 0),
-                                                (self.padding_color,
-                                                 self.padding_color),
-                                                (0, 0)))
-            elif diff_w > 0:
-                # cropping
-                array = array[:, diff_w_left:-diff_w_right, :]
-            # print(array.shape)
+            array = self.fit_to_display(array)
 
             yield {"hold": frame["hold"], "frame": array}
 
+    def fit_to_display(self, array):
+        """Center array on the display. Larger frames are cropped, smaller
+        frames are padded with padding_color."""
+        (h, w, b) = array.shape
+
+        diff_h = h - self.height
+        diff_w = w - self.width
+
+        # cropping
+        if diff_h > 0:
+            array = array[diff_h//2:diff_h//2 + self.height, :, :]
+        if diff_w > 0:
+            array = array[:, diff_w//2:diff_w//2 + self.width, :]
+
+        # padding
+        if diff_h < 0 or diff_w < 0:
+            (h, w, b) = array.shape
+            top = (self.height - h)//2
+            left = (self.width - w)//2
+            padded = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            padded[:, :] = self.padding_color
+            padded[top:top+h, left:left+w, :] = array
+            array = padded
+        return array
+
     @property
     def kwargs(self):
         return {"width": self.width, "height": self.height,
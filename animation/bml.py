@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Format Reference
+# http://blinkenlights.net/project/bml
+
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from animation.blm import BlmAnimation
+
+# hex digit (as ascii code) to its value
+HEX_VALUES = np.zeros((256,), dtype=np.uint8)
+HEX_VALUES[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def local_name(tag):
+    """Strip an eventual xml namespace from tag"""
+    return tag.rsplit("}", 1)[-1]
+
+
+class BmlAnimation(BlmAnimation):
+    """Plays Blinkenlights Markup Language movies (.bml and .bmm).
+
+    The xml is parsed incrementally. Every <row> is decoded straight into the
+    array of the current frame and discarded afterwards, so long movies never
+    build a complete document tree in memory. Frames are stored already
+    colored and fitted to the display."""
+
+    kind = "bml"
+
+    def color_lookup_table(self, bits, channels):
+        """Map the values of a channel to rgb. Grey movies blend from
+        background_color to foregound_color, color movies scale every
+        channel to 0..255."""
+        max_value = (1 << bits) - 1
+        levels = np.arange(max_value + 1, dtype=np.float64) / max_value
+        if channels == 1:
+            background = np.array(self.background_color, dtype=np.float64)
+            foreground = np.array(self.foregound_color, dtype=np.float64)
+            lut = background + levels[:, np.newaxis] * \
+                (foreground - background)
+        else:
+            lut = levels * 255
+        return (lut + 0.5).astype(np.uint8)
+
+    def load_frames(self):
+        self.frames = []
+
+        width = height = bits = channels = None
+        digits = 1
+        lut = None
+        values = None
+        row = 0
+        root = None
+
+        for event, element in ET.iterparse(str(self.path),
+                                           events=("start", "end")):
+            tag = local_name(element.tag)
+            if event == "start":
+                if root is None:
+                    root = element
+                if tag == "blm":
+                    width = int(element.get("width"))
+                    height = int(element.get("height"))
+                    bits = int(element.get("bits", 1))
+                    channels = int(element.get("channels", 1))
+                    if not (1 <= bits <= 8 and channels in (1, 3)):
+                        raise AttributeError
+                    digits = 1 if bits <= 4 else 2
+                    lut = self.color_lookup_table(bits, channels)
+                elif tag == "frame":
+                    if lut is None:
+                        raise AttributeError
+                    values = np.zeros((height, width * channels),
+                                      dtype=np.uint8)
+                    row = 0
+                continue
+
+            if tag == "row" and values is not None:
+                if row < height:
+                    text = "".join((element.text or "").split())
+                    nibbles = HEX_VALUES[np.frombuffer(text.encode("ascii"),
+                                                       dtype=np.uint8)]
+                    if digits == 2:
+                        nibbles = nibbles[:len(nibbles) - len(nibbles) % 2]
+                        nibbles = (nibbles[0::2] << 4) | nibbles[1::2]
+                    length = min(len(nibbles), width * channels)
+                    values[row, :length] = nibbles[:length]
+                row += 1
+                element.clear()
+            elif tag == "frame" and values is not None:
+                values = np.minimum(values, len(lut) - 1)
+                if channels == 1:
+                    array = lut[values]
+                else:
+                    array = lut[values.reshape(height, width, channels)]
+                self.frames.append({"hold": int(element.get("duration", 0)),
+                                    "frame": self.fit_to_display(array)})
+                values = None
+                element.clear()
+                # drop references to finished frames from the root element
+                root.clear()
+
+        if len(self.frames) == 0:
+            raise AttributeError
+
+    def rendered_frames(self):
+        """Frames are rendered while parsing already"""
+        yield from self.frames
@@ -22,8 +22,11 @@ import numpy as np
 from PIL import Image, ImageDraw
 
 from animation.abstract_animation import AbstractAnimation
+from animation import frame_cache
 
 LEN_HOUR = 2
+FACES = 12 * 60
+WATCH = "resources/clock/watch_16x16_without_arms.png"
 
 
 class ClockAnimation(AbstractAnimation):
@@ -33,10 +36,35 @@ class ClockAnimation(AbstractAnimation):
         self.name = "clock"
         self.mode = mode
         self.background_color = background_color
-        watch = Image.open("resources/clock/watch_16x16_without_arms.png")
-        self.background = Image.new("RGB", watch.size, background_color)
+        self.background = None
+        # one frame for every hour and minute, drawn on first use and shared
+        # by all clock animations with the same background
+        self.atlas = frame_cache.cached(("clock", WATCH, self.width,
+                                         self.height, tuple(background_color)),
+                                        self.create_atlas)
+
+    def create_atlas(self):
+        return {"faces": np.zeros((FACES, self.height, self.width, 3),
+                                  dtype=np.uint8),
+                "drawn": np.zeros((FACES,), dtype=bool)}
+
+    def load_background(self):
+        watch = Image.open(WATCH)
+        self.background = Image.new("RGB", watch.size, self.background_color)
         self.background.paste(watch, mask=watch.split()[3])
 
+    def face(self, hour, minute):
+        """Frame showing hour:minute"""
+        i = (hour % 12) * 60 + minute % 60
+        if not self.atlas["drawn"][i]:
+            if self.background is None:
+                self.load_background()
+            image = self.background.copy()
+            self.add_hour_minute_hands(image, hour, minute)
+            self.atlas["faces"][i] = np.array(image)
+            self.atlas["drawn"][i] = True
+        return self.atlas["faces"][i]
+
     def minute_point(self, middle, minute):
         minute %= 60
         angle = 2*math.pi * minute/60 - math.pi/2
@@ -85,25 +113,18 @@ class ClockAnimation(AbstractAnimation):
         while self._running:
             if self.mode == 'current':
                 local_time = time.localtime()
-                image = self.background.copy()
-                self.add_hour_minute_hands(image,
-                                           local_time.tm_hour,
-                                           local_time.tm_min)
-                self.frame_queue.put(np.array(image).copy())
-                time.sleep(1)
+                self.frame_queue.put(self.face(local_time.tm_hour,
+                                               local_time.tm_min))
+                # the picture only changes with the next minute
+                now = time.time()
+                self.hold_until(now + 60 - now % 60)
             else:
-                hour = 0
-                for i in range(12*60):
+                for i in range(FACES):
                     if not self._running:
                         break
-                    if i % 60 == 0:
-                        hour += 1
-                        hour %= 12
-                    minute = i % 60
-                    image = self.background.copy()
-                    self.add_hour_minute_hands(image, hour, minute)
-                    self.frame_queue.put(np.array(image).copy())
-                    time.sleep(0.1)
+                    hour, minute = divmod(i, 60)
+                    self.frame_queue.put(self.face(hour, minute))
+                    self.wait(0.1)
 
     @property
     def kwargs(self):
@@ -111,19 +132,7 @@ class ClockAnimation(AbstractAnimation):
                 "frame_queue": self.frame_queue, "repeat": self.repeat,
                 "mode": self.mode, "background_color": self.background_color}
 
-
     def dump_animation(self, min_step=5):
-        hour = 0
-        for i in range(1, 12*60+1):
-            if i % 60 == 0:
-                hour += 1
-                hour %= 12
-            minute = i % 60
-            if minute % min_step == 0:
-                cp = self.background.copy()
-                draw = ImageDraw.Draw(cp)
-                draw.line([self.middle_point(minute),
-                           self.minute_point(minute)], fill=(0, 0, 0))
-                draw.line([self.middle_point(minute),
-                           self.hour_point(hour)], fill=(0, 0, 0))
-                cp.save("{}.bmp".format(i))
+        for i in range(0, FACES, min_step):
+            hour, minute = divmod(i, 60)
+            Image.fromarray(self.face(hour, minute)).save("{}.bmp".format(i))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generative effects computed over the whole frame at once.
+
+Every effect computes a field of palette positions for all pixels from
+coordinate grids that are prepared when the effect is created, and turns
+it into colors with one lookup in a 256 entry palette (see
+animation.palette). Nothing is computed per pixel in Python.
+
+    effect = Plasma(32, 32)
+    frame = effect.render(seconds)  # (height, width, 3) uint8
+
+Run python3 -m animation.effects [width [height]] for frame times.
+"""
+
+import time
+
+import numpy as np
+
+from animation import palette as palettes
+
+PALETTE_SIZE = 256
+
+
+FIRE = ((0, 0, 0), (128, 0, 0), (255, 60, 0), (255, 160, 0),
+        (255, 255, 80), (255, 255, 255))
+
+
+class Effect():
+    def __init__(self, width, height, palette=None, speed=1.0):
+        self.width = width
+        self.height = height
+        self.palette = palettes.wheel(PALETTE_SIZE) if palette is None \
+            else np.asarray(palette, dtype=np.uint8)
+        self.speed = speed
+        # pixel centers, scaled so that effects look alike on every size
+        scale = max(width, height)
+        y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+        self.x = (x + 0.5) / scale
+        self.y = (y + 0.5) / scale
+        self.field = np.empty((height, width), dtype=np.float32)
+        self.index = np.empty((height, width), dtype=np.intp)
+
+    def colorize(self, field):
+        """Colors of a field of palette positions, 1.0 is one turn through
+        the palette"""
+        np.multiply(field, len(self.palette), out=self.field)
+        np.floor(self.field, out=self.field)
+        self.index[:] = self.field
+        np.remainder(self.index, len(self.palette), out=self.index)
+        return self.palette[self.index]
+
+    def render(self, t):
+        """Frame at t seconds"""
+        raise NotImplementedError
+
+
+class Plasma(Effect):
+    def __init__(self, width, height, palette=None, speed=1.0, scale=10.0):
+        super().__init__(width, height, palette, speed)
+        self.scale = scale
+        self.xs = self.x * scale
+        self.ys = self.y * scale
+        self.diagonal = (self.xs + self.ys) / 2
+        self.radius = np.hypot(self.x - 0.5, self.y - 0.5) * scale
+        self.value = np.empty_like(self.field)
+        self.scratch = np.empty_like(self.field)
+
+    def render(self, t):
+        t *= self.speed
+        value, scratch = self.value, self.scratch
+        np.sin(np.add(self.xs, t, out=value), out=value)
+        np.add(self.ys, t * 0.7, out=scratch)
+        value += np.sin(scratch, out=scratch)
+        np.add(self.diagonal, t * 0.5, out=scratch)
+        value += np.sin(scratch, out=scratch)
+        np.subtract(self.radius, t * 1.3, out=scratch)
+        value += np.sin(scratch, out=scratch)
+        # four sines: -4 .. 4, one turn through the palette
+        value *= 1 / 8
+        value += t * 0.05
+        return self.colorize(value)
+
+
+class Fire(Effect):
+    def __init__(self, width, height, palette=None, speed=1.0, cooling=None,
+                 seed=None):
+        super().__init__(width, height,
+                         palettes.compile_palette(FIRE, PALETTE_SIZE,
+                                                  "linear", cyclic=False)
+                         if palette is None else palette,
+                         speed)
+        # maximum heat lost per row, by default the flames die out just
+        # below the top of the display
+        self.cooling = cooling if cooling is not None else \
+            2 * 256 // height + 2
+        self.random = np.random.default_rng(seed)
+        # heat of every pixel plus two rows of embers below the display
+        self.heat = np.zeros((height + 2, width), dtype=np.int32)
+        self.sum = np.empty((height, width), dtype=np.int32)
+        self.last_step = None
+        self.steps_per_second = 30
+
+    def step(self):
+        heat = self.heat
+        heat[-2:] = self.random.integers(96, 256, size=(2, self.width))
+        # every pixel takes the average of the three pixels below and the
+        # pixel two rows below, then cools down
+        below = heat[1:-1]
+        np.add(below, np.roll(below, 1, axis=1), out=self.sum)
+        self.sum += np.roll(below, -1, axis=1)
+        self.sum += heat[2:]
+        self.sum >>= 2
+        self.sum -= self.random.integers(0, self.cooling, size=self.sum.shape)
+        np.maximum(self.sum, 0, out=heat[:-2])
+
+    def render(self, t):
+        step = int(t * self.speed * self.steps_per_second)
+        if self.last_step is None:
+            self.last_step = step - 1
+        for _ in range(min(step - self.last_step, self.height)):
+            self.step()
+        self.last_step = step
+        np.clip(self.heat[:-2], 0, len(self.palette) - 1, out=self.index)
+        return self.palette[self.index]
+
+
+class Noise(Effect):
+    """Two octaves of smooth value noise drifting over the display"""
+    LATTICE = 256
+
+    def __init__(self, width, height, palette=None, speed=1.0, scale=4.0,
+                 seed=None):
+        super().__init__(width, height, palette, speed)
+        self.scale = scale
+        self.lattice = np.random.default_rng(seed).random(
+            (self.LATTICE, self.LATTICE), dtype=np.float32)
+
+    def octave(self, x, y):
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        fx = x - x0
+        fy = y - y0
+        # smoothstep
+        fx = fx * fx * (3 - 2 * fx)
+        fy = fy * fy * (3 - 2 * fy)
+        mask = self.LATTICE - 1
+        x0 = x0.astype(np.intp) & mask
+        y0 = y0.astype(np.intp) & mask
+        x1 = (x0 + 1) & mask
+        y1 = (y0 + 1) & mask
+        lattice = self.lattice
+        top = lattice[y0, x0] + (lattice[y0, x1] - lattice[y0, x0]) * fx
+        bottom = lattice[y1, x0] + (lattice[y1, x1] - lattice[y1, x0]) * fx
+        return top + (bottom - top) * fy
+
+    def render(self, t):
+        t *= self.speed
+        x = self.x * self.scale
+        y = self.y * self.scale
+        value = self.octave(x + t * 0.4, y + t * 0.25) * (2 / 3) + \
+            self.octave(x * 2 - t * 0.3, y * 2 + t * 0.5) * (1 / 3)
+        value += t * 0.02
+        return self.colorize(value)
+
+
+class Gradient(Effect):
+    """Linear gradient moving along angle (degrees)"""
+    def __init__(self, width, height, palette=None, speed=1.0, angle=45.0,
+                 repeats=1.0):
+        super().__init__(width, height, palette, speed)
+        angle = np.radians(angle)
+        self.position = (self.x * np.cos(angle) + self.y * np.sin(angle)) \
+            * repeats
+
+    def render(self, t):
+        return self.colorize(self.position - t * self.speed * 0.1)
+
+
+class Ripple(Effect):
+    """Concentric waves around one or more centers (relative coordinates)"""
+    def __init__(self, width, height, palette=None, speed=1.0,
+                 centers=((0.5, 0.5),), wavelength=0.25):
+        super().__init__(width, height, palette, speed)
+        self.distances = [np.hypot(self.x - cx, self.y - cy) / wavelength
+                          for cx, cy in centers]
+        self.value = np.empty_like(self.field)
+        self.scratch = np.empty_like(self.field)
+
+    def render(self, t):
+        t *= self.speed
+        value, scratch = self.value, self.scratch
+        value[:] = 0
+        for distance in self.distances:
+            np.subtract(distance, t, out=scratch)
+            scratch *= 2 * np.pi
+            value += np.sin(scratch, out=scratch)
+        value *= 0.5 / len(self.distances)
+        value += 0.5
+        # waves through half of the palette, slowly shifting its colors
+        value *= 0.5
+        value += t * 0.03
+        return self.colorize(value)
+
+
+EFFECTS = {"plasma": Plasma,
+           "fire": Fire,
+           "noise": Noise,
+           "gradient": Gradient,
+           "ripple": Ripple}
+
+
+def run_benchmark(width=32, height=32, frames=600):
+    """Mean and worst frame time of every effect, compared to the 16.7ms of
+    a frame at 60fps"""
+    for name, effect_class in EFFECTS.items():
+        effect = effect_class(width, height)
+        effect.render(0)
+        times = np.empty((frames,))
+        for i in range(frames):
+            start = time.perf_counter()
+            effect.render(i / 60)
+            times[i] = time.perf_counter() - start
+        print("{:8} {}x{}: mean {:.3f}ms, max {:.3f}ms, {:.0f} fps "
+              "possible".format(name, width, height, times.mean() * 1000,
+                                times.max() * 1000, 1 / times.mean()))
+
+
+if __name__ == "__main__":
+    import sys
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else width
+    run_benchmark(width, height)
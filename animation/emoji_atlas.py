@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Emoji pre-rendered at matrix resolution.
+
+The atlas is built once (on any machine that has the emoji font) with
+
+    python3 -m animation.emoji_atlas [text_size [emoji_font [emoji_size]]]
+
+and consists of two numpy files in resources/fonts:
+
+    emoji_<text_size>.npy        (count, text_size, text_size, 3) uint8 images
+    emoji_<text_size>_index.npy  (count,) uint32 sorted codepoints
+
+At runtime the images are memory mapped and looked up by codepoint, so the
+emoji font itself does not have to be installed on the device.
+"""
+
+from pathlib import Path
+import threading
+import time
+
+import numpy as np
+
+ATLAS_DIRECTORY = "resources/fonts"
+
+
+def atlas_paths(text_size, directory=ATLAS_DIRECTORY):
+    directory = Path(directory)
+    return (directory.joinpath("emoji_{}.npy".format(text_size)),
+            directory.joinpath("emoji_{}_index.npy".format(text_size)))
+
+
+class EmojiAtlas():
+    def __init__(self, text_size, directory=ATLAS_DIRECTORY):
+        images, index = atlas_paths(text_size, directory)
+        self.text_size = text_size
+        self.images = np.load(str(images), mmap_mode='r')
+        self.codepoints = np.load(str(index))
+        if self.images.shape[0] != self.codepoints.shape[0] or \
+                self.images.shape[1:] != (text_size, text_size, 3):
+            raise AttributeError
+
+    def __len__(self):
+        return len(self.codepoints)
+
+    def find(self, char):
+        """Position of char in the atlas or -1"""
+        codepoint = ord(char)
+        i = int(np.searchsorted(self.codepoints, codepoint))
+        if i < len(self.codepoints) and self.codepoints[i] == codepoint:
+            return i
+        return -1
+
+    def __contains__(self, char):
+        return self.find(char) >= 0
+
+    def get(self, char):
+        """Read-only view of the image of char, or None"""
+        i = self.find(char)
+        return self.images[i] if i >= 0 else None
+
+
+_atlases = {}
+_lock = threading.Lock()
+
+
+def load_atlas(text_size, directory=ATLAS_DIRECTORY):
+    """Return the shared EmojiAtlas for text_size, or None if it has not been
+    built"""
+    key = (text_size, str(directory))
+    with _lock:
+        if key not in _atlases:
+            images, index = atlas_paths(text_size, directory)
+            if images.is_file() and index.is_file():
+                _atlases[key] = EmojiAtlas(text_size, directory)
+            else:
+                _atlases[key] = None
+        return _atlases[key]
+
+
+def build_atlas(text_size, emoji_font, emoji_size, directory=ATLAS_DIRECTORY):
+    import freetype
+    from animation.font_cache import face_pool, glyph_cache
+
+    face, lock = face_pool.face(emoji_font, emoji_size)
+    with lock:
+        codepoints = sorted(code for code, glyph_index in face.get_chars()
+                            if glyph_index)
+
+    images = []
+    indices = []
+    for codepoint in codepoints:
+        try:
+            image = glyph_cache.color_glyph(emoji_font, emoji_size,
+                                            chr(codepoint), text_size)
+        except (freetype.FT_Exception, ValueError):
+            # glyph without color bitmap
+            continue
+        images.append(image)
+        indices.append(codepoint)
+
+    images_path, index_path = atlas_paths(text_size, directory)
+    np.save(str(images_path), np.array(images, dtype=np.uint8).reshape(
+        (len(images), text_size, text_size, 3)))
+    np.save(str(index_path), np.array(indices, dtype=np.uint32))
+    return images_path, index_path, len(indices)
+
+
+if __name__ == "__main__":
+    import sys
+    text_size = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    emoji_font = sys.argv[2] if len(sys.argv) > 2 else \
+        "resources/fonts/Apple Color Emoji.ttc"
+    emoji_size = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    start = time.time()
+    images_path, index_path, count = build_atlas(text_size, emoji_font,
+                                                 emoji_size)
+    print("{} emoji rendered at {}x{} in {:.1f}s: {} ({} bytes), {}".format(
+        count, text_size, text_size, time.time() - start, images_path,
+        images_path.stat().st_size, index_path))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process wide font faces and rendered glyphs.
+
+Opening a font (the emoji font is a very large file), loading a glyph
+through freetype and unpacking its bitmap are the expensive parts of
+rendering text. Every face is opened once per font and size when it is first
+needed, and every glyph is loaded once and reused by all later messages.
+
+A freetype face is not thread safe, so every face comes with a lock that is
+held while the face is used.
+"""
+
+from collections import namedtuple
+import threading
+
+import freetype
+import numpy as np
+from PIL import Image
+
+# bitmap: (rows, width) uint8 array, 255 where the glyph is set
+Glyph = namedtuple("Glyph", ["bitmap", "left", "top", "advance_x",
+                             "advance_y"])
+
+
+def unpack_mono_bitmap(bitmap):
+    """Unpack a 1 bit per pixel freetype bitmap to a (rows, width) array
+    of 0 and 255"""
+    rows, width, pitch = bitmap.rows, bitmap.width, abs(bitmap.pitch)
+    if rows == 0 or width == 0:
+        return np.zeros((rows, width), dtype=np.uint8)
+    data = np.array(bitmap.buffer, dtype=np.uint8).reshape(rows, pitch)
+    return np.unpackbits(data, axis=1)[:, :width] * np.uint8(255)
+
+
+def convert_bgra_to_rgb(buf):
+    blue = buf[:, :, 0]
+    green = buf[:, :, 1]
+    red = buf[:, :, 2]
+    return np.dstack((red, green, blue))
+
+
+class FacePool():
+    def __init__(self):
+        self._faces = {}  # (font, size) -> (face, lock)
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def face(self, font, size):
+        """Return (face, lock) for font at size, opening the font on first
+        use. Hold lock while using face."""
+        key = (font, size)
+        with self._lock:
+            entry = self._faces.get(key)
+            if entry is None:
+                face = freetype.Face(font)
+                face.set_char_size(size * 64)
+                entry = (face, threading.Lock())
+                self._faces[key] = entry
+                self.opened += 1
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._faces.clear()
+
+
+class GlyphCache():
+    def __init__(self, face_pool):
+        self.face_pool = face_pool
+        self._glyphs = {}
+        self._char_indices = {}
+        self._kerning = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, table, key):
+        with self._lock:
+            value = table.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def _store(self, table, key, value):
+        with self._lock:
+            table[key] = value
+
+    def has_char(self, font, size, char):
+        """True if font contains char. Opens the face on first use."""
+        key = (font, char)
+        found = self._lookup(self._char_indices, key)
+        if found is None:
+            face, lock = self.face_pool.face(font, size)
+            with lock:
+                found = face.get_char_index(char) != 0
+            self._store(self._char_indices, key, found)
+        return found
+
+    def glyph(self, font, size, char):
+        key = (font, size, char)
+        glyph = self._lookup(self._glyphs, key)
+        if glyph is None:
+            face, lock = self.face_pool.face(font, size)
+            with lock:
+                face.load_char(char, freetype.FT_LOAD_RENDER |
+                               freetype.FT_LOAD_TARGET_MONO)
+                slot = face.glyph
+                glyph = Glyph(unpack_mono_bitmap(slot.bitmap),
+                              slot.bitmap_left,
+                              slot.bitmap_top,
+                              slot.advance.x >> 6,
+                              slot.advance.y >> 6)
+            self._store(self._glyphs, key, glyph)
+        return glyph
+
+    def kerning(self, font, size, left, right):
+        """Horizontal kerning in pixels between left and right"""
+        key = (font, size, left, right)
+        kerning = self._lookup(self._kerning, key)
+        if kerning is None:
+            face, lock = self.face_pool.face(font, size)
+            with lock:
+                kerning = face.get_kerning(left, right).x >> 6
+            self._store(self._kerning, key, kerning)
+        return kerning
+
+    def color_glyph(self, font, size, char, target_size):
+        """Return the rgb image of a color (emoji) glyph loaded at size and
+        scaled to target_size x target_size"""
+        key = (font, size, char, target_size)
+        image = self._lookup(self._glyphs, key)
+        if image is None:
+            face, lock = self.face_pool.face(font, size)
+            with lock:
+                face.load_char(char, freetype.FT_LOAD_COLOR)
+                bitmap = face.glyph.bitmap
+                if bitmap.pixel_mode != freetype.FT_PIXEL_MODE_BGRA:
+                    raise ValueError("{!r} has no color bitmap".format(char))
+                bitmap = np.array(bitmap.buffer, dtype=np.uint8).reshape(
+                    (bitmap.rows, bitmap.width, 4))
+            rgb = convert_bgra_to_rgb(bitmap)
+            image = np.array(Image.fromarray(rgb).resize((target_size,
+                                                          target_size)))
+            self._store(self._glyphs, key, image)
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._glyphs.clear()
+            self._char_indices.clear()
+            self._kerning.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+face_pool = FacePool()
+glyph_cache = GlyphCache(face_pool)
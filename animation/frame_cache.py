@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Process wide cache for precompiled frames.
+
+Animations are recreated every time they are played, but decoding their
+assets is the expensive part on a Raspberry Pi. Decoded frame stacks are kept
+here, keyed by whatever identifies the asset (usually path, modification time
+and matrix size), and shared by all instances. The least recently used entries
+are dropped once the cache grows beyond MAX_BYTES.
+"""
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+MAX_BYTES = 32 * 1024 * 1024
+
+_entries = OrderedDict()  # key -> (value, nbytes)
+_lock = threading.Lock()
+_total_bytes = 0
+
+
+def nbytes(value):
+    """Memory used by the numpy arrays contained in value"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+def get(key):
+    with _lock:
+        if key not in _entries:
+            return None
+        _entries.move_to_end(key)
+        return _entries[key][0]
+
+
+def put(key, value):
+    global _total_bytes
+    size = nbytes(value)
+    with _lock:
+        if key in _entries:
+            _total_bytes -= _entries.pop(key)[1]
+        _entries[key] = (value, size)
+        _total_bytes += size
+        # keep at least the newest entry, even if it is larger than MAX_BYTES
+        while _total_bytes > MAX_BYTES and len(_entries) > 1:
+            _, (_, evicted_size) = _entries.popitem(last=False)
+            _total_bytes -= evicted_size
+
+
+def cached(key, loader):
+    """Return the value stored for key. On a miss loader() is called and its
+    result is stored. Loading happens outside of the lock, so two threads
+    missing the same key at once may both decode it."""
+    value = get(key)
+    if value is None:
+        value = loader()
+        put(key, value)
+    return value
+
+
+def clear():
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
+
+
+def stats():
+    with _lock:
+        return {"entries": len(_entries), "bytes": _total_bytes,
+                "max_bytes": MAX_BYTES}
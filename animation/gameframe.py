@@ -16,7 +16,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import numpy as np
 from PIL import Image
 
@@ -173,7 +172,7 @@ class GameframeAnimation(AbstractAnimation):
                     self.frame_queue.put(frame.copy())
                 else:
                     break
-                time.sleep(self.hold/1000)
+                self.hold_until(self.frame_deadline(self.hold/1000))
                 # if (time.time() - self.started) > self.duration:
                 #     break
             if self.repeat > 0:
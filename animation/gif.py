@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import numpy as np
+from PIL import Image
+from pathlib import Path
+
+from animation.abstract_animation import AbstractAnimation
+from animation import frame_cache
+
+DEFAULT_FRAMES_PER_SEC = 25
+MAX_LENGTH_IN_SEC = 30
+FRAME_LIMIT = MAX_LENGTH_IN_SEC * DEFAULT_FRAMES_PER_SEC
+DEFAULT_DURATION = 1000 // DEFAULT_FRAMES_PER_SEC  # milliseconds
+MAX_DURATION = 5000  # milliseconds
+
+
+class GifAnimation(AbstractAnimation):
+    """Plays animated GIF and APNG files (and still images as one frame).
+
+    All frames are decoded once, resampled to the matrix size and stored as
+    one contiguous (frames, height, width, 3) array in the frame cache."""
+
+    def __init__(self, width, height, frame_queue, repeat, path,
+                 background_color=(0, 0, 0)):
+        super().__init__(width, height, frame_queue, repeat)
+
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError
+        self.name = "gif.{}".format(self.path.stem)
+        self.background_color = tuple(background_color)
+
+        self.load_frames()
+
+        print(self)
+
+    def intrinsic_duration(self):
+        return int(self.durations.sum())/1000.0
+
+    def __str__(self):
+        return "Path: {} file: {} frames: {} shape: {} duration: {} "\
+               "decode time: {:.3f}s memory: {} bytes\n"\
+               "".format(self.path,
+                         self.name,
+                         len(self.frames),
+                         self.frames.shape[1:],
+                         self.intrinsic_duration(),
+                         self.decode_time,
+                         self.frames.nbytes + self.durations.nbytes)
+
+    def load_frames(self):
+        key = ("gif", str(self.path.resolve()), self.path.stat().st_mtime,
+               self.width, self.height, self.background_color)
+        self.frames, self.durations, self.decode_time = \
+            frame_cache.cached(key, self.decode)
+
+    def decode(self):
+        start = time.time()
+        try:
+            image = Image.open(str(self.path))
+        except IOError:
+            raise AttributeError
+
+        with image:
+            count = min(getattr(image, "n_frames", 1), FRAME_LIMIT)
+            frames = np.empty((count, self.height, self.width, 3),
+                              dtype=np.uint8)
+            durations = np.empty((count,), dtype=np.uint32)
+            background = Image.new("RGBA", image.size,
+                                   self.background_color + (255,))
+            for i in range(count):
+                # While seeking Pillow composes the frame on top of the
+                # previous one, applying the GIF disposal method or the APNG
+                # dispose_op/blend_op. What is left transparent afterwards is
+                # shown on background_color.
+                image.seek(i)
+                frame = Image.alpha_composite(background,
+                                              image.convert("RGBA"))
+                frame = self.resize_frame(frame.convert("RGB"))
+                frames[i] = np.asarray(frame)
+                durations[i] = self.frame_duration(image)
+        return frames, durations, time.time() - start
+
+    def resize_frame(self, frame):
+        size = (self.width, self.height)
+        if frame.size == size:
+            return frame
+        if frame.size[0] > self.width or frame.size[1] > self.height:
+            # average the covered pixels when shrinking
+            return frame.resize(size, Image.BOX)
+        # keep pixel art crisp when growing
+        return frame.resize(size, Image.NEAREST)
+
+    @staticmethod
+    def frame_duration(image):
+        try:
+            duration = int(image.info.get("duration", DEFAULT_DURATION))
+        except (TypeError, ValueError):
+            duration = DEFAULT_DURATION
+        if duration <= 0 or duration > MAX_DURATION:
+            duration = DEFAULT_DURATION
+        return duration
+
+    def animate(self):
+        while self._running:
+            for frame, duration in zip(self.frames, self.durations):
+                if self._running:
+                    self.frame_queue.put(frame.copy())
+                else:
+                    break
+                self.hold_until(self.frame_deadline(duration/1000))
+            if self.repeat > 0:
+                self.repeat -= 1
+            elif self.repeat == 0:
+                self._running = False
+
+    @property
+    def kwargs(self):
+        return {"width": self.width, "height": self.height,
+                "frame_queue": self.frame_queue, "repeat": self.repeat,
+                "path": self.path, "background_color": self.background_color}
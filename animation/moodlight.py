@@ -23,18 +23,25 @@ import random
 import colorsys
 
 from animation.abstract_animation import AbstractAnimation
+from animation.effects import EFFECTS
+from animation import palette
+
+MODES = ("colorwheel", "cyclecolors", "wish_down_up") + tuple(EFFECTS)
+MAX_HOLD = 60  # seconds, unchanged frames are looked ahead at most this far
 
 
 class MoodlightAnimation(AbstractAnimation):
     def __init__(self, width, height, frame_queue, repeat=False,
                  mode="wish_down_up"):
         super().__init__(width, height, frame_queue, repeat)
+        self.name = "moodlight"
         self.mode = mode
         self.colors = [(255, 0, 0), (255, 255, 0), (0, 255, 255), (0, 0, 255)]  # if empty choose random colors
         self.random = False  # how to step through colors
         self.hold = 10  # seconds to hold colors
         self.transition_duration = 10  # seconds to change from one to other
         self.frequency = 60  # frames per second
+        self.color_space = "oklab"  # to interpolate between self.colors in
         print("MoodlightAnimation created")
 
     def ribbapi_hsv_to_rgb(self, h, s, v):
@@ -56,37 +63,22 @@ class MoodlightAnimation(AbstractAnimation):
 
     def color_wheel_generator(self, steps):
         # steps: how many steps to take to go from 0 to 360.
-        increase = (360 - 0) / steps
+        table = palette.wheel(4096)
+        indices = np.arange(steps) * len(table) // steps
         while True:
-            for i in np.arange(0, 360, increase):
-                color = self.ribbapi_hsv_to_rgb(i, 100, 100)
-                yield color
+            for i in indices:
+                yield table[i]
 
     def cycle_selected_colors_generator(self, steps, hold):
         # steps: how many steps from one color to other color
         # hold: how many iterations to stay at one color
-        current_color = None
+        table = palette.compile_palette(self.colors, 4096, self.color_space)
+        indices = palette.transition_indices(len(table), len(self.colors),
+                                             steps, hold)
+        yield table[0]
         while True:
-            for color in self.colors:
-                if not current_color:
-                    current_color = color
-                    yield color
-                else:
-                    # rgb color
-                    r, g, b = color
-                    current_r, current_g, current_b = current_color
-                    increase_r = (r - current_r) / steps
-                    increase_g = (g - current_g) / steps
-                    increase_b = (b - current_b) / steps
-                    for _ in range(steps):
-                        current_r += increase_r
-                        current_g += increase_g
-                        current_b += increase_b
-                        current_color = (current_r, current_g, current_b)
-                        color = (int(current_r), int(current_g), int(current_b))
-                        yield color
-                for _ in range(hold):
-                    yield color
+            for i in indices:
+                yield table[i]
 
     def frame_generator(self, color_mode, style):
         frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
@@ -107,11 +99,30 @@ class MoodlightAnimation(AbstractAnimation):
                 yield frame
             elif style == "wish_down_up":
                 color = next(colors)
-                frame = np.concatenate((frame[1:16, :],
-                                        np.array(color * self.width).reshape(1, self.width, 3)), axis=0)
+                frame = np.concatenate((frame[1:, :],
+                                        np.broadcast_to(color, (1, self.width, 3))), axis=0)
                 yield frame
 
+    def animate_effect(self):
+        effect = EFFECTS[self.mode](self.width, self.height)
+        # displays started together render the same moment
+        start = self.started
+        next_frame = start
+        while self._running:
+            # effects create a new frame every time, no copy needed
+            self.frame_queue.put(effect.render(time.time() - start))
+            next_frame += 1/self.frequency
+            delay = next_frame - time.time()
+            if delay < 0:
+                # fell behind, do not try to catch up
+                next_frame = time.time()
+            else:
+                time.sleep(delay)
+
     def animate(self):
+        if self.mode in EFFECTS:
+            self.animate_effect()
+            return
         while self._running:
             if self.mode == "colorwheel":
                 generator = self.frame_generator("colorwheel", "fill")
@@ -122,12 +133,25 @@ class MoodlightAnimation(AbstractAnimation):
             elif self.mode == "wish_down_up":
                 generator = self.frame_generator("colorwheel", "wish_down_up")
 
-            for frame in generator:
-                if self._running:
-                    self.frame_queue.put(frame.copy())
+            frames = iter(generator)
+            frame = next(frames)
+            while self._running:
+                previous = frame.copy()
+                self.frame_queue.put(previous)
+                # while a color is held the frame often does not change, do
+                # not send it to the display again but hold it for the
+                # whole run of unchanged steps at once
+                steps = 1
+                for frame in frames:
+                    if steps >= MAX_HOLD * self.frequency or \
+                            not np.array_equal(frame, previous):
+                        break
+                    steps += 1
+                deadline = self.frame_deadline(steps / self.frequency)
+                if steps > 1:
+                    self.hold_until(deadline)
                 else:
-                    break
-                time.sleep(1/self.frequency)
+                    self.wait(deadline - time.time())
             # if self.repeat > 0:
             #     self.repeat -= 1
             # elif self.repeat == 0:
@@ -136,4 +160,5 @@ class MoodlightAnimation(AbstractAnimation):
     @property
     def kwargs(self):
         return {"width": self.width, "height": self.height,
-                "frame_queue": self.frame_queue, "repeat": self.repeat}
+                "frame_queue": self.frame_queue, "repeat": self.repeat,
+                "mode": self.mode}
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Color palettes compiled to lookup tables.
+
+A palette is a list of rgb colors. It is compiled once into a (size, 3)
+uint8 table (usually 256 or 4096 entries) that runs through the colors, and
+afterwards a color transition is only an index into that table. Compiled
+tables are shared and read-only.
+
+Colors can be interpolated in
+
+    "srgb"    the gamma encoded values (what a naive fade does, the middle
+              of a transition looks too dark)
+    "linear"  linear light, physically correct mixing
+    "oklab"   a perceptual space, transitions look even to the eye
+"""
+
+import threading
+
+import numpy as np
+
+SPACES = ("srgb", "linear", "oklab")
+
+# the hue wheel of hsv with full saturation and value
+RAINBOW = ((255, 0, 0), (255, 255, 0), (0, 255, 0), (0, 255, 255),
+           (0, 0, 255), (255, 0, 255))
+
+# OKLab, see https://bottosson.github.io/posts/oklab/
+_LINEAR_TO_LMS = np.array([[0.4122214708, 0.5363325363, 0.0514459929],
+                           [0.2119034982, 0.6806995451, 0.1073969566],
+                           [0.0883024619, 0.2817188376, 0.6299787005]])
+_LMS_TO_OKLAB = np.array([[0.2104542553, 0.7936177850, -0.0040720468],
+                          [1.9779984951, -2.4285922050, 0.4505937099],
+                          [0.0259040371, 0.7827717662, -0.8086757660]])
+_OKLAB_TO_LMS = np.linalg.inv(_LMS_TO_OKLAB)
+_LMS_TO_LINEAR = np.linalg.inv(_LINEAR_TO_LMS)
+
+
+def srgb_to_linear(rgb):
+    """(..., 3) values 0..255 to linear light 0..1"""
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(linear):
+    """Linear light 0..1 to (..., 3) values 0..255 (float)"""
+    c = np.clip(linear, 0, 1)
+    c = np.where(c <= 0.0031308, c * 12.92,
+                 1.055 * c ** (1 / 2.4) - 0.055)
+    return c * 255
+
+
+def linear_to_oklab(linear):
+    return np.cbrt(linear @ _LINEAR_TO_LMS.T) @ _LMS_TO_OKLAB.T
+
+
+def oklab_to_linear(lab):
+    return (lab @ _OKLAB_TO_LMS.T) ** 3 @ _LMS_TO_LINEAR.T
+
+
+def _encode(colors, space):
+    if space == "srgb":
+        return np.asarray(colors, dtype=np.float64)
+    linear = srgb_to_linear(colors)
+    return linear if space == "linear" else linear_to_oklab(linear)
+
+
+def _decode(values, space):
+    if space == "srgb":
+        return values
+    if space == "oklab":
+        values = oklab_to_linear(values)
+    return linear_to_srgb(values)
+
+
+def build(colors, size=256, space="oklab", cyclic=True):
+    """Compile colors into a (size, 3) uint8 table. The colors are spread
+    evenly over the table; a cyclic table returns to the first color at its
+    end, so that index size wraps around to index 0 without a jump."""
+    if space not in SPACES:
+        raise ValueError("Unknown color space {}".format(space))
+    colors = np.array(colors, dtype=np.float64).reshape(-1, 3)
+    if cyclic:
+        colors = np.concatenate((colors, colors[:1]))
+    if len(colors) == 1:
+        colors = np.concatenate((colors, colors))
+    stops = np.linspace(0, size if cyclic else size - 1, len(colors))
+    encoded = _encode(colors, space)
+    positions = np.arange(size)
+    values = np.stack([np.interp(positions, stops, encoded[:, c])
+                       for c in range(3)], axis=1)
+    return np.clip(_decode(values, space).round(), 0, 255).astype(np.uint8)
+
+
+_tables = {}
+_lock = threading.Lock()
+
+
+def compile_palette(colors, size=256, space="oklab", cyclic=True):
+    """Return the shared, read-only table of colors, building it on first
+    use"""
+    colors = tuple(tuple(int(v) for v in color) for color in colors)
+    key = (colors, size, space, cyclic)
+    with _lock:
+        table = _tables.get(key)
+    if table is None:
+        table = build(colors, size, space, cyclic)
+        table.flags.writeable = False
+        with _lock:
+            table = _tables.setdefault(key, table)
+    return table
+
+
+def wheel(size=256, space="srgb"):
+    """Hue wheel. In srgb this is exactly the hsv wheel."""
+    return compile_palette(RAINBOW, size, space, cyclic=True)
+
+
+def transition_indices(size, count, steps, hold):
+    """Indices into a cyclic table of count colors (of size entries) that
+    fade from every color to the next in steps and then stay hold steps on
+    the next color"""
+    segment = size / count
+    indices = []
+    for k in range(count):
+        start = k * segment
+        indices.extend(int(start + segment * (i + 1) / steps) % size
+                       for i in range(steps))
+        indices.extend([int(start + segment) % size] * hold)
+    return np.array(indices, dtype=np.intp)
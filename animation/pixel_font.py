@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bitmap pixel fonts (BDF and PCF) for small matrices.
+
+Outline fonts rendered down to 16 pixels are hard to read. Pixel fonts are
+drawn for exactly that size. A font is parsed once (with the parsers of
+Pillow, which cover the latin-1 range) into one packed array of glyph cells,
+and messages are composed from it without a loop over pixels.
+"""
+
+from pathlib import Path
+import threading
+
+import numpy as np
+from PIL import BdfFontFile, PcfFontFile
+
+PIXEL_FONT_SUFFIXES = (".bdf", ".pcf")
+
+
+def is_pixel_font(path):
+    return Path(str(path)).suffix.lower() in PIXEL_FONT_SUFFIXES
+
+
+class PixelFont():
+    def __init__(self, path):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            if self.path.suffix.lower() == ".pcf":
+                font = PcfFontFile.PcfFontFile(f)
+            else:
+                font = BdfFontFile.BdfFontFile(f)
+        glyphs = [(code, glyph) for code, glyph in enumerate(font.glyph)
+                  if glyph is not None]
+        if not glyphs:
+            raise AttributeError
+
+        # dst is the glyph box relative to the origin on the baseline, with
+        # y pointing down: (x0, -top, x1, bottom)
+        left = min(dst[0] for _, (_, dst, _, _) in glyphs)
+        right = max(dst[2] for _, (_, dst, _, _) in glyphs)
+        self.ascent = max(-dst[1] for _, (_, dst, _, _) in glyphs)
+        self.descent = max(dst[3] for _, (_, dst, _, _) in glyphs)
+        self.cell_left = left  # x offset of a cell relative to the pen
+        self.cell_width = right - left
+        self.cell_height = self.ascent + self.descent
+
+        # all glyphs packed into (256, cell_height, cell_width)
+        self.cells = np.zeros((256, self.cell_height, self.cell_width),
+                              dtype=bool)
+        self.advances = np.zeros((256,), dtype=np.int32)
+        self.present = np.zeros((256,), dtype=bool)
+        for code, (advance, dst, src, image) in glyphs:
+            bitmap = np.array(image, dtype=bool)
+            if bitmap.size:
+                top = self.ascent + dst[1]
+                x = dst[0] - left
+                self.cells[code, top:top+bitmap.shape[0],
+                           x:x+bitmap.shape[1]] = bitmap
+            self.advances[code] = advance[0]
+            self.present[code] = True
+
+    def __str__(self):
+        return "Pixel font: {} glyphs: {} cell: {}x{} ascent: {}\n".format(
+            self.path, int(self.present.sum()), self.cell_width,
+            self.cell_height, self.ascent)
+
+    def codes(self, text):
+        """Latin-1 codes of the characters of text the font can draw"""
+        codes = np.fromiter((ord(c) for c in text), dtype=np.int64,
+                            count=len(text))
+        codes = codes[codes < 256]
+        return codes[self.present[codes]]
+
+    def render(self, text, colors=((255, 255, 255),)):
+        """Render text to a (cell_height, width, 3) array with the baseline
+        at row ascent. colors is one rgb tuple per character (of the drawable
+        characters), repeated if shorter than text."""
+        codes = self.codes(text)
+        n = len(codes)
+        if n == 0:
+            return np.zeros((self.cell_height, 0, 3), dtype=np.uint8)
+
+        advances = self.advances[codes]
+        pens = np.concatenate(([0], np.cumsum(advances)[:-1]))
+        starts = pens + self.cell_left
+        offset = -min(0, int(starts.min()))
+        width = max(int(pens[-1] + advances[-1]),
+                    int(starts.max()) + self.cell_width) + offset
+
+        # label every pixel with the (1 based) index of the character that
+        # set it, glyph cells may overlap their neighbours
+        cells = self.cells[codes]  # (n, h, w)
+        labels = np.zeros((width, self.cell_height), dtype=np.int32)
+        columns = starts[:, np.newaxis] + offset + \
+            np.arange(self.cell_width)[np.newaxis, :]  # (n, w)
+        values = cells.transpose(0, 2, 1) * \
+            np.arange(1, n + 1, dtype=np.int32)[:, np.newaxis, np.newaxis]
+        np.maximum.at(labels, columns.ravel(),
+                      values.reshape(n * self.cell_width, self.cell_height))
+
+        palette = np.zeros((n + 1, 3), dtype=np.uint8)
+        colors = np.array(colors, dtype=np.uint8).reshape(-1, 3)
+        palette[1:] = colors[np.arange(n) % len(colors)]
+        return palette[labels.T]
+
+
+_fonts = {}
+_lock = threading.Lock()
+
+
+def load_pixel_font(path):
+    """Return the shared PixelFont of path, parsing it on first use"""
+    key = str(Path(path).resolve())
+    with _lock:
+        if key not in _fonts:
+            _fonts[key] = PixelFont(path)
+            print(_fonts[key])
+        return _fonts[key]
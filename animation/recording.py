@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Recordings of network streams (.rrec) and their playback.
+
+A recording is written frame by frame while the stream plays; only the
+previous frame and the keyframe index are kept in memory. All numbers are
+little endian.
+
+    header      "RIBBAREC", version, width, height (uint16 each)
+    records     kind (b"K" or b"D"), milliseconds since the start (uint32),
+                payload length (uint32), payload
+    index       "INDX", frames, duration in milliseconds, keyframes
+                (uint32 each), (milliseconds, file offset) per keyframe
+                (uint32, uint64)
+    trailer     file offset of the index (uint64), "RIBBAEND"
+
+A keyframe (K) holds the whole frame as rgb24. A delta (D) holds the runs
+of pixels that changed since the previous frame, every run as first pixel
+and pixel count (uint16 each) followed by its rgb24 values; an unchanged
+frame is a delta without runs. A keyframe is written at least every
+KEYFRAME_INTERVAL seconds, so seeking decodes at most that much. The index
+is written when the recording is closed; without it (the recording was
+cut off) the reader rebuilds it by scanning the records.
+
+Run python3 -m animation.recording for sizes and seek times.
+"""
+
+import bisect
+import struct
+import time
+import numpy as np
+from pathlib import Path
+
+from animation.abstract_animation import AbstractAnimation
+
+MAGIC = b"RIBBAREC"
+VERSION = 1
+HEADER = struct.Struct("<8sHHH")
+RECORD = struct.Struct("<cII")
+RUN = struct.Struct("<HH")
+INDEX_MAGIC = b"INDX"
+INDEX = struct.Struct("<4sIII")
+INDEX_ENTRY = struct.Struct("<IQ")
+TRAILER_MAGIC = b"RIBBAEND"
+TRAILER = struct.Struct("<Q8s")
+KEYFRAME = b"K"
+DELTA = b"D"
+KEYFRAME_INTERVAL = 2.0  # seconds
+
+
+def encode_delta(previous, frame):
+    """Runs of the pixels of frame that differ from previous. Runs that are
+    only one unchanged pixel apart are joined, that is shorter than a run
+    header."""
+    changed = np.any(previous != frame, axis=2).reshape(-1)
+    edges = np.flatnonzero(np.diff(changed, prepend=False, append=False))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts) > 1:
+        keep = starts[1:] - ends[:-1] > 1
+        starts = starts[np.concatenate(([True], keep))]
+        ends = ends[np.concatenate((keep, [True]))]
+    pixels = frame.reshape(-1, 3)
+    parts = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        parts.append(RUN.pack(start, end - start))
+        parts.append(pixels[start:end].tobytes())
+    return b"".join(parts)
+
+
+def apply_delta(frame, payload):
+    """Write the runs of a delta payload into frame"""
+    pixels = frame.reshape(-1, 3)
+    position = 0
+    while position < len(payload):
+        start, count = RUN.unpack_from(payload, position)
+        position += RUN.size
+        pixels[start:start + count] = np.frombuffer(
+            payload, dtype=np.uint8, count=count * 3,
+            offset=position).reshape(count, 3)
+        position += count * 3
+
+
+class RecordingWriter():
+    """Writes frames to a recording as they arrive"""
+    def __init__(self, path, width, height,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        if width * height > 0xFFFF:
+            raise ValueError("{}x{} is too large to record".format(width,
+                                                                   height))
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.keyframe_interval = keyframe_interval
+        self.file = self.path.open("wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, width, height))
+        self.previous = np.zeros((height, width, 3), dtype=np.uint8)
+        self.index = []  # (milliseconds, offset) of every keyframe
+        self.frames = 0
+        self.milliseconds = 0
+        self.bytes = HEADER.size
+
+    def write(self, frame, milliseconds):
+        """Append frame, shown milliseconds after the start"""
+        if frame.shape != self.previous.shape:
+            raise ValueError("frame of shape {} in a {}x{} recording".format(
+                frame.shape, self.width, self.height))
+        milliseconds = max(int(milliseconds), self.milliseconds)
+        keyframe = not self.index or milliseconds - self.index[-1][0] >= \
+            self.keyframe_interval * 1000
+        if not keyframe:
+            payload = encode_delta(self.previous, frame)
+            # a delta of almost every pixel is larger than the frame itself
+            keyframe = len(payload) >= frame.nbytes
+        if keyframe:
+            payload = frame.tobytes()
+            self.index.append((milliseconds, self.bytes))
+        self.file.write(RECORD.pack(KEYFRAME if keyframe else DELTA,
+                                    milliseconds, len(payload)))
+        self.file.write(payload)
+        self.bytes += RECORD.size + len(payload)
+        self.previous[:] = frame
+        self.frames += 1
+        self.milliseconds = milliseconds
+
+    def close(self):
+        index_offset = self.bytes
+        self.file.write(INDEX.pack(INDEX_MAGIC, self.frames,
+                                   self.milliseconds, len(self.index)))
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(index_offset, TRAILER_MAGIC))
+        self.file.close()
+
+
+class RecordingReader():
+    """Decodes a recording record by record. Frames are decoded into three
+    buffers in turn, so a frame handed out stays unchanged while the next
+    two are decoded."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = self.path.open("rb")
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("{} is no recording".format(self.path))
+        magic, version, self.width, self.height = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is no recording".format(self.path))
+        self.frame_bytes = self.width * self.height * 3
+        if not self.read_index():
+            self.scan()
+        self.buffers = np.zeros((3, self.height, self.width, 3),
+                                dtype=np.uint8)
+        self.buffer_index = 0
+        self.file.seek(HEADER.size)
+
+    def read_index(self):
+        size = self.path.stat().st_size
+        if size < HEADER.size + TRAILER.size:
+            return False
+        self.file.seek(size - TRAILER.size)
+        self.end, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+        if magic != TRAILER_MAGIC or self.end >= size:
+            return False
+        self.file.seek(self.end)
+        magic, self.frames, self.milliseconds, count = INDEX.unpack(
+            self.file.read(INDEX.size))
+        if magic != INDEX_MAGIC:
+            return False
+        entries = self.file.read(count * INDEX_ENTRY.size)
+        self.index = list(INDEX_ENTRY.iter_unpack(entries))
+        return True
+
+    def scan(self):
+        """Rebuild the index of a recording that was cut off"""
+        self.index = []
+        self.frames = 0
+        self.milliseconds = 0
+        offset = self.end = HEADER.size
+        self.file.seek(offset)
+        while True:
+            record = self.file.read(RECORD.size)
+            if len(record) < RECORD.size:
+                break
+            kind, milliseconds, length = RECORD.unpack(record)
+            if kind not in (KEYFRAME, DELTA) or \
+                    len(self.file.read(length)) < length:
+                break
+            if kind == KEYFRAME:
+                self.index.append((milliseconds, offset))
+            self.frames += 1
+            self.milliseconds = milliseconds
+            offset += RECORD.size + length
+            self.end = offset
+
+    def duration(self):
+        return self.milliseconds / 1000
+
+    def read(self):
+        """(seconds, frame) of the next record or None at the end"""
+        if self.file.tell() >= self.end:
+            return None
+        kind, milliseconds, length = RECORD.unpack(
+            self.file.read(RECORD.size))
+        payload = self.file.read(length)
+        frame = self.buffers[self.buffer_index]
+        if kind == KEYFRAME:
+            frame.reshape(-1)[:] = np.frombuffer(payload, dtype=np.uint8,
+                                                 count=self.frame_bytes)
+        else:
+            frame[:] = self.buffers[self.buffer_index - 1]
+            apply_delta(frame, payload)
+        self.buffer_index = (self.buffer_index + 1) % len(self.buffers)
+        return milliseconds / 1000, frame
+
+    def seek(self, seconds):
+        """Continue at the last frame shown at seconds, decoded from the
+        keyframe before it. Returns that (seconds, frame) or None if
+        seconds is past the end."""
+        milliseconds = int(seconds * 1000)
+        if milliseconds > self.milliseconds:
+            self.file.seek(self.end)
+            return None
+        i = bisect.bisect_right(self.index, (milliseconds, float("inf")))
+        self.file.seek(self.index[max(i - 1, 0)][1])
+        current = self.read()
+        while current is not None:
+            position = self.file.tell()
+            following = self.read()
+            if following is None or following[0] * 1000 > milliseconds:
+                # the frame after the one we want is decoded already
+                self.file.seek(position)
+                self.buffer_index = (self.buffer_index - 1) % \
+                    len(self.buffers)
+                return current
+            current = following
+        return current
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingAnimation(AbstractAnimation):
+    """Replays a recorded stream at its original timing. Frames are decoded
+    from the file while playing, memory use does not depend on the length
+    of the recording."""
+
+    def __init__(self, width, height, frame_queue, repeat, path, position=0):
+        super().__init__(width, height, frame_queue, repeat)
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError
+        self.name = "recording.{}".format(self.path.stem)
+
+        self.position = position  # seconds into the recording
+        self._seek_to = None
+
+        try:
+            self.reader = RecordingReader(self.path)
+        except (ValueError, struct.error):
+            raise AttributeError
+        if self.reader.width != width or self.reader.height != height or \
+                self.reader.frames == 0:
+            self.reader.close()
+            raise AttributeError
+
+        print(self)
+
+    def intrinsic_duration(self):
+        return self.reader.duration()
+
+    def __str__(self):
+        return "Path: {} file: {} frames: {} keyframes: {} duration: {:.1f}\n"\
+               "".format(self.path,
+                         self.name,
+                         self.reader.frames,
+                         len(self.reader.index),
+                         self.intrinsic_duration())
+
+    def seek(self, seconds):
+        """Continue playback at seconds into the recording"""
+        self._seek_to = max(0, seconds)
+
+    def animate(self):
+        try:
+            while self._running:
+                self.play(self.position)
+                self.position = 0
+                if self.repeat > 0:
+                    self.repeat -= 1
+                elif self.repeat == 0:
+                    self._running = False
+        finally:
+            self.reader.close()
+
+    def play(self, position):
+        current = self.reader.seek(position)
+        start = time.time() - position
+        while self._running and current is not None:
+            seconds, frame = current
+            self.frame_queue.put(frame)
+            self.position = seconds
+            current = self.reader.read()
+            if current is not None:
+                self.hold_until(start + current[0])
+            if self._seek_to is not None:
+                current = self.reader.seek(self._seek_to)
+                start = time.time() - self._seek_to
+                self._seek_to = None
+
+    @property
+    def kwargs(self):
+        return {"width": self.width, "height": self.height,
+                "frame_queue": self.frame_queue, "repeat": self.repeat,
+                "path": self.path, "position": self.position}
+
+
+def run_benchmark(width=16, height=16, seconds=120, fps=30):
+    """Size of recordings of a few effects compared to raw rgb and the time
+    to seek to random positions"""
+    import random
+    import tempfile
+    from animation import effects
+
+    path = Path(tempfile.mkdtemp()) / "benchmark.rrec"
+    frames = int(seconds * fps)
+    scenes = {"plasma": effects.Plasma(width, height),
+              "gradient": effects.Gradient(width, height, speed=0.1),
+              "sparse": None}
+    for name, effect in scenes.items():
+        writer = RecordingWriter(path, width, height)
+        sparse = np.zeros((height, width, 3), dtype=np.uint8)
+        encode = 0
+        for i in range(frames):
+            if effect is not None:
+                frame = effect.render(i / fps)
+            else:
+                # a few pixels change in every frame
+                sparse[np.random.randint(height, size=3),
+                       np.random.randint(width, size=3)] = \
+                    np.random.randint(256, size=3)
+                frame = sparse
+            start = time.perf_counter()
+            writer.write(frame, i * 1000 / fps)
+            encode += time.perf_counter() - start
+        writer.close()
+        reader = RecordingReader(path)
+        start = time.perf_counter()
+        while reader.read() is not None:
+            pass
+        decode = (time.perf_counter() - start) / frames
+        start = time.perf_counter()
+        for _ in range(100):
+            reader.seek(random.uniform(0, seconds))
+        seek = (time.perf_counter() - start) / 100
+        reader.close()
+        size = path.stat().st_size
+        print("{}x{} {:9} {} frames: {} bytes ({:.1%} of raw), write "
+              "{:.0f}us, read {:.0f}us per frame, seek {:.2f}ms".format(
+                  width, height, name, frames, size,
+                  size / (frames * width * height * 3),
+                  encode / frames * 1e6,
+                  decode * 1e6, seek * 1e3))
+    path.unlink()
+    path.parent.rmdir()
+
+
+if __name__ == "__main__":
+    # python3 -m animation.recording
+    run_benchmark(16, 16)
+    run_benchmark(32, 32)
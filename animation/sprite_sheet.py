@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Descriptor example (mario.ini):
+#
+# [sheet]
+# image = mario_sprite_sheet.png  ; relative to the descriptor
+#
+# [grid]
+# x = 96        ; pixel offset of the first cell
+# y = 32
+# width = 16    ; size of one cell
+# height = 16
+# columns = 4   ; cells per row, 0: as many as fit into the sheet
+#
+# [animation]
+# frames = 0, 1, 2, 1     ; cell indices counted row-wise, empty: all cells
+# hold = 80, 80, 80, 800  ; milliseconds, one value for all or one per frame
+# loop = true
+
+import numpy as np
+from PIL import Image
+
+import configparser
+from pathlib import Path
+
+from animation.abstract_animation import AbstractAnimation
+from animation import frame_cache
+
+
+class SpriteSheetAnimation(AbstractAnimation):
+    """Plays a sequence of cells of a sprite sheet.
+
+    The sheet is decoded (and scaled so that one cell has the size of the
+    matrix) only once and kept in the frame cache. Every frame is a view into
+    that array, so the number of cells does not influence decoding costs."""
+
+    def __init__(self, width, height, frame_queue, repeat, path):
+        super().__init__(width, height, frame_queue, repeat)
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError
+        self.name = "sprite.{}".format(self.path.stem)
+
+        self.read_descriptor()
+        self.load_frames()
+
+        if not self.loop:
+            self.repeat = 0
+
+        print(self)
+
+    def intrinsic_duration(self):
+        return sum(self.holds)/1000.0
+
+    def __str__(self):
+        return "Path: {} image: {} frames: {} cell: {}x{} at {},{} "\
+               "duration: {} sheet memory: {} bytes\n"\
+               "".format(self.path,
+                         self.image,
+                         len(self.frames),
+                         self.cell_width,
+                         self.cell_height,
+                         self.x,
+                         self.y,
+                         self.intrinsic_duration(),
+                         self.sheet.nbytes)
+
+    def read_descriptor(self):
+        parser = configparser.ConfigParser(inline_comment_prefixes=(";",))
+        parser.read(str(self.path))
+        image = parser.get('sheet', 'image', fallback=None)
+        if not image:
+            raise AttributeError
+        self.image = self.path.parent.joinpath(image)
+        if not self.image.is_file():
+            raise FileNotFoundError
+        self.x = parser.getint('grid', 'x', fallback=0)
+        self.y = parser.getint('grid', 'y', fallback=0)
+        self.cell_width = parser.getint('grid', 'width', fallback=self.width)
+        self.cell_height = parser.getint('grid', 'height',
+                                         fallback=self.height)
+        self.columns = parser.getint('grid', 'columns', fallback=0)
+        self.order = [int(i) for i in
+                      parser.get('animation', 'frames', fallback='').split(',')
+                      if i.strip()]
+        self.holds = [int(i) for i in
+                      parser.get('animation', 'hold', fallback='100').split(',')
+                      if i.strip()]
+        self.loop = parser.getboolean('animation', 'loop', fallback=True)
+        if self.cell_width <= 0 or self.cell_height <= 0 or not self.holds:
+            raise AttributeError
+
+    def load_sheet(self):
+        """Decode the sheet and scale it so one cell is one matrix frame"""
+        with Image.open(str(self.image)) as image:
+            if image.mode == "RGBA":
+                background = Image.new("RGB", image.size, (0, 0, 0))
+                background.paste(image, mask=image.split()[3])
+                image = background
+            else:
+                image = image.convert("RGB")
+        scale_x = self.width / self.cell_width
+        scale_y = self.height / self.cell_height
+        if scale_x != 1 or scale_y != 1:
+            size = (round(image.size[0] * scale_x),
+                    round(image.size[1] * scale_y))
+            image = image.resize(size, Image.NEAREST if scale_x >= 1 and
+                                 scale_y >= 1 else Image.BOX)
+        return np.ascontiguousarray(np.asarray(image))
+
+    def load_frames(self):
+        key = ("sprite", str(self.image.resolve()),
+               self.image.stat().st_mtime, self.width, self.height,
+               self.cell_width, self.cell_height)
+        self.sheet = frame_cache.cached(key, self.load_sheet)
+
+        # grid origin in the coordinates of the scaled sheet
+        x0 = round(self.x * self.width / self.cell_width)
+        y0 = round(self.y * self.height / self.cell_height)
+        (h, w, b) = self.sheet.shape
+        columns = self.columns or (w - x0) // self.width
+        rows = (h - y0) // self.height
+        if columns <= 0 or rows <= 0:
+            raise AttributeError
+
+        order = self.order or list(range(columns * rows))
+        self.frames = []
+        for index in order:
+            row, column = divmod(index, columns)
+            top = y0 + row * self.height
+            left = x0 + column * self.width
+            if top + self.height > h or left + self.width > w:
+                raise AttributeError
+            self.frames.append(self.sheet[top:top+self.height,
+                                          left:left+self.width, :])
+
+        if len(self.holds) < len(self.frames):
+            self.holds = self.holds + \
+                [self.holds[-1]] * (len(self.frames) - len(self.holds))
+        # holds without a frame are never played
+        self.holds = self.holds[:len(self.frames)]
+
+    def animate(self):
+        while self._running:
+            for frame, hold in zip(self.frames, self.holds):
+                if self._running:
+                    # a view into the sheet, nothing writes to frames taken
+                    # from the queue, so it needs no copy
+                    self.frame_queue.put(frame)
+                else:
+                    break
+                self.hold_until(self.frame_deadline(hold/1000))
+            if self.repeat > 0:
+                self.repeat -= 1
+            elif self.repeat == 0:
+                self._running = False
+
+    @property
+    def kwargs(self):
+        return {"width": self.width, "height": self.height,
+                "frame_queue": self.frame_queue, "repeat": self.repeat,
+                "path": self.path}
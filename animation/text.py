@@ -16,15 +16,47 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import freetype
+# freetype is used through animation.font_cache
 # to install on mac: brew install freetype
 #                    pip3 install freetype-py
 #                    freetype-py > 1.0.2 needed for emoji to work. see github.
+from collections import OrderedDict
 import numpy as np
-from PIL import Image
+import threading
 import time
 
 from animation.abstract_animation import AbstractAnimation
+from animation.font_cache import face_pool, glyph_cache, unpack_mono_bitmap
+from animation.emoji_atlas import load_atlas
+from animation.pixel_font import is_pixel_font, load_pixel_font
+
+
+class StripCache():
+    """The most recently rendered scroll strips, so repeated messages do not
+    have to be rendered again"""
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._strips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, key, render):
+        with self._lock:
+            if key in self._strips:
+                self._strips.move_to_end(key)
+                return self._strips[key]
+        strip = render()
+        with self._lock:
+            self._strips[key] = strip
+            while len(self._strips) > self.max_entries:
+                self._strips.popitem(last=False)
+        return strip
+
+    def clear(self):
+        with self._lock:
+            self._strips.clear()
+
+
+strip_cache = StripCache()
 
 
 class TextAnimation(AbstractAnimation):
@@ -32,7 +64,8 @@ class TextAnimation(AbstractAnimation):
                  steps_per_second=15, pixels_per_step=1, text_size=16,
                  emoji_size=20,
                  text_font="resources/fonts/SFCompactDisplay-Regular.otf",
-                 emoji_font="resources/fonts/Apple Color Emoji.ttc"):
+                 emoji_font="resources/fonts/Apple Color Emoji.ttc",
+                 color=None, baseline=None):
         super().__init__(width, height, frame_queue, repeat)
 
         self.name = "text"
@@ -42,156 +75,167 @@ class TextAnimation(AbstractAnimation):
         self.steps_per_second = steps_per_second
         self.pixels_per_step = pixels_per_step
 
-        self.text_face = freetype.Face(text_font)
-        self.emoji_face = freetype.Face(emoji_font)
-
-        self.text_face.set_char_size(self.text_size * 64)
-        self.emoji_face.set_char_size(self.emoji_size * 64)
-        np.set_printoptions(threshold=np.nan, linewidth=300)
+        self.text_font = text_font
+        self.emoji_font = emoji_font
+        # None: white, an rgb tuple or a list of rgb tuples, one for each
+        # character (repeated if shorter than text)
+        self.color = color
+        # row of the display the bottom of the letters (without descenders)
+        # sits on, None: center vertically
+        self.baseline = baseline
+        self.pixel_font = load_pixel_font(text_font) \
+            if is_pixel_font(text_font) else None
+        # pre-rendered emoji replace the emoji font if they are available
+        self.emoji_atlas = load_atlas(self.text_size)
+        self.time_to_first_frame = None
 
-    def __del__(self):
-        del self.text_face
-        del self.emoji_face
-
-    def render(self, text):
+    def layout(self, text):
+        """Place every drawable character of text. Returns a list of
+        (x, y, image) in coordinates with y pointing up, where image is a
+        (rows, width) mono bitmap or a (rows, width, 3) color glyph, and the
+        bounding box (xmin, xmax, ymin, ymax) of all of them."""
         xmin, xmax = 0, 0
         ymin, ymax = 0, 0
         previous = 0
         pen_x, pen_y = 0, 0
-        # first pass
+        placed = []
         for c in text:
-            if self.text_face.get_char_index(c):
-                self.text_face.load_char(c, freetype.FT_LOAD_RENDER | freetype.FT_LOAD_TARGET_MONO)
-                kerning = self.text_face.get_kerning(previous, c)
+            if glyph_cache.has_char(self.text_font, self.text_size, c):
+                glyph = glyph_cache.glyph(self.text_font, self.text_size, c)
+                pen_x += glyph_cache.kerning(self.text_font, self.text_size,
+                                             previous, c)
                 previous = c
-                bitmap = self.text_face.glyph.bitmap
-                width = self.text_face.glyph.bitmap.width
-                rows = self.text_face.glyph.bitmap.rows
-                top = self.text_face.glyph.bitmap_top
-                left = self.text_face.glyph.bitmap_left
-                pen_x += (kerning.x >> 6)
-                x0 = pen_x + left
-                x1 = x0 + width
-                y0 = pen_y - (rows - top)
-                y1 = y0 + rows
-                xmin, xmax = min(xmin, x0),  max(xmax, x1)
-                ymin, ymax = min(ymin, y0), max(ymax, y1)
-                pen_x += (self.text_face.glyph.advance.x >> 6)
-                pen_y += (self.text_face.glyph.advance.y >> 6)
-                # print("char: {} width: {} rows: {} top: {} left: {} kernx: {} xmin: {} xmax: {} ymin: {} ymax: {} pen_x: {} pen_y {}".format(c, width, rows, top, left, (kerning.x >> 6), xmin, xmax, ymin, ymax, pen_x, pen_y))
-            elif self.emoji_face.get_char_index(c):
-                kerning = 0
+                image = glyph.bitmap
+                left, top = glyph.left, glyph.top
+                advance_x, advance_y = glyph.advance_x, glyph.advance_y
+            else:
+                image = self.get_color_char(c)
+                if image is None:
+                    continue
                 previous = 0
-                width = self.text_size
-                rows = self.text_size
-                top = self.text_size - 3
-                left = 0
-                pen_x += kerning
-                x0 = pen_x + left
-                x1 = x0 + width
-                y0 = pen_y - (rows - top)
-                y1 = y0 + rows
-                xmin, xmax = min(xmin, x0),  max(xmax, x1)
-                ymin, ymax = min(ymin, y0), max(ymax, y1)
-                pen_x += self.text_size
+                left, top = 0, self.text_size - 3
+                advance_x, advance_y = self.text_size, 0
+            rows, width = image.shape[:2]
+            x0 = pen_x + left
+            y0 = pen_y - (rows - top)
+            xmin, xmax = min(xmin, x0), max(xmax, x0 + width)
+            ymin, ymax = min(ymin, y0), max(ymax, y0 + rows)
+            if image.ndim == 2 and self.color is not None:
+                color = self.char_color(len(placed))
+                image = np.where(image[:, :, np.newaxis], color, 0).astype(
+                    np.uint8)
+            placed.append((x0, y0, image))
+            pen_x += advance_x
+            pen_y += advance_y
+        return placed, (xmin, xmax, ymin, ymax)
 
-        L = np.zeros((ymax-ymin, xmax-xmin, 3), dtype=np.uint8)
+    def char_color(self, i):
+        """Color of the ith drawable character"""
+        colors = self.color
+        if colors is None:
+            return (255, 255, 255)
+        if len(colors) and not isinstance(colors[0], (tuple, list)):
+            return tuple(colors)
+        return tuple(colors[i % len(colors)])
 
-        # second pass
-        previous = 0
-        pen_x, pen_y = 0, 0
-        for c in text:
-            if self.text_face.get_char_index(c):
-                self.text_face.load_char(c,
-                                         freetype.FT_LOAD_RENDER |
-                                         freetype.FT_LOAD_TARGET_MONO)
-                kerning = self.text_face.get_kerning(previous, c)
-                previous = c
-                bitmap = self.text_face.glyph.bitmap
-                width = self.text_face.glyph.bitmap.width
-                rows = self.text_face.glyph.bitmap.rows
-                top = self.text_face.glyph.bitmap_top
-                left = self.text_face.glyph.bitmap_left
-                pen_x += (kerning.x >> 6)
-                x = pen_x - xmin + left
-                y = pen_y - ymin - (rows - top)
-                Z = self.unpack_mono_bitmap(bitmap)
-                # Z = np.array(bitmap.buffer, dtype=np.uint8).reshape(rows,
-                #                                                     width)
-                Z = np.repeat(Z, 3, axis=1).reshape(rows, width, 3)
-                L[y:y+rows, x:x+width] |= Z[::-1, ::1]
-
-                pen_x += (self.text_face.glyph.advance.x >> 6)
-                pen_y += (self.text_face.glyph.advance.y >> 6)
-            elif self.emoji_face.get_char_index(c):
-                kerning = 0
-                previous = 0
-                width = self.text_size
-                rows = self.text_size
-                top = self.text_size - 3
-                left = 0
-                pen_x += kerning
-                x = pen_x - xmin + left
-                y = pen_y - ymin - (rows - top)
-                Z = self.get_color_char(c)
-                L[y:y+rows, x:x+width] |= Z[::-1, ::1]
-                pen_x += self.text_size
-        return L[::-1, ::1]
+    def render(self, text):
+        return self.render_with_ascent(text)[0]
+
+    def render_with_ascent(self, text):
+        """Render text. Returns the image and the number of rows above the
+        baseline."""
+        if self.pixel_font is not None:
+            codes = self.pixel_font.codes(text)
+            colors = [self.char_color(i) for i in range(max(1, len(codes)))]
+            return self.pixel_font.render(text, colors), \
+                self.pixel_font.ascent
+
+        placed, (xmin, xmax, ymin, ymax) = self.layout(text)
+        L = np.zeros((ymax-ymin, xmax-xmin, 3), dtype=np.uint8)
+        for x0, y0, image in placed:
+            rows, width = image.shape[:2]
+            x = x0 - xmin
+            y = y0 - ymin
+            if image.ndim == 2:
+                image = image[:, :, np.newaxis]
+            L[y:y+rows, x:x+width] |= image[::-1, ::1]
+        return L[::-1, ::1], ymax
 
     @staticmethod
     def unpack_mono_bitmap(bitmap):
-        data = bytearray(bitmap.rows * bitmap.width)
-
-        for y in range(bitmap.rows):
-            for byte_index in range(bitmap.pitch):
-                byte_value = bitmap.buffer[y * bitmap.pitch + byte_index]
-                num_bits_done = byte_index * 8
-                rowstart = y * bitmap.width + byte_index * 8
-                for bit_index in range(min(8, bitmap.width - num_bits_done)):
-                    bit = byte_value & (1 << (7 - bit_index))
-                    data[rowstart + bit_index] = 255 if bit else 0
-        return np.array(data).reshape(bitmap.rows, bitmap.width)
+        return unpack_mono_bitmap(bitmap)
 
     def get_color_char(self, char):
-        self.emoji_face.load_char(char, freetype.FT_LOAD_COLOR)
-        bitmap = self.emoji_face.glyph.bitmap
-        bitmap = np.array(bitmap.buffer, dtype=np.uint8).reshape((bitmap.rows,
-                                                                  bitmap.width,
-                                                                  4))
-        rgb = self.convert_bgra_to_rgb(bitmap)
-        im = Image.fromarray(rgb)
-        im = im.resize((self.text_size, self.text_size))
-        return np.array(im)
-
-    def convert_bgra_to_rgb(self, buf):
-        blue = buf[:, :, 0]
-        green = buf[:, :, 1]
-        red = buf[:, :, 2]
-        return np.dstack((red, green, blue))
+        """Image of an emoji scaled to text_size or None if char is no
+        emoji"""
+        if self.emoji_atlas is not None:
+            return self.emoji_atlas.get(char)
+        # the emoji face is only opened when the first character missing in
+        # the text font shows up
+        if glyph_cache.has_char(self.emoji_font, self.emoji_size, char):
+            try:
+                return glyph_cache.color_glyph(self.emoji_font,
+                                               self.emoji_size, char,
+                                               self.text_size)
+            except ValueError:
+                pass
+        return None
+
+    def strip_key(self):
+        color = self.color
+        if color is not None:
+            color = tuple(tuple(c) if isinstance(c, (tuple, list)) else c
+                          for c in color)
+        return (self.text, self.text_font, self.text_size, self.emoji_font,
+                self.emoji_size, self.width, self.height,
+                self.pixels_per_step, color, self.baseline)
+
+    def render_strip(self):
+        """Render text padded so that it scrolls in from the right and out to
+        the left, vertically centered or with the baseline on row
+        baseline"""
+        buf, ascent = self.render_with_ascent(self.text)
+        height, width, nbytes = buf.shape
+        h_pad_0 = self.height
+        h_pad_1 = self.width + self.pixels_per_step
+        v_pad_0 = 0
+        v_pad_1 = 0
+        if self.baseline is not None:
+            v_pad_0 = self.baseline + 1 - ascent
+            if v_pad_0 < 0:
+                buf = buf[-v_pad_0:]
+                height = buf.shape[0]
+                v_pad_0 = 0
+            v_pad_1 = max(0, self.height - height - v_pad_0)
+        elif height < self.height:
+            v_pad_0 = int((self.height - height)/2)
+            v_pad_1 = self.height - height - v_pad_0
+
+        buf = np.pad(buf, ((v_pad_0, v_pad_1), (h_pad_0, h_pad_1), (0, 0)),
+                     'constant', constant_values=0)
+        # frames are views into the strip, which is shared through the cache
+        buf.flags.writeable = False
+        return buf
+
+    def prerender(self):
+        """Render the scroll strip into the strip cache"""
+        return strip_cache.cached(self.strip_key(), self.render_strip)
 
     def animate(self):
         if self._running:
             if self.steps_per_second <= 0 or self.pixels_per_step < 1:
                 return
-            buf = self.render(self.text)
-            height, width, nbytes = buf.shape
-            h_pad_0 = self.height
-            h_pad_1 = self.width + self.pixels_per_step
-            v_pad_0 = 0
-            v_pad_1 = 0
-            if height < self.height:
-                v_pad_0 = int((self.height - height)/2)
-                v_pad_1 = self.height - height - v_pad_0
-
-            buf = np.pad(buf, ((v_pad_0, v_pad_1), (h_pad_0, h_pad_1), (0, 0)),
-                         'constant', constant_values=0)
+            buf = self.prerender()
             wait = 1.0 / self.steps_per_second
 
             for i in range(0, buf.shape[1] - self.width, self.pixels_per_step):
                 if not self._running:
                     break
-                cut = buf[0:self.height, i:i+self.width, :]
-                self.frame_queue.put(cut.copy())
+                self.frame_queue.put(buf[0:self.height, i:i+self.width, :])
+                if self.time_to_first_frame is None:
+                    self.time_to_first_frame = time.time() - self.started
+                    print("{}: first frame after {:.1f}ms".format(
+                        self.name, self.time_to_first_frame * 1000))
                 time.sleep(wait)
 
     @property
@@ -201,4 +245,56 @@ class TextAnimation(AbstractAnimation):
                 "text": self.text, "steps_per_second": self.steps_per_second,
                 "pixels_per_step": self.pixels_per_step,
                 "text_size": self.text_size, "emoji_size": self.emoji_size,
-                "text_font": self.text_font, "emoji_font": self.emoji_font}
+                "text_font": self.text_font, "emoji_font": self.emoji_font,
+                "color": self.color, "baseline": self.baseline}
+
+
+def run_benchmark(text_font, emoji_font, repeat=20):
+    """Time to first frame of a text message when the fonts still have to be
+    opened and when the face pool is already warm, and rendering of a
+    typical and a long message with an empty and a warm glyph cache."""
+    import queue
+    for label in ("cold", "warm"):
+        if label == "cold":
+            face_pool.clear()
+            glyph_cache.clear()
+            strip_cache.clear()
+        frame_queue = queue.Queue()
+        start = time.time()
+        animation = TextAnimation(16, 16, frame_queue, False, "RibbaPi",
+                                  text_font=text_font, emoji_font=emoji_font)
+        animation.start()
+        frame_queue.get()
+        print("time to first frame, {} font pool: {:.2f}ms, faces opened "
+              "so far: {}".format(label, (time.time() - start) * 1000,
+                                  face_pool.opened))
+        animation.stop()
+        animation.join()
+
+    messages = {"typical": "RibbaPi 👍",
+                "long": "The quick brown fox jumps over the lazy dog. " * 8}
+    for label, message in messages.items():
+        glyph_cache.clear()
+        animation = TextAnimation(16, 16, None, False, message,
+                                  text_font=text_font, emoji_font=emoji_font)
+        start = time.time()
+        animation.render(message)
+        cold = time.time() - start
+        start = time.time()
+        for _ in range(repeat):
+            animation.render(message)
+        warm = (time.time() - start) / repeat
+        print("{}: {} chars, cold {:.2f}ms, warm {:.2f}ms, glyph cache "
+              "hits {} misses {}".format(label, len(message), cold * 1000,
+                                         warm * 1000, glyph_cache.hits,
+                                         glyph_cache.misses))
+
+
+if __name__ == "__main__":
+    # python3 -m animation.text [text_font [emoji_font]]
+    import sys
+    text_font = sys.argv[1] if len(sys.argv) > 1 else \
+        "resources/fonts/SFCompactDisplay-Regular.otf"
+    emoji_font = sys.argv[2] if len(sys.argv) > 2 else \
+        "resources/fonts/Apple Color Emoji.ttc"
+    run_benchmark(text_font, emoji_font)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded, prioritized queue of pending text messages.
+
+Messages wait here from the moment they arrive until they are displayed.
+Higher priorities are shown first, messages of equal priority in order of
+arrival. A message that is identical to one still pending is merged into it,
+messages can expire, and once capacity messages are pending the drop policy
+decides what to give up:
+
+    "lowest"  drop the oldest message of the lowest priority, unless the new
+              message has an even lower priority
+    "oldest"  drop the oldest pending message
+    "newest"  reject the new message
+
+Only messages marked ready (rendered) are handed out by get().
+"""
+
+import itertools
+import threading
+import time
+
+DROP_POLICIES = ("lowest", "oldest", "newest")
+
+
+def message_key(options):
+    """Hashable identity of a message, used to find duplicates"""
+    return tuple(sorted((k, repr(v)) for k, v in options.items()))
+
+
+class TextMessage():
+    def __init__(self, options, priority, expires, sequence):
+        self.options = options  # TextAnimation kwargs including text
+        self.priority = priority
+        self.expires = expires  # time.time() based or None
+        self.arrived = time.time()
+        self.sequence = sequence
+        self.key = message_key(options)
+        self.ready = False
+        self.dropped = False
+
+    def __repr__(self):
+        return "TextMessage({!r}, priority={})".format(
+            self.options.get("text"), self.priority)
+
+
+class TextScheduler():
+    def __init__(self, capacity=16, drop_policy="lowest", default_ttl=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError("Unknown drop policy {}".format(drop_policy))
+        self.capacity = capacity
+        self.drop_policy = drop_policy
+        self.default_ttl = default_ttl  # seconds or None: never expire
+        self._pending = []
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+        self.accepted = 0
+        self.coalesced = 0
+        self.dropped_capacity = 0
+        self.dropped_expired = 0
+        self.delivered = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _drop(self, message):
+        message.dropped = True
+        self._pending.remove(message)
+
+    def _expire(self, now):
+        for message in [m for m in self._pending
+                        if m.expires is not None and m.expires < now]:
+            self._drop(message)
+            self.dropped_expired += 1
+
+    def put(self, options, priority=0, ttl=None):
+        """Add a message. Returns the TextMessage that will carry it (an
+        already pending one if the message is a duplicate) or None if it was
+        dropped."""
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        expires = now + ttl if ttl is not None else None
+        key = message_key(options)
+        with self._lock:
+            self._expire(now)
+            for message in self._pending:
+                if message.key == key:
+                    message.priority = max(message.priority, priority)
+                    if message.expires is not None:
+                        message.expires = None if expires is None else \
+                            max(message.expires, expires)
+                    self.coalesced += 1
+                    return message
+
+            if len(self._pending) >= self.capacity:
+                if self.drop_policy == "newest":
+                    victim = None
+                elif self.drop_policy == "oldest":
+                    victim = min(self._pending, key=lambda m: m.sequence)
+                else:
+                    victim = min(self._pending,
+                                 key=lambda m: (m.priority, m.sequence))
+                    if victim.priority > priority:
+                        victim = None
+                self.dropped_capacity += 1
+                if victim is None:
+                    print("Text queue full, dropped {!r}".format(
+                        options.get("text")))
+                    return None
+                print("Text queue full, dropped {!r}".format(victim))
+                self._drop(victim)
+
+            message = TextMessage(options, priority, expires,
+                                  next(self._sequence))
+            self._pending.append(message)
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, len(self._pending))
+            return message
+
+    def mark_ready(self, message):
+        with self._lock:
+            message.ready = True
+
+    def discard(self, message):
+        """Remove a message that can not be displayed (e.g. failed to
+        render)"""
+        with self._lock:
+            if message in self._pending:
+                self._drop(message)
+
+    def _next(self):
+        ready = [m for m in self._pending if m.ready]
+        if not ready:
+            return None
+        return min(ready, key=lambda m: (-m.priority, m.sequence))
+
+    def empty(self):
+        """True if no message is ready to be displayed"""
+        with self._lock:
+            self._expire(time.time())
+            return self._next() is None
+
+    def get(self):
+        """Return the options of the next ready message or None"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            message = self._next()
+            if message is None:
+                return None
+            self._pending.remove(message)
+            wait = now - message.arrived
+            self.delivered += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            return message.options
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        with self._lock:
+            return {"depth": len(self._pending),
+                    "ready": sum(1 for m in self._pending if m.ready),
+                    "max_depth": self.max_depth,
+                    "capacity": self.capacity,
+                    "accepted": self.accepted,
+                    "coalesced": self.coalesced,
+                    "dropped_capacity": self.dropped_capacity,
+                    "dropped_expired": self.dropped_expired,
+                    "delivered": self.delivered,
+                    "mean_wait": self.total_wait / self.delivered
+                    if self.delivered else 0.0,
+                    "max_wait": self.max_wait}
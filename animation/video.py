@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Supported files
+#
+# .rgb  headerless rgb24 frames. Size and frame rate are read from an ini file
+#       with the same stem (clip.rgb -> clip.ini), falling back to matrix size
+#       and DEFAULT_FPS:
+#           [video]
+#           width = 16
+#           height = 16
+#           fps = 25
+#       ffmpeg -i in.mp4 -vf scale=16:16 -r 25 -f rawvideo -pix_fmt rgb24 clip.rgb
+#
+# .y4m  YUV4MPEG2 with 4:4:4, 4:2:0 or mono planes.
+#       ffmpeg -i in.mp4 -vf scale=16:16 -r 25 -pix_fmt yuv444p clip.y4m
+
+import configparser
+import time
+import numpy as np
+from pathlib import Path
+
+from animation.abstract_animation import AbstractAnimation
+
+DEFAULT_FPS = 25
+Y4M_MAGIC = b"YUV4MPEG2 "
+Y4M_FRAME = b"FRAME\n"
+
+
+class VideoAnimation(AbstractAnimation):
+    """Plays long raw video clips by memory mapping the file.
+
+    Frames are never loaded as a whole: every frame is read through the
+    mapping when it is due, so memory use does not depend on the length of
+    the clip. Raw rgb frames are handed to the frame queue as read-only views
+    into the mapping. The frame to show is derived from the elapsed time, so
+    late frames are skipped instead of slowing the clip down."""
+
+    def __init__(self, width, height, frame_queue, repeat, path, position=0):
+        super().__init__(width, height, frame_queue, repeat)
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError
+        self.name = "video.{}".format(self.path.stem)
+
+        self.position = position  # seconds into the clip
+        self._seek_to = None
+
+        if self.path.suffix.lower() == ".y4m":
+            self.open_y4m()
+        else:
+            self.open_rgb()
+        if self.frame_count == 0:
+            raise AttributeError
+
+        print(self)
+
+    def intrinsic_duration(self):
+        return self.frame_count / self.fps
+
+    def __str__(self):
+        return "Path: {} file: {} format: {} frames: {} size: {}x{} fps: {} "\
+               "duration: {:.1f}\n"\
+               "".format(self.path,
+                         self.name,
+                         self.format,
+                         self.frame_count,
+                         self.video_width,
+                         self.video_height,
+                         self.fps,
+                         self.intrinsic_duration())
+
+    def read_sidecar(self):
+        self.video_width = self.width
+        self.video_height = self.height
+        self.fps = DEFAULT_FPS
+        config = self.path.with_suffix(".ini")
+        if config.is_file():
+            parser = configparser.ConfigParser()
+            parser.read(str(config))
+            self.video_width = parser.getint('video', 'width',
+                                             fallback=self.width)
+            self.video_height = parser.getint('video', 'height',
+                                              fallback=self.height)
+            self.fps = parser.getfloat('video', 'fps', fallback=DEFAULT_FPS)
+
+    def open_rgb(self):
+        self.format = "rgb24"
+        self.read_sidecar()
+        self.check_size()
+        frame_bytes = self.video_width * self.video_height * 3
+        self.frame_count = self.path.stat().st_size // frame_bytes
+        if self.frame_count == 0:
+            return
+        self.frames = np.memmap(str(self.path), dtype=np.uint8, mode='r',
+                                shape=(self.frame_count,
+                                       self.video_height,
+                                       self.video_width, 3))
+        top, left = self.crop_offsets()
+        self.frames = self.frames[:, top:top+self.height,
+                                  left:left+self.width, :]
+
+    def open_y4m(self):
+        with self.path.open('rb') as f:
+            header = f.readline()
+            frame_header = f.read(len(Y4M_FRAME))
+        if not header.startswith(Y4M_MAGIC) or frame_header != Y4M_FRAME:
+            # per frame parameters are not supported
+            raise AttributeError
+
+        self.fps = DEFAULT_FPS
+        colorspace = "420jpeg"
+        for token in header[len(Y4M_MAGIC):].decode("ascii").split():
+            if token[0] == "W":
+                self.video_width = int(token[1:])
+            elif token[0] == "H":
+                self.video_height = int(token[1:])
+            elif token[0] == "F":
+                numerator, denominator = token[1:].split(":")
+                self.fps = int(numerator) / int(denominator)
+            elif token[0] == "C":
+                colorspace = token[1:]
+        self.check_size()
+        self.format = "y4m " + colorspace
+
+        luma = self.video_width * self.video_height
+        if colorspace.startswith("444"):
+            self.subsampling = 1
+            chroma = luma
+        elif colorspace.startswith("420"):
+            self.subsampling = 2
+            chroma = ((self.video_width + 1) // 2) * \
+                ((self.video_height + 1) // 2)
+        elif colorspace.startswith("mono"):
+            self.subsampling = 0
+            chroma = 0
+        else:
+            raise AttributeError
+        self.plane_sizes = (luma, chroma)
+
+        record = len(Y4M_FRAME) + luma + 2 * chroma
+        self.frame_count = \
+            (self.path.stat().st_size - len(header)) // record
+        if self.frame_count == 0:
+            return
+        self.frames = np.memmap(str(self.path), dtype=np.uint8, mode='r',
+                                offset=len(header),
+                                shape=(self.frame_count, record))
+        # the converted frames rotate through these buffers, so a frame can
+        # still be on display while the next one is written
+        self.rgb_buffers = np.zeros((3, self.height, self.width, 3),
+                                    dtype=np.uint8)
+        self.rgb_buffer_index = 0
+
+    def check_size(self):
+        if self.video_width < self.width or self.video_height < self.height:
+            raise AttributeError
+
+    def crop_offsets(self):
+        """Larger videos are cropped to the center of the matrix"""
+        return ((self.video_height - self.height) // 2,
+                (self.video_width - self.width) // 2)
+
+    def frame(self, index):
+        if self.format == "rgb24":
+            return self.frames[index]
+        return self.y4m_to_rgb(index)
+
+    def y4m_to_rgb(self, index):
+        luma, chroma = self.plane_sizes
+        record = self.frames[index]
+        offset = len(Y4M_FRAME)
+        top, left = self.crop_offsets()
+        window = (slice(top, top+self.height), slice(left, left+self.width))
+
+        y = record[offset:offset+luma].reshape(self.video_height,
+                                               self.video_width)[window]
+        y = (y.astype(np.float32) - 16) * 1.164
+        if self.subsampling:
+            planes = []
+            for i in range(2):
+                start = offset + luma + i * chroma
+                plane = record[start:start+chroma]
+                if self.subsampling == 2:
+                    plane = plane.reshape((self.video_height + 1) // 2,
+                                          (self.video_width + 1) // 2)
+                    plane = plane.repeat(2, axis=0).repeat(2, axis=1)
+                    plane = plane[:self.video_height, :self.video_width]
+                else:
+                    plane = plane.reshape(self.video_height, self.video_width)
+                planes.append(plane[window].astype(np.float32) - 128)
+            u, v = planes
+        else:
+            u = v = np.zeros_like(y)
+
+        # ITU-R BT.601, limited range
+        rgb = self.rgb_buffers[self.rgb_buffer_index]
+        self.rgb_buffer_index = \
+            (self.rgb_buffer_index + 1) % len(self.rgb_buffers)
+        rgb[:, :, 0] = np.clip(y + 1.596 * v, 0, 255)
+        rgb[:, :, 1] = np.clip(y - 0.392 * u - 0.813 * v, 0, 255)
+        rgb[:, :, 2] = np.clip(y + 2.017 * u, 0, 255)
+        return rgb
+
+    def seek(self, seconds):
+        """Continue playback at seconds into the clip"""
+        self._seek_to = max(0, seconds)
+
+    def animate(self):
+        while self._running:
+            start = time.time() - self.position
+            while self._running:
+                if self._seek_to is not None:
+                    start = time.time() - self._seek_to
+                    self._seek_to = None
+                index = int((time.time() - start) * self.fps)
+                if index >= self.frame_count:
+                    break
+                self.frame_queue.put(self.frame(index))
+                self.position = index / self.fps
+                delay = start + (index + 1) / self.fps - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            self.position = 0
+            if self.repeat > 0:
+                self.repeat -= 1
+            elif self.repeat == 0:
+                self._running = False
+
+    @property
+    def kwargs(self):
+        return {"width": self.width, "height": self.height,
+                "frame_queue": self.frame_queue, "repeat": self.repeat,
+                "path": self.path, "position": self.position}
@@ -230,18 +230,15 @@ class Apa102(AbstractDisplay):
                        dtype=np.uint8)
         return ret.reshape((self.height, self.width, 1))
 
-    def gamma_correct_buffer(self):
-        for x in np.nditer(self._buffer,
-                           op_flags=['readwrite'],
-                           flags=['external_loop', 'buffered'],
-                           order='F'):
-            x[...] = self.__gamma8[x]
+    def gamma_corrected_buffer(self):
+        """Return a gamma corrected copy of buffer. The buffer itself is left
+        untouched, as frames may be views into shared or read-only data."""
+        return self.__gamma8[self._buffer]
 
     def show(self, gamma=False):
-        if gamma:
-            self.gamma_correct_buffer()
+        buffer = self.gamma_corrected_buffer() if gamma else self._buffer
         apa102_led_frames = np.concatenate((self.get_brightness_array(),
-                                            self._buffer), axis=2)
+                                            buffer), axis=2)
         reindexed_frames = apa102_led_frames.take(
                                        self.__virtual_to_physical_byte_indices)
         to_send = \
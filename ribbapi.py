@@ -21,11 +21,24 @@
 
 from animation.gameframe import GameframeAnimation
 from animation.blm import BlmAnimation
+from animation.bml import BmlAnimation
+from animation.gif import GifAnimation
+from animation.sprite_sheet import SpriteSheetAnimation
+from animation.video import VideoAnimation
+from animation.recording import RecordingAnimation
 from animation.text import TextAnimation
+from animation.text_scheduler import TextScheduler
 from animation.clock import ClockAnimation
 from animation.moodlight import MoodlightAnimation
 from server.ribbapi_http import RibbaPiHttpServer
 from server.tpm2_net import Tpm2NetServer
+from server.artnet import ArtNetServer
+from server.e131 import E131Server
+from server.opc import OpcServer
+from server.shared_frames import SharedFrameServer
+from server.recorder import StreamRecorder
+from server.sync import SyncNode
+from server.stream_output import StreamOutput
 
 from pathlib import Path
 import os
@@ -47,6 +60,48 @@ DISPLAY_WIDTH = 16
 DISPLAY_HEIGTH = 16
 HARDWARE = "APA102"
 #HARDWARE = "COMPUTER"
+TEXT_QUEUE_CAPACITY = 16
+TEXT_QUEUE_DROP_POLICY = "lowest"  # "lowest", "oldest" or "newest"
+TEXT_QUEUE_TTL = 600  # seconds a text may wait to be displayed
+# how often the mainloop checks for work while the current animation does not
+# tell when its next frame is due
+MAINLOOP_INTERVAL = 1/60
+# universes of the display in Art-Net and E1.31 streams, 510 channels (170
+# pixels) each, row by row
+ARTNET_FIRST_UNIVERSE = 0
+E131_FIRST_UNIVERSE = 1
+CHANNELS_PER_UNIVERSE = 510
+# Open Pixel Control channel of the display and how to share it between
+# clients: "latest" or "priority" (OPC_PRIORITIES maps hosts to priorities)
+OPC_CHANNEL = 1
+OPC_POLICY = "latest"
+OPC_PRIORITIES = {}
+# seconds the frames of network streams are delayed to present them at a
+# steady rate, None: present them as soon as they arrive
+STREAM_JITTER_DELAY = None
+# record the frames of network streams to RECORDINGS_DIRECTORY, one file per
+# stream; recordings are played like other animations
+RECORD_STREAMS = False
+RECORDINGS_DIRECTORY = "resources/animations/recordings/"
+# play in sync with other RibbaPis: None, "leader" (picks the animations) or
+# "follower" (plays what the leader picked), announced to SYNC_ADDRESS
+SYNC_ROLE = None
+SYNC_ADDRESS = "255.255.255.255"
+# send what the display shows to other devices, a list of (protocol,
+# "host[:port]") with protocol "tpm2.net" or "artnet" (universes as above),
+# at most STREAM_OUTPUT_FPS frames per second
+STREAM_OUTPUT_TARGETS = []
+STREAM_OUTPUT_FPS = 60
+
+
+# animations a leader can announce, by class name
+SYNC_ANIMATIONS = {animation_class.__name__: animation_class
+                   for animation_class in (GameframeAnimation, BlmAnimation,
+                                           BmlAnimation, GifAnimation,
+                                           SpriteSheetAnimation,
+                                           VideoAnimation, RecordingAnimation,
+                                           ClockAnimation,
+                                           MoodlightAnimation)}
 
 
 class RibbaPi():
@@ -69,7 +124,11 @@ class RibbaPi():
         self.interrupted_animation_kwargs = None
 
         self.frame_queue = queue.Queue(maxsize=1)
-        self.text_queue = queue.Queue()
+        # pending texts, handed out once they are rendered
+        self.text_queue = TextScheduler(capacity=TEXT_QUEUE_CAPACITY,
+                                        drop_policy=TEXT_QUEUE_DROP_POLICY,
+                                        default_ttl=TEXT_QUEUE_TTL)
+        self.text_render_queue = queue.Queue()  # texts waiting for rendering
         self.receiving_data = threading.Event()
 
         self.gameframe_activated = True
@@ -82,14 +141,37 @@ class RibbaPi():
         self.blm_duration = 60
         self.blm_selected = []
 
+        self.gif_activated = False
+        self.gif_repeat = -1
+        self.gif_duration = 60
+        self.gif_selected = []
+
+        self.sprite_activated = False
+        self.sprite_repeat = -1
+        self.sprite_duration = 60
+        self.sprite_selected = []
+
+        self.video_activated = False
+        self.video_repeat = 0
+        self.video_duration = 60
+        self.video_selected = []
+
+        self.recording_activated = False
+        self.recording_repeat = 0
+        self.recording_duration = 60
+        self.recording_selected = []
+
         self.clock_activated = True
         self.clock_last_shown = time.time()
         self.clock_show_every = 600
         self.clock_duration = 10
 
         self.moodlight_activated = False
+        self.moodlight_mode = "wish_down_up"
 
-        # find and prepare installed animations
+        # find and prepare installed animations, library_version counts
+        # changes of them or of a selection (clients cache the library)
+        self.library_version = 0
         self.refresh_animations()
 
         self.play_random = True
@@ -102,25 +184,137 @@ class RibbaPi():
                              daemon=True)
         self.http_server_thread.start()
 
-        # start tpm2_net server
+        # start stream servers (tpm2_net, Art-Net, E1.31, OPC, frames of
+        # local renderers in shared memory)
         self.tpm2_net_server = Tpm2NetServer(self)
-        self.tpm2_net_server_thread = \
-            threading.Thread(target=self.tpm2_net_server.serve_forever,
-                             daemon=True)
-        self.tpm2_net_server_thread.start()
-
-        self.text_queue.put("RibbaPi 👍")
+        self.artnet_server = ArtNetServer(self, ARTNET_FIRST_UNIVERSE,
+                                          CHANNELS_PER_UNIVERSE)
+        self.e131_server = E131Server(self, E131_FIRST_UNIVERSE,
+                                      CHANNELS_PER_UNIVERSE)
+        self.opc_server = OpcServer(self, OPC_CHANNEL, OPC_POLICY,
+                                    OPC_PRIORITIES)
+        self.shared_frame_server = SharedFrameServer(self)
+        self.stream_recorder = StreamRecorder(RECORDINGS_DIRECTORY,
+                                              DISPLAY_WIDTH, DISPLAY_HEIGTH,
+                                              self.add_recording)
+        self.stream_recorder.enabled = RECORD_STREAMS
+        self.stream_servers = [self.tpm2_net_server, self.artnet_server,
+                               self.e131_server, self.opc_server,
+                               self.shared_frame_server]
+        self.stream_server_threads = []
+        for server in self.stream_servers:
+            if STREAM_JITTER_DELAY is not None:
+                server.enable_jitter_buffer(STREAM_JITTER_DELAY)
+            server.recorder = self.stream_recorder
+            thread = threading.Thread(target=server.serve_forever,
+                                      daemon=True)
+            thread.start()
+            self.stream_server_threads.append(thread)
+
+        # mirror the display to other devices
+        self.stream_output = None
+        if STREAM_OUTPUT_TARGETS:
+            self.stream_output = StreamOutput(
+                DISPLAY_WIDTH, DISPLAY_HEIGTH, STREAM_OUTPUT_TARGETS,
+                STREAM_OUTPUT_FPS, first_universe=ARTNET_FIRST_UNIVERSE,
+                channels_per_universe=CHANNELS_PER_UNIVERSE)
+            self.stream_output.start()
+
+        # synchronized playback with other RibbaPis
+        self.sync = None
+        if SYNC_ROLE is not None:
+            self.sync = SyncNode(self, SYNC_ROLE, SYNC_ADDRESS)
+            self.sync_thread = threading.Thread(
+                target=self.sync.serve_forever, daemon=True)
+            self.sync_thread.start()
+
+        # render texts as soon as they arrive, not when they are due
+        self.text_render_thread = threading.Thread(target=self.render_texts,
+                                                   daemon=True)
+        self.text_render_thread.start()
+
+        self.display_text("RibbaPi 👍")
 
     # New frame handling
-    def process_frame_queue(self):
-        # check if there is a frame that needs to be displayed
-        if not self.frame_queue.empty():
-            # get frame and display it
-            self.display.buffer = self.frame_queue.get()
+    def process_frame_queue(self, timeout=0):
+        # wait up to timeout for a frame that needs to be displayed
+        try:
+            frame = self.frame_queue.get(timeout=timeout) if timeout > 0 \
+                else self.frame_queue.get_nowait()
+        except queue.Empty:
+            frame = None
+        else:
             self.frame_queue.task_done()
-            self.display.show(gamma=True)
+        # None is only sent to wake up the mainloop
+        if frame is not None:
+            self.show_frame(frame)
+        # stream servers never wait for the display, they keep their newest
+        # frame until it is taken here
+        for server in self.stream_servers:
+            frame = server.take_frame()
+            if frame is not None:
+                self.show_frame(frame)
+
+    def show_frame(self, frame):
+        self.display.buffer = frame
+        self.display.show(gamma=True)
+        if self.sync is not None:
+            self.sync.frame_presented(self.current_animation)
+        if self.stream_output is not None:
+            self.stream_output.submit(frame)
+
+    def wake(self):
+        """Make the mainloop look for work now instead of after its
+        timeout"""
+        try:
+            self.frame_queue.put_nowait(None)
+        except queue.Full:
+            # a frame is waiting, the mainloop wakes up anyway
+            pass
+
+    def next_wakeup_timeout(self):
+        """Seconds the mainloop may sleep. If the current animation tells
+        until when its frame is static, sleep until then or until it has to
+        be stopped; everything else in between wakes the mainloop up."""
+        static_until = self.current_animation.static_until \
+            if self.is_current_animation_running() else None
+        if static_until is None:
+            return MAINLOOP_INTERVAL
+        until = static_until
+        deadline = self.current_animation_deadline()
+        if deadline is not None:
+            until = min(until, deadline)
+        return max(MAINLOOP_INTERVAL, until - time.time())
 
     # Text handling
+    def display_text(self, text, priority=0, ttl=None, **options):
+        """Queue text for display. options are passed on to TextAnimation,
+        e.g. text_font, color or baseline. Returns False if the text was
+        dropped because the queue is full."""
+        options["text"] = text
+        message = self.text_queue.put(options, priority=priority, ttl=ttl)
+        if message is None:
+            return False
+        if not message.ready:
+            self.text_render_queue.put(message)
+        return True
+
+    def render_texts(self):
+        while True:
+            message = self.text_render_queue.get()
+            if not (message.ready or message.dropped):
+                try:
+                    TextAnimation(DISPLAY_WIDTH, DISPLAY_HEIGTH,
+                                  self.frame_queue, False,
+                                  **message.options).prerender()
+                except Exception as e:
+                    print("Could not render text {!r}: {}".format(message, e))
+                    self.text_queue.discard(message)
+                else:
+                    self.text_queue.mark_ready(message)
+                    self.wake()
+            self.text_render_queue.task_done()
+
     def process_text_queue(self):
         #TODO move those two if checks down inside bigger if startement
         # check if external data (e.g. tpm2_net) is received
@@ -137,16 +331,25 @@ class RibbaPi():
             if self.is_current_animation_running():
                 return
             # get text and create text animation
-            text = self.text_queue.get()
+            message = self.text_queue.get()
+            if message is None:
+                # expired in the meantime
+                return
             self.current_animation = TextAnimation(DISPLAY_WIDTH,
                                                    DISPLAY_HEIGTH,
                                                    self.frame_queue,
                                                    False,
-                                                   text)
+                                                   **message)
             self.current_animation.start()
 
     # Animation handling
     def refresh_animations(self):
+        # fonts, outline fonts and bitmap pixel fonts
+        self.text_fonts = []
+        for p in sorted(Path("resources/fonts/").glob("*"), key=lambda s: s.name.lower()):
+            if p.is_file() and p.suffix.lower() in (".otf", ".ttf", ".bdf", ".pcf"):
+                self.text_fonts.append(str(p))
+
         # gameframe
         self.gameframe_animations = []
         for p in sorted(Path("resources/animations/gameframe/").glob("*"), key=lambda s: s.name.lower()):
@@ -162,8 +365,48 @@ class RibbaPi():
         for p in sorted(Path("resources/animations/162-blms/").glob("*.blm"), key=lambda s: s.name.lower()):
             if p.is_file():
                 self.blm_animations.append(str(p))
+        for p in sorted(Path("resources/animations/bml/").glob("*"), key=lambda s: s.name.lower()):
+            if p.is_file() and p.suffix.lower() in (".bml", ".bmm"):
+                self.blm_animations.append(str(p))
         self.blm_selected = self.blm_animations.copy()
 
+        # gif
+        self.gif_animations = []
+        for p in sorted(Path("resources/animations/gif/").glob("*"), key=lambda s: s.name.lower()):
+            if p.is_file() and p.suffix.lower() in (".gif", ".png", ".apng"):
+                self.gif_animations.append(str(p))
+        self.gif_selected = self.gif_animations.copy()
+
+        # sprite sheets
+        self.sprite_animations = []
+        for p in sorted(Path("resources/animations/sprites/").glob("*.ini"), key=lambda s: s.name.lower()):
+            if p.is_file():
+                self.sprite_animations.append(str(p))
+        self.sprite_selected = self.sprite_animations.copy()
+
+        # raw videos
+        self.video_animations = []
+        for p in sorted(Path("resources/animations/video/").glob("*"), key=lambda s: s.name.lower()):
+            if p.is_file() and p.suffix.lower() in (".rgb", ".y4m"):
+                self.video_animations.append(str(p))
+        self.video_selected = self.video_animations.copy()
+
+        # recorded streams
+        self.recording_animations = []
+        for p in sorted(Path(RECORDINGS_DIRECTORY).glob("*.rrec"), key=lambda s: s.name.lower()):
+            if p.is_file():
+                self.recording_animations.append(str(p))
+        self.recording_selected = self.recording_animations.copy()
+        self.library_version += 1
+
+    def add_recording(self, path):
+        """A stream recording was finished"""
+        path = str(path)
+        if path not in self.recording_animations:
+            self.recording_animations.append(path)
+            self.recording_selected.append(path)
+            self.library_version += 1
+
     def clean_finished_animation(self):
         if self.current_animation and not self.current_animation.is_alive():
             self.current_animation = None
@@ -171,12 +414,26 @@ class RibbaPi():
     def animation_generator(self):
         gameframes = self.gameframe_generator()
         blms = self.blm_generator()
+        gifs = self.gif_generator()
+        sprites = self.sprite_generator()
+        videos = self.video_generator()
+        recordings = self.recording_generator()
         while True:
             if self.gameframe_activated:
                 yield next(gameframes)
             if self.blm_activated:
                 yield next(blms)
-            if not (self.gameframe_activated or self.blm_activated):
+            if self.gif_activated:
+                yield next(gifs)
+            if self.sprite_activated:
+                yield next(sprites)
+            if self.video_activated:
+                yield next(videos)
+            if self.recording_activated:
+                yield next(recordings)
+            if not (self.gameframe_activated or self.blm_activated or
+                    self.gif_activated or self.sprite_activated or
+                    self.video_activated or self.recording_activated):
                 yield None
 
     def gameframe_generator(self):
@@ -205,14 +462,90 @@ class RibbaPi():
                 else:
                     i += 1
                     i %= len(self.blm_selected)
-                yield BlmAnimation(DISPLAY_WIDTH,
+                animation_class = self.blm_animation_class(
+                    self.blm_selected[i])
+                yield animation_class(DISPLAY_WIDTH,
+                                      DISPLAY_HEIGTH,
+                                      self.frame_queue,
+                                      self.blm_repeat,
+                                      self.blm_selected[i])
+            else:
+                yield None
+
+    def gif_generator(self):
+        i = -1
+        while True:
+            if len(self.gif_selected) > 0:
+                if self.play_random:
+                    i = random.randint(0, len(self.gif_selected) - 1)
+                else:
+                    i += 1
+                    i %= len(self.gif_selected)
+                yield GifAnimation(DISPLAY_WIDTH,
                                    DISPLAY_HEIGTH,
                                    self.frame_queue,
-                                   self.blm_repeat,
-                                   self.blm_selected[i])
+                                   self.gif_repeat,
+                                   self.gif_selected[i])
+            else:
+                yield None
+
+    def sprite_generator(self):
+        i = -1
+        while True:
+            if len(self.sprite_selected) > 0:
+                if self.play_random:
+                    i = random.randint(0, len(self.sprite_selected) - 1)
+                else:
+                    i += 1
+                    i %= len(self.sprite_selected)
+                yield SpriteSheetAnimation(DISPLAY_WIDTH,
+                                           DISPLAY_HEIGTH,
+                                           self.frame_queue,
+                                           self.sprite_repeat,
+                                           self.sprite_selected[i])
+            else:
+                yield None
+
+    def video_generator(self):
+        i = -1
+        while True:
+            if len(self.video_selected) > 0:
+                if self.play_random:
+                    i = random.randint(0, len(self.video_selected) - 1)
+                else:
+                    i += 1
+                    i %= len(self.video_selected)
+                yield VideoAnimation(DISPLAY_WIDTH,
+                                     DISPLAY_HEIGTH,
+                                     self.frame_queue,
+                                     self.video_repeat,
+                                     self.video_selected[i])
+            else:
+                yield None
+
+    def recording_generator(self):
+        i = -1
+        while True:
+            if len(self.recording_selected) > 0:
+                if self.play_random:
+                    i = random.randint(0, len(self.recording_selected) - 1)
+                else:
+                    i += 1
+                    i %= len(self.recording_selected)
+                yield RecordingAnimation(DISPLAY_WIDTH,
+                                         DISPLAY_HEIGTH,
+                                         self.frame_queue,
+                                         self.recording_repeat,
+                                         self.recording_selected[i])
             else:
                 yield None
 
+    @staticmethod
+    def blm_animation_class(path):
+        if Path(path).suffix.lower() in (".bml", ".bmm"):
+            return BmlAnimation
+        return BlmAnimation
+
     def set_next_animation(self, path):
         animation = None
         if str(path).startswith("resources/animations/gameframe"):
@@ -223,15 +556,52 @@ class RibbaPi():
                                                self.gameframe_repeat,
                                                path)
 
-        elif str(path).startswith("resources/animations/162-blms") and \
-                str(path).endswith("blm"):
+        elif (str(path).startswith("resources/animations/162-blms") and
+              str(path).endswith("blm")) or \
+             (str(path).startswith("resources/animations/bml") and
+              Path(path).suffix.lower() in (".bml", ".bmm")):
             if Path(path).is_file():
-                animation = BlmAnimation(DISPLAY_WIDTH,
+                animation_class = self.blm_animation_class(path)
+                animation = animation_class(DISPLAY_WIDTH,
+                                            DISPLAY_HEIGTH,
+                                            self.frame_queue,
+                                            self.blm_repeat,
+                                            path)
+
+        elif str(path).startswith("resources/animations/gif"):
+            if Path(path).is_file():
+                animation = GifAnimation(DISPLAY_WIDTH,
                                          DISPLAY_HEIGTH,
                                          self.frame_queue,
-                                         self.blm_repeat,
+                                         self.gif_repeat,
                                          path)
 
+        elif str(path).startswith("resources/animations/sprites") and \
+                str(path).endswith(".ini"):
+            if Path(path).is_file():
+                animation = SpriteSheetAnimation(DISPLAY_WIDTH,
+                                                 DISPLAY_HEIGTH,
+                                                 self.frame_queue,
+                                                 self.sprite_repeat,
+                                                 path)
+
+        elif str(path).startswith("resources/animations/video"):
+            if Path(path).is_file():
+                animation = VideoAnimation(DISPLAY_WIDTH,
+                                           DISPLAY_HEIGTH,
+                                           self.frame_queue,
+                                           self.video_repeat,
+                                           path)
+
+        elif str(path).startswith(RECORDINGS_DIRECTORY.rstrip("/")) and \
+                str(path).endswith(".rrec"):
+            if Path(path).is_file():
+                animation = RecordingAnimation(DISPLAY_WIDTH,
+                                               DISPLAY_HEIGTH,
+                                               self.frame_queue,
+                                               self.recording_repeat,
+                                               path)
+
         if animation:
             self.store_animation_for_resume(animation)
 
@@ -239,8 +609,46 @@ class RibbaPi():
         self.interrupted_animation_class = type(animation)
         self.interrupted_animation_kwargs = animation.kwargs
 
+    def is_sync_follower(self):
+        return self.sync is not None and self.sync.role == "follower"
+
+    def process_sync(self):
+        """Followers switch to the animation the leader announced"""
+        if not self.is_sync_follower() or self.receiving_data.is_set() or \
+                self.sync.pending is None:
+            return
+        if self.is_current_animation_running():
+            # texts are shown to the end
+            if not isinstance(self.current_animation, TextAnimation):
+                self.current_animation.stop()
+            return
+        message = self.sync.take_pending()
+        if message is None:
+            return
+        animation_class = SYNC_ANIMATIONS.get(message["animation"])
+        if animation_class is None:
+            print("Cannot play {} in sync".format(message["animation"]))
+            return
+        try:
+            animation = animation_class(width=DISPLAY_WIDTH,
+                                        height=DISPLAY_HEIGTH,
+                                        frame_queue=self.frame_queue,
+                                        **message["kwargs"])
+        except (AttributeError, FileNotFoundError, TypeError,
+                ValueError) as e:
+            print("Cannot play {} in sync: {!r}".format(message["animation"],
+                                                        e))
+            return
+        animation.start_at = message["local_start"]
+        self.current_animation = animation
+        self.sync.started(message["id"], animation)
+        animation.start()
+
     def get_next_animation(self):
         next_animation = None
+        if self.is_sync_follower():
+            # waits for the leader
+            return None
         # check if there is an animation to resume
         if self.interrupted_animation_class:
             next_animation = self.interrupted_animation_class(
@@ -257,7 +665,8 @@ class RibbaPi():
         elif self.moodlight_activated:
             next_animation = MoodlightAnimation(DISPLAY_WIDTH,
                                                DISPLAY_HEIGTH,
-                                               self.frame_queue)
+                                               self.frame_queue,
+                                               mode=self.moodlight_mode)
         else:
             next_animation = next(self.animations)
         return next_animation
@@ -276,30 +685,50 @@ class RibbaPi():
         if self.is_current_animation_running():
             if self.receiving_data.is_set():
                 self.stop_current_animation()
-            if isinstance(self.current_animation, ClockAnimation):
-                duration = self.clock_duration
-                if self.current_animation.started + duration < time.time():
-                    self.stop_current_animation()
-            if isinstance(self.current_animation, GameframeAnimation):
-                duration = max(self.gameframe_duration,
-                               self.current_animation.intrinsic_duration())
-                if self.current_animation.started + duration < time.time():
-                    self.stop_current_animation()
-            if isinstance(self.current_animation, BlmAnimation):
-                duration = max(self.blm_duration,
-                               self.current_animation.intrinsic_duration())
-                if self.current_animation.started + duration < time.time():
-                    self.stop_current_animation()
+            deadline = self.current_animation_deadline()
+            if deadline is not None and deadline < time.time():
+                self.stop_current_animation()
 
+    def current_animation_deadline(self):
+        """time.time() when the current animation has played long enough or
+        None if it plays until it finishes"""
+        if not self.current_animation or \
+                not hasattr(self.current_animation, "started"):
+            return None
+        animation = self.current_animation
+        if isinstance(animation, ClockAnimation):
+            duration = self.clock_duration
+        elif isinstance(animation, GameframeAnimation):
+            duration = max(self.gameframe_duration,
+                           animation.intrinsic_duration())
+        elif isinstance(animation, BlmAnimation):
+            duration = max(self.blm_duration, animation.intrinsic_duration())
+        elif isinstance(animation, GifAnimation):
+            duration = max(self.gif_duration, animation.intrinsic_duration())
+        elif isinstance(animation, SpriteSheetAnimation):
+            duration = max(self.sprite_duration,
+                           animation.intrinsic_duration())
+        elif isinstance(animation, VideoAnimation):
+            duration = max(self.video_duration,
+                           animation.intrinsic_duration())
+        elif isinstance(animation, RecordingAnimation):
+            duration = max(self.recording_duration,
+                           animation.intrinsic_duration())
+        else:
+            return None
+        return animation.started + duration
 
     def mainloop(self):
         # TODO start auto renewing timer for clock and predined texts
 
         try:
             while True:
-                self.process_frame_queue()
+                # sleeps until a frame arrives or there is something to do
+                self.process_frame_queue(self.next_wakeup_timeout())
                 # if the current_animation is finished then cleanup
                 self.clean_finished_animation()
+                # followers play what the leader announced
+                self.process_sync()
                 # check if there is text to display
                 self.process_text_queue()
                 # if there is currently no animation, start a new one
@@ -308,21 +737,35 @@ class RibbaPi():
                     self.current_animation = self.get_next_animation()
 
                     if self.current_animation:
+                        if self.sync is not None and \
+                                self.sync.role == "leader":
+                            self.sync.announce(self.current_animation)
                         self.current_animation.start()
                 # Check if current_animation has played long enough
                 self.check_current_animation_runtime()
-
-                # to limit CPU usage do not go faster than 60 "fps"
-                time.sleep(1/60)
         except KeyboardInterrupt:
             pass
 
         self.stop_current_animation()
         self.display.clear_buffer()
         self.display.show()
+        if self.stream_output is not None:
+            # the mirrors go dark as well
+            self.stream_output.submit(self.display.buffer)
+            self.stream_output.close()
 
         self.http_server.shutdown()
         self.http_server.server_close()
+        for server, thread in zip(self.stream_servers,
+                                  self.stream_server_threads):
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.stream_recorder.close()
+        if self.sync is not None:
+            self.sync.shutdown()
+            self.sync_thread.join()
+            self.sync.server_close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Protocol Reference
+# https://art-net.org.uk/resources/art-net-specification/
+
+from server.stream import UniverseFrameAssembler, UdpStreamServer, \
+    RECEIVE_BUFFER
+
+ARTNET_PORT = 6454
+ARTNET_ID = b"Art-Net\x00"
+ARTNET_OP_DMX = 0x5000
+ARTNET_OP_SYNC = 0x5200
+ARTNET_DMX_HEADER_SIZE = 18
+
+
+class ArtNetFrameAssembler(UniverseFrameAssembler):
+    def process_packet(self, data):
+        if len(data) < 10 or data[:8] != ARTNET_ID:
+            self.malformed += 1
+            raise ValueError("no Art-Net packet")
+        opcode = data[8] | (data[9] << 8)
+        if opcode == ARTNET_OP_SYNC:
+            return self.sync()
+        if opcode != ARTNET_OP_DMX:
+            # polls and everything else are not implemented
+            raise ValueError("no Art-Net dmx packet")
+        if len(data) < ARTNET_DMX_HEADER_SIZE:
+            self.malformed += 1
+            raise ValueError("Art-Net dmx packet too short")
+        sequence = data[12]  # 0: sequence not used
+        universe = data[14] | ((data[15] & 0x7F) << 8)
+        length = (data[16] << 8) | data[17]
+        if len(data) < ARTNET_DMX_HEADER_SIZE + length:
+            self.malformed += 1
+            raise ValueError("Art-Net dmx packet too short")
+        i = self.universe_index(universe)
+        return self.universe_data(i, data, ARTNET_DMX_HEADER_SIZE, length,
+                                  sequence if sequence else None)
+
+
+class ArtNetServer(UdpStreamServer):
+    name = "Art-Net"
+
+    def __init__(self, ribbapi, first_universe=0, channels_per_universe=510,
+                 port=ARTNET_PORT, receive_buffer=RECEIVE_BUFFER):
+        super().__init__(ribbapi, port, receive_buffer)
+        self.first_universe = first_universe
+        self.channels_per_universe = channels_per_universe
+
+    def create_assembler(self):
+        return ArtNetFrameAssembler(self.ribbapi.display.width,
+                                    self.ribbapi.display.height,
+                                    self.first_universe,
+                                    self.channels_per_universe)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+JSON control API, version 2.
+
+    GET  /api/v2/state    configuration and what is playing, small
+    GET  /api/v2/library  installed and selected animations, revalidated
+                          with its ETag, it changes only with
+                          ribbapi.library_version
+    POST /api/v2/batch    a list of operations, applied in order:
+
+        {"op": "set", "key": "brightness", "value": 0.4}
+        {"op": "select", "kind": "gif", "paths": [...]}
+        {"op": "next_animation"}
+        {"op": "play", "path": "resources/animations/gif/nyan.gif"}
+        {"op": "display_text", "text": "Hi", "color": "#ff0000",
+         "font": ..., "priority": 0, "ttl": 60}
+
+The batch answers with one result per operation ({"ok": true} or
+{"ok": false, "error": ...}, an operation that fails changes nothing) and
+the state after all of them.
+"""
+
+import hashlib
+import json
+
+from animation.moodlight import MODES as MOODLIGHT_MODES
+
+LIBRARY_KINDS = ("gameframe", "blm", "gif", "sprite", "video", "recording")
+MAX_OPERATIONS = 256
+
+
+def parse_colors(value):
+    """Parse "#rrggbb" or a comma separated list of them (one color for
+    each character) to a list of rgb tuples. Invalid colors are skipped."""
+    colors = []
+    for color in value.split(","):
+        color = color.strip().lstrip("#")
+        if len(color) == 6:
+            try:
+                colors.append(tuple(bytes.fromhex(color)))
+            except ValueError:
+                continue
+    return colors
+
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError("expected true or false")
+    return value
+
+
+def _number(low, high, kind=float):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or \
+                not low <= value <= high:
+            raise ValueError("expected a number from {} to {}".format(low,
+                                                                      high))
+        return kind(value)
+    return check
+
+
+# checks of the options of a text, shared with the v1 form
+text_priority = _number(-1000, 1000, int)
+text_ttl = _number(0, 86400)
+
+
+def _moodlight_mode(value):
+    if value not in MOODLIGHT_MODES:
+        raise ValueError("expected one of {}".format(
+            ", ".join(MOODLIGHT_MODES)))
+    return value
+
+
+# key -> check and conversion of the value, every key is an attribute of
+# ribbapi except brightness and record_streams
+SETTINGS = {"brightness": _number(0.0, 1.0),
+            "play_random": _flag,
+            "clock_activated": _flag,
+            "clock_duration": _number(1, 3600, int),
+            "clock_show_every": _number(10, 86400, int),
+            "moodlight_activated": _flag,
+            "moodlight_mode": _moodlight_mode,
+            "record_streams": _flag}
+for _kind in LIBRARY_KINDS:
+    SETTINGS[_kind + "_activated"] = _flag
+    SETTINGS[_kind + "_duration"] = _number(1, 86400, int)
+    SETTINGS[_kind + "_repeat"] = _number(-1, 1000, int)
+
+
+def get_setting(ribbapi, key):
+    if key == "brightness":
+        return ribbapi.display.brightness
+    if key == "record_streams":
+        return ribbapi.stream_recorder.enabled
+    return getattr(ribbapi, key)
+
+
+def state(ribbapi):
+    """Everything but the library"""
+    animation = ribbapi.current_animation
+    streams = []
+    for server in ribbapi.stream_servers:
+        streams.extend(server.stats())
+    return {"version": 2,
+            "settings": {key: get_setting(ribbapi, key) for key in SETTINGS},
+            "moodlight_modes": list(MOODLIGHT_MODES),
+            "fonts": ribbapi.text_fonts,
+            "library_version": ribbapi.library_version,
+            "current_animation": getattr(animation, "name",
+                                         type(animation).__name__)
+            if animation is not None else None,
+            "receiving_data": ribbapi.receiving_data.is_set(),
+            "text_queue": ribbapi.text_queue.stats(),
+            "streams": streams,
+            "recording": ribbapi.stream_recorder.stats(),
+            "sync": ribbapi.sync.stats() if ribbapi.sync else None,
+            "output": ribbapi.stream_output.stats()
+            if ribbapi.stream_output else None}
+
+
+def encode(value):
+    return json.dumps(value, default=str).encode("utf-8")
+
+
+class LibraryCache():
+    """The library as JSON with its ETag, built again only when
+    ribbapi.library_version changed"""
+    def __init__(self):
+        self.version = None
+        self.body = None
+        self.etag = None
+
+    def get(self, ribbapi):
+        version = ribbapi.library_version
+        if version != self.version:
+            library = {kind: {"animations": getattr(ribbapi,
+                                                    kind + "_animations"),
+                              "selected": getattr(ribbapi,
+                                                  kind + "_selected")}
+                       for kind in LIBRARY_KINDS}
+            body = encode({"library_version": version,
+                           "library": library})
+            # set together, other threads may read them meanwhile
+            self.body, self.etag, self.version = \
+                body, '"{}"'.format(hashlib.sha1(body).hexdigest()), version
+        return self.body, self.etag
+
+
+def apply_operation(ribbapi, operation):
+    """Apply one operation of a batch. Raises ValueError if it is invalid,
+    nothing is changed then."""
+    if not isinstance(operation, dict):
+        raise ValueError("an operation is an object")
+    op = operation.get("op")
+    if not isinstance(op, str):
+        raise ValueError("op is a string")
+    if op == "set":
+        key = operation.get("key")
+        if not isinstance(key, str) or key not in SETTINGS:
+            raise ValueError("unknown setting {}".format(key))
+        value = SETTINGS[key](operation.get("value"))
+        if key == "brightness":
+            ribbapi.display.brightness = value
+        elif key == "record_streams":
+            if value:
+                ribbapi.stream_recorder.enabled = True
+            else:
+                ribbapi.stream_recorder.stop()
+        else:
+            setattr(ribbapi, key, value)
+    elif op == "select":
+        kind = operation.get("kind")
+        if not isinstance(kind, str) or kind not in LIBRARY_KINDS:
+            raise ValueError("unknown kind {}".format(kind))
+        paths = operation.get("paths")
+        if not isinstance(paths, list) or \
+                not all(isinstance(path, str) for path in paths):
+            raise ValueError("paths is a list of strings")
+        available = set(getattr(ribbapi, kind + "_animations"))
+        unknown = [path for path in paths if path not in available]
+        if unknown:
+            raise ValueError("not in the library: {}".format(
+                ", ".join(map(str, unknown[:5]))))
+        setattr(ribbapi, kind + "_selected", list(paths))
+        ribbapi.library_version += 1
+    elif op == "next_animation":
+        ribbapi.stop_current_animation()
+    elif op == "play":
+        path = operation.get("path")
+        if not any(path in getattr(ribbapi, kind + "_animations")
+                   for kind in LIBRARY_KINDS):
+            raise ValueError("not in the library: {}".format(path))
+        ribbapi.set_next_animation(path)
+        ribbapi.stop_current_animation()
+    elif op == "display_text":
+        text = operation.get("text")
+        if not isinstance(text, str) or not text:
+            raise ValueError("text is a non empty string")
+        options = {}
+        font = operation.get("font")
+        if font:
+            if font not in ribbapi.text_fonts:
+                raise ValueError("unknown font {}".format(font))
+            options["text_font"] = font
+        if "color" in operation:
+            colors = parse_colors(str(operation["color"]))
+            if not colors:
+                raise ValueError("color is #rrggbb[,#rrggbb...]")
+            options["color"] = colors
+        if "priority" in operation:
+            options["priority"] = text_priority(operation["priority"])
+        if "ttl" in operation:
+            options["ttl"] = text_ttl(operation["ttl"])
+        if not ribbapi.display_text(text, **options):
+            raise ValueError("the text queue is full")
+    else:
+        raise ValueError("unknown operation {}".format(op))
+
+
+def apply_batch(ribbapi, operations):
+    """Results of applying the operations in order"""
+    if not isinstance(operations, list):
+        raise ValueError("a batch is a list of operations")
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError("at most {} operations".format(MAX_OPERATIONS))
+    results = []
+    for operation in operations:
+        try:
+            apply_operation(ribbapi, operation)
+        except ValueError as e:
+            results.append({"ok": False, "error": str(e)})
+        else:
+            results.append({"ok": True})
+    return results
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Protocol Reference
+# ANSI E1.31-2018, Streaming ACN (sACN)
+
+import socket
+import struct
+
+from server.stream import UniverseFrameAssembler, UdpStreamServer, \
+    RECEIVE_BUFFER
+
+E131_PORT = 5568
+E131_ACN_ID = b"ASC-E1.17\x00\x00\x00"
+E131_ROOT_DATA = 0x00000004
+E131_ROOT_EXTENDED = 0x00000008
+E131_FRAMING_DATA = 0x00000002
+E131_FRAMING_SYNC = 0x00000001
+E131_OPTION_PREVIEW = 0x80 >> 1
+E131_OPTION_TERMINATED = 0x80 >> 2
+E131_DMX_OFFSET = 126  # first channel after the start code
+E131_SYNC_SIZE = 49
+
+
+def multicast_group(universe):
+    return "239.255.{}.{}".format(universe >> 8, universe & 0xFF)
+
+
+class E131FrameAssembler(UniverseFrameAssembler):
+    def __init__(self, width, height, first_universe,
+                 channels_per_universe=510):
+        super().__init__(width, height, first_universe, channels_per_universe)
+        self.sync_address = 0
+
+    def process_packet(self, data):
+        if len(data) < E131_SYNC_SIZE or data[4:16] != E131_ACN_ID:
+            self.malformed += 1
+            raise ValueError("no E1.31 packet")
+        root_vector = int.from_bytes(data[18:22], "big")
+        framing_vector = int.from_bytes(data[40:44], "big")
+        if root_vector == E131_ROOT_EXTENDED and \
+                framing_vector == E131_FRAMING_SYNC:
+            if self.sync_address != (data[45] << 8) | data[46]:
+                raise ValueError("sync of other universes")
+            return self.sync()
+        if root_vector != E131_ROOT_DATA or \
+                framing_vector != E131_FRAMING_DATA:
+            # universe discovery is not implemented
+            raise ValueError("no E1.31 data packet")
+        if len(data) < E131_DMX_OFFSET:
+            self.malformed += 1
+            raise ValueError("E1.31 data packet too short")
+
+        options = data[112]
+        if options & E131_OPTION_TERMINATED:
+            self.reset()
+            raise ValueError("E1.31 stream terminated")
+        if options & E131_OPTION_PREVIEW or data[125] != 0:
+            # preview data or no dmx start code (e.g. priorities)
+            raise ValueError("no E1.31 dmx data")
+        universe = (data[113] << 8) | data[114]
+        i = self.universe_index(universe)
+        length = ((data[123] << 8) | data[124]) - 1
+        if length < 0 or len(data) < E131_DMX_OFFSET + length:
+            self.malformed += 1
+            raise ValueError("E1.31 data packet too short")
+        self.sync_address = (data[109] << 8) | data[110]
+        # a frame waits for a sync packet only if the sender announces them
+        self.synchronized = self.sync_address != 0
+        return self.universe_data(i, data, E131_DMX_OFFSET, length,
+                                  data[111])
+
+
+class E131Server(UdpStreamServer):
+    """E1.31 receiver, joins the multicast groups of the displayed
+    universes (and of the sync address once it is known)"""
+    name = "E1.31"
+
+    def __init__(self, ribbapi, first_universe=1, channels_per_universe=510,
+                 port=E131_PORT, receive_buffer=RECEIVE_BUFFER):
+        super().__init__(ribbapi, port, receive_buffer)
+        self.first_universe = first_universe
+        self.channels_per_universe = channels_per_universe
+        self.joined = set()
+        for universe in range(first_universe, first_universe +
+                              self.create_assembler().universe_count):
+            self.join(universe)
+
+    def join(self, universe):
+        if universe in self.joined or not 0 < universe < 64000:
+            return
+        self.joined.add(universe)
+        request = struct.pack("4s4s",
+                              socket.inet_aton(multicast_group(universe)),
+                              socket.inet_aton("0.0.0.0"))
+        try:
+            self.socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_ADD_MEMBERSHIP, request)
+        except OSError as e:
+            # unicast still works
+            print("E1.31: could not join multicast group of universe {}: "
+                  "{}".format(universe, e))
+
+    def create_assembler(self):
+        return E131FrameAssembler(self.ribbapi.display.width,
+                                  self.ribbapi.display.height,
+                                  self.first_universe,
+                                  self.channels_per_universe)
+
+    def process_packet(self, data, addr=None):
+        super().process_packet(data, addr)
+        assembler = self.sources.get(addr)
+        if assembler is not None and assembler.sync_address:
+            self.join(assembler.sync_address)
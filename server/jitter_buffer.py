@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Steady presentation of network streams.
+
+Frames of a stream arrive unevenly (Wi-Fi on the Pi Zero delays and then
+bunches packets). A jitter buffer delays them by a fixed amount and
+releases them at the frame rate of the source, estimated from the arrival
+times, on the event loop of the stream server:
+
+    late        frames that arrived after they were due, the buffer ran
+                empty before them
+    dropped     frames given up to keep the delay bounded
+    duplicated  frame times in which no new frame was available, the
+                previous one stayed on the display
+"""
+
+from collections import deque
+
+# limits of the estimated frame interval, seconds
+MIN_INTERVAL = 1 / 240
+MAX_INTERVAL = 1.0
+# arrivals the frame rate is estimated from
+RATE_WINDOW = 64
+
+
+class JitterBuffer():
+    def __init__(self, loop, present, delay=0.05, max_frames=16):
+        self.loop = loop
+        self.present = present  # called with every released frame
+        self.delay = delay  # seconds between arrival and release
+        self.max_frames = max_frames
+        self.frames = deque()
+        self.interval = None  # estimated seconds between source frames
+        self.arrivals = deque(maxlen=RATE_WINDOW)
+        self.next_release = None
+        self.handle = None
+        self.starved = False
+        self.empty_ticks = 0
+
+        self.received = 0
+        self.released = 0
+        self.late = 0
+        self.dropped = 0
+        self.duplicated = 0
+
+    def estimate(self, now):
+        # the mean interval over a window of arrivals, single intervals
+        # are as uneven as the network
+        if self.arrivals and now - self.arrivals[-1] > MAX_INTERVAL:
+            # the stream paused, start over
+            self.arrivals.clear()
+        self.arrivals.append(now)
+        if len(self.arrivals) > 1:
+            interval = (now - self.arrivals[0]) / (len(self.arrivals) - 1)
+            self.interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+    def push(self, frame):
+        """Add a frame that just arrived. The frame is copied, the buffers of
+        the stream servers are reused after a few frames."""
+        now = self.loop.time()
+        self.estimate(now)
+        self.received += 1
+        self.frames.append(frame.copy())
+        if len(self.frames) > self.max_frames:
+            self.frames.popleft()
+            self.dropped += 1
+        if self.starved:
+            self.starved = False
+            self.late += 1
+        if self.handle is None:
+            # (re)start the playout clock
+            self.next_release = now + self.delay
+            self.handle = self.loop.call_at(self.next_release, self.release)
+
+    def target_depth(self):
+        """Frames that may wait to keep the delay"""
+        if not self.interval:
+            return self.max_frames
+        return max(1, min(self.max_frames,
+                          round(self.delay / self.interval) + 1))
+
+    def release(self):
+        now = self.loop.time()
+        interval = self.interval or self.delay or MIN_INTERVAL
+        if self.frames:
+            self.empty_ticks = 0
+            frame = self.frames.popleft()
+            while len(self.frames) > self.target_depth():
+                # the source runs faster than estimated or bunched frames
+                frame = self.frames.popleft()
+                self.dropped += 1
+            self.present(frame)
+            self.released += 1
+        else:
+            self.duplicated += 1
+            self.starved = True
+            self.empty_ticks += 1
+            if self.empty_ticks * interval > max(1.0, 4 * self.delay):
+                # the stream paused or ended, restart with the next frame
+                self.empty_ticks = 0
+                self.starved = False
+                self.handle = None
+                return
+        # the estimate is never exact: slow down a little while fewer frames
+        # wait than the delay holds, speed up while more do
+        error = len(self.frames) - self.delay / interval
+        interval *= 1 - max(-0.2, min(0.2, 0.02 * error))
+        self.next_release += interval
+        if self.next_release < now:
+            # the loop was busy, do not try to catch up
+            self.next_release = now + interval
+        self.handle = self.loop.call_at(self.next_release, self.release)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.frames.clear()
+
+    def stats(self):
+        return {"delay": self.delay,
+                "fps": 1 / self.interval if self.interval else 0.0,
+                "depth": len(self.frames),
+                "received": self.received,
+                "released": self.released,
+                "late": self.late,
+                "dropped": self.dropped,
+                "duplicated": self.duplicated}
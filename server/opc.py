@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Protocol Reference
+# http://openpixelcontrol.org/
+
+import asyncio
+import socket
+import time
+
+from server.stream import FrameRing, StreamServer
+
+OPC_PORT = 7890
+OPC_HEADER_SIZE = 4
+OPC_BROADCAST = 0
+OPC_SET_PIXELS = 0
+OPC_SYSTEM_EXCLUSIVE = 255
+OPC_POLICIES = ("latest", "priority")
+
+
+class OpcConnection(asyncio.BufferedProtocol):
+    """One client connection. The socket is read straight into the header
+    and into the frame ring, pixel data is not copied on its way to the
+    mainloop."""
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.peer = None
+        self.ring = FrameRing(server.ribbapi.display.width,
+                              server.ribbapi.display.height,
+                              in_use=server.frames_in_use)
+        self.frame_bytes = self.ring.flat.size
+        self.views = [memoryview(buffer.reshape(-1))
+                      for buffer in self.ring.buffers]
+        self.header = memoryview(bytearray(OPC_HEADER_SIZE))
+        self.discard = memoryview(bytearray(4096))
+        self.reading_header = True
+        self.filled = 0  # bytes of the header read
+        self.remaining = 0  # bytes of the payload still to read
+        self.offset = 0  # bytes of the frame read
+        self.accept = False  # the current message sets our pixels
+        self.into_frame = False  # the last buffer handed out is the frame
+
+        self.priority = 0
+        self.connected = time.time()
+        self.last_frame = None
+        self.packets = 0
+        self.frames = 0
+        self.malformed = 0
+        self.gaps = 0
+        self.dropped = 0  # frames not shown because of the policy
+        self.bytes = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info("peername")[:2]
+        self.server.connection_made(self)
+
+    def connection_lost(self, exc):
+        self.server.connection_lost(self)
+
+    def get_buffer(self, sizehint):
+        if self.reading_header:
+            return self.header[self.filled:]
+        self.into_frame = self.accept and self.offset < self.frame_bytes
+        if self.into_frame:
+            count = min(self.remaining, self.frame_bytes - self.offset)
+            return self.views[self.ring.index][self.offset:
+                                               self.offset + count]
+        return self.discard[:min(self.remaining, len(self.discard))]
+
+    def buffer_updated(self, nbytes):
+        self.bytes += nbytes
+        if self.reading_header:
+            self.filled += nbytes
+            if self.filled < OPC_HEADER_SIZE:
+                return
+            channel, command = self.header[0], self.header[1]
+            self.remaining = (self.header[2] << 8) | self.header[3]
+            self.reading_header = False
+            self.filled = 0
+            self.offset = 0
+            self.accept = command == OPC_SET_PIXELS and \
+                channel in (OPC_BROADCAST, self.server.channel)
+            if command not in (OPC_SET_PIXELS, OPC_SYSTEM_EXCLUSIVE):
+                self.malformed += 1
+        else:
+            if self.into_frame:
+                self.offset += nbytes
+            self.remaining -= nbytes
+        if self.remaining == 0:
+            self.message_complete()
+
+    def message_complete(self):
+        self.reading_header = True
+        self.packets += 1
+        if not self.accept:
+            return
+        if self.offset < self.frame_bytes:
+            # pixels not sent are off
+            self.ring.flat[self.offset:] = 0
+        self.frames += 1
+        self.last_frame = time.time()
+        self.server.frame_received(self, self.ring.complete())
+
+
+class OpcServer(StreamServer):
+    """Open Pixel Control over long lived TCP connections.
+
+    With policy "latest" the frames of all clients are shown as they
+    arrive. With "priority" the client with the highest priority (given per
+    host in priorities) that sent a frame within timeout owns the display,
+    among equal priorities the one that started first."""
+    name = "OPC"
+
+    def __init__(self, ribbapi, channel=1, policy="latest", priorities=None,
+                 port=OPC_PORT):
+        super().__init__(ribbapi)
+        if policy not in OPC_POLICIES:
+            raise ValueError("Unknown OPC policy {}".format(policy))
+        self.channel = channel
+        self.policy = policy
+        self.priorities = priorities or {}
+        self.owner = None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('', port))
+        self.socket.listen()
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.endpoint = None
+
+    async def create_endpoint(self):
+        self.endpoint = await self.loop.create_server(
+            lambda: OpcConnection(self), sock=self.socket)
+
+    def close_endpoint(self):
+        self.endpoint.close()
+        for connection in list(self.sources.values()):
+            connection.transport.close()
+
+    def server_close(self):
+        self.socket.close()
+        super().server_close()
+
+    def connection_made(self, connection):
+        connection.priority = self.priorities.get(connection.peer[0], 0)
+        self.sources[connection.peer] = connection
+        self.last_seen[connection.peer] = time.time()
+
+    def connection_lost(self, connection):
+        self.sources.pop(connection.peer, None)
+        self.last_seen.pop(connection.peer, None)
+        if self.owner is connection:
+            self.owner = None
+
+    def is_active(self, connection):
+        return connection.last_frame is not None and \
+            connection.last_frame + self.timeout > time.time()
+
+    def frame_received(self, connection, frame):
+        self.last_seen[connection.peer] = connection.last_frame
+        if self.policy == "priority":
+            owner = self.owner
+            if owner is None or owner is not connection and \
+                    (connection.priority > owner.priority or
+                     not self.is_active(owner)):
+                self.owner = connection
+            elif owner is not connection:
+                connection.dropped += 1
+                return
+        self.stream_started()
+        self.update_time()
+        self.present(frame)
+
+    def source_stats(self, addr, connection):
+        entry = super().source_stats(addr, connection)
+        seconds = max(time.time() - connection.connected, 1e-6)
+        entry.update({"dropped": connection.dropped,
+                      "fps": connection.frames / seconds,
+                      "bytes_per_second": connection.bytes / seconds,
+                      "priority": connection.priority})
+        return entry
+
+
+def run_benchmark(width=16, height=16, frames=20000):
+    """Frames per second of one client streaming over the loopback
+    interface as fast as possible"""
+    import threading
+    from types import SimpleNamespace
+
+    ribbapi = SimpleNamespace(
+        display=SimpleNamespace(width=width, height=height),
+        receiving_data=threading.Event(), wake=lambda: None,
+        current_animation=None)
+    server = OpcServer(ribbapi, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    payload = bytes(width * height * 3)
+    message = bytes((1, OPC_SET_PIXELS, len(payload) >> 8,
+                     len(payload) & 0xFF)) + payload
+    client = socket.create_connection(("127.0.0.1", server.server_address[1]))
+
+    def received():
+        return sum(source["frames"] for source in server.stats())
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        client.sendall(message)
+    while received() < frames and \
+            time.perf_counter() - start < 30:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    stats = server.stats()
+    count = sum(source["frames"] for source in stats)
+    client.close()
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    print("{}x{} over tcp: {:.0f} frames/s, {} of {} received, {:.1f} MB/s"
+          "".format(width, height, count / elapsed, count, frames,
+                    len(message) * count / elapsed / 1e6))
+    print(stats)
+
+
+if __name__ == "__main__":
+    # python3 -m server.opc
+    run_benchmark(16, 16)
+    run_benchmark(32, 32)
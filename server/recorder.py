@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import threading
+import time
+from pathlib import Path
+
+from animation.recording import RecordingWriter
+
+# seconds, longer pauses of a stream are shortened to this in a recording
+MAX_PAUSE = 1.0
+# frames waiting for the writer thread, further frames are dropped
+MAX_QUEUED = 256
+
+FINISH = "finish"
+CLOSE = "close"
+
+
+class StreamRecorder():
+    """Records the frames of all stream servers while enabled. A recording
+    starts with the first frame of a stream and is finished once every
+    stream has stopped; it is then handed to finished (its path).
+
+    The stream servers only queue a copy of each frame, files are opened,
+    written and finished by a thread of the recorder, so a slow disk never
+    holds up packet reception. Frames that do not fit into the queue are
+    dropped and counted."""
+    def __init__(self, directory, width, height, finished=None):
+        self.directory = Path(directory)
+        self.width = width
+        self.height = height
+        self.finished = finished
+        self.enabled = False
+        self.queue = queue.Queue()
+        self.writer = None
+        self.start = None
+        self.last = None
+        self.failed = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, frame):
+        if not self.enabled:
+            return
+        if self.queue.qsize() >= MAX_QUEUED:
+            self.dropped += 1
+            return
+        self.queue.put((frame.copy(), time.monotonic()))
+
+    def finish(self):
+        """Close the current recording, if any"""
+        self.queue.put(FINISH)
+
+    def stop(self):
+        self.enabled = False
+        self.finish()
+
+    def close(self):
+        """Stop, finish the recording and wait for the writer thread"""
+        self.stop()
+        self.queue.put(CLOSE)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is CLOSE:
+                return
+            if item is FINISH:
+                self.finish_recording()
+            else:
+                self.write(*item)
+
+    def write(self, frame, now):
+        if self.writer is None:
+            if not self.open():
+                return
+            self.start = now
+        elif now - self.last > MAX_PAUSE:
+            self.start += now - self.last - MAX_PAUSE
+        self.last = now
+        try:
+            self.writer.write(frame, (now - self.start) * 1000)
+        except OSError as e:
+            print("Recording {} failed: {}".format(self.writer.path, e))
+            self.failed += 1
+            self.close_writer()
+
+    def open(self):
+        path = self.directory / time.strftime("stream-%Y%m%d-%H%M%S.rrec")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.writer = RecordingWriter(path, self.width, self.height)
+        except OSError as e:
+            print("Could not record to {}: {}".format(path, e))
+            self.failed += 1
+            return False
+        return True
+
+    def close_writer(self):
+        writer, self.writer = self.writer, None
+        try:
+            writer.close()
+        except OSError as e:
+            print("Could not finish {}: {}".format(writer.path, e))
+            return None
+        return writer.path
+
+    def finish_recording(self):
+        if self.writer is None:
+            return
+        path = self.close_writer()
+        if path is not None and self.finished is not None:
+            self.finished(path)
+
+    def stats(self):
+        writer = self.writer
+        return {"enabled": self.enabled,
+                "path": str(writer.path) if writer else None,
+                "frames": writer.frames if writer else 0,
+                "bytes": writer.bytes if writer else 0,
+                "queued": self.queue.qsize(),
+                "dropped": self.dropped,
+                "failed": self.failed}
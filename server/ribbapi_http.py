@@ -16,24 +16,336 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import threading
 import urllib
 import html
 
+from animation.moodlight import MODES as MOODLIGHT_MODES
+from server import control_api
+from server.control_api import parse_colors
 
-class RibbaPiHttpServer(HTTPServer):
-    def __init__(self, ribbapi):
-        super().__init__(('', 8080), RibbaPiHttpHandler)
+HTTP_PORT = 8080
+HTTP_TIMEOUT = 10  # seconds a client may stall before it is disconnected
+# seconds a connection may take to send the head of its next request, idle
+# keep-alive connections and half sent requests do not hold a slot longer
+IDLE_TIMEOUT = 3
+MAX_CONNECTIONS = 32  # further connections are closed right away
+MAX_BODY_SIZE = 64 * 1024
+
+# The control page, static, it gets everything from /api/v2. Browsers
+# revalidate it and the library with their ETag, so a visit costs a 304 for
+# each unless something changed. /v1 is the former page without javascript.
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>RibbaPi Control</title><meta charset="UTF-8"></head>
+<body>
+<h1>RibbaPi</h1>
+<h2>Text display</h2>
+<form id="text">
+<fieldset>
+<legend>Enter text to be displayed on RibbaPi</legend>
+<input type="text" name="text"><br>
+<select name="font"><option value="">Default font</option></select>
+<input type="color" name="color" value="#ffffff"> Color<br>
+<input type="number" name="priority" value="0" min="-1000" max="1000"> Priority<br>
+<input type="number" name="ttl" min="0" max="86400" step="any" placeholder="default"> Seconds to wait at most<br>
+<input type="submit" value="Submit">
+</fieldset>
+</form>
+<div id="status"></div>
+<h2>Configuration</h2>
+<form id="configuration">
+<fieldset>
+<legend>Configuration of RibbaPi</legend>
+<input name="brightness" type="range" min="0.0" max="1.0" step="0.02"> Brightness level<br>
+<label><input type="checkbox" name="gameframe_activated">Gameframe Animations</label><br>
+<label><input type="checkbox" name="blm_activated">Blinkenlights Animations</label><br>
+<label><input type="checkbox" name="gif_activated">GIF Animations</label><br>
+<label><input type="checkbox" name="sprite_activated">Sprite Sheet Animations</label><br>
+<label><input type="checkbox" name="video_activated">Videos</label><br>
+<label><input type="checkbox" name="recording_activated">Stream Recordings</label><br>
+<label><input type="checkbox" name="record_streams">Record Streams</label><br>
+<label><input type="checkbox" name="clock_activated">Clock Animation</label><br>
+<label><input type="checkbox" name="moodlight_activated">Moodlight</label><br>
+<select name="moodlight_mode"></select> Moodlight mode<br>
+<label><input type="checkbox" name="play_random">Random order</label><br>
+<input type="submit" value="Update Configuration">
+</fieldset>
+</form>
+<h2>Animations</h2>
+<button id="next">Next animation!</button>
+<form id="library"></form>
+<p id="message"></p>
+<p><a href="/v1">Page without javascript</a></p>
+<script>
+"use strict";
+let libraryVersion = null;
+
+function element(tag, properties, ...children) {
+  const e = Object.assign(document.createElement(tag), properties);
+  e.append(...children);
+  return e;
+}
+
+async function batch(operations) {
+  const response = await fetch("/api/v2/batch", {
+    method: "POST", headers: {"Content-Type": "application/json"},
+    body: JSON.stringify(operations)});
+  const answer = await response.json();
+  const errors = (answer.results || []).filter(r => !r.ok).map(r => r.error);
+  if (answer.error) errors.push(answer.error);
+  document.getElementById("message").textContent = errors.join("; ");
+  if (answer.state) showState(answer.state);
+}
+
+function showState(state) {
+  const configuration = document.getElementById("configuration");
+  if (!configuration.dataset.filled) {
+    for (const mode of state.moodlight_modes)
+      configuration.moodlight_mode.append(element("option", {value: mode, textContent: mode}));
+    for (const font of state.fonts)
+      document.getElementById("text").font.append(element("option", {value: font, textContent: font}));
+    configuration.dataset.filled = "1";
+  }
+  if (!configuration.contains(document.activeElement)) {
+    for (const [key, value] of Object.entries(state.settings)) {
+      const input = configuration.elements[key];
+      if (!input) continue;
+      if (input.type === "checkbox") input.checked = value;
+      else input.value = value;
+    }
+  }
+  const lines = [];
+  if (state.current_animation) lines.push("Playing " + state.current_animation);
+  if (state.receiving_data) lines.push("Receiving a stream");
+  const q = state.text_queue;
+  lines.push(`Text queue: ${q.depth}/${q.capacity} pending, ${q.delivered} shown, ` +
+             `${q.dropped_capacity} dropped (full), ${q.dropped_expired} expired`);
+  for (const s of state.streams)
+    lines.push(`${s.input} ${s.source}: ${s.packets} packets, ${s.frames} frames, ` +
+               `${s.malformed} malformed, ${s.gaps} gaps`);
+  if (state.recording.path)
+    lines.push(`Recording ${state.recording.path}: ${state.recording.frames} frames, ` +
+               `${state.recording.dropped} dropped`);
+  for (const t of state.output || [])
+    lines.push(`Output to ${t.target}: ${t.fps.toFixed(1)} fps, ${t.lost} lost`);
+  document.getElementById("status").replaceChildren(
+    ...lines.map(line => element("p", {textContent: line})));
+  if (state.library_version !== libraryVersion) loadLibrary();
+}
+
+async function loadLibrary() {
+  // answered from the browser cache after a 304 if nothing changed
+  const answer = await (await fetch("/api/v2/library", {cache: "no-cache"})).json();
+  libraryVersion = answer.library_version;
+  const form = document.getElementById("library");
+  const fieldsets = [];
+  for (const [kind, entry] of Object.entries(answer.library)) {
+    if (!entry.animations.length) continue;
+    const selected = new Set(entry.selected);
+    const fieldset = element("fieldset", {}, element("legend", {textContent: "Choose " + kind + " animations to display"}));
+    fieldset.dataset.kind = kind;
+    for (const path of entry.animations) {
+      const play = element("a", {href: "#", textContent: path});
+      play.onclick = event => { event.preventDefault(); batch([{op: "play", path: path}]); };
+      fieldset.append(element("input", {type: "checkbox", value: path, checked: selected.has(path)}),
+                      " ", play, element("br"));
+    }
+    fieldsets.push(fieldset);
+  }
+  form.replaceChildren(...fieldsets, element("input", {type: "submit", value: "Submit"}));
+}
+
+document.getElementById("text").onsubmit = event => {
+  event.preventDefault();
+  const form = event.target;
+  const operation = {op: "display_text", text: form.text.value, color: form.color.value};
+  if (form.font.value) operation.font = form.font.value;
+  if (form.priority.value) operation.priority = parseInt(form.priority.value);
+  if (form.ttl.value) operation.ttl = parseFloat(form.ttl.value);
+  form.text.value = "";
+  batch([operation]);
+};
+document.getElementById("configuration").onsubmit = event => {
+  event.preventDefault();
+  const operations = [];
+  for (const input of event.target.elements) {
+    if (!input.name) continue;
+    const value = input.type === "checkbox" ? input.checked :
+                  input.type === "range" ? parseFloat(input.value) : input.value;
+    operations.push({op: "set", key: input.name, value: value});
+  }
+  batch(operations);
+};
+document.getElementById("library").onsubmit = event => {
+  event.preventDefault();
+  batch([...event.target.querySelectorAll("fieldset")].map(fieldset => ({
+    op: "select", kind: fieldset.dataset.kind,
+    paths: [...fieldset.querySelectorAll("input:checked")].map(input => input.value)})));
+};
+document.getElementById("next").onclick = () => batch([{op: "next_animation"}]);
+
+async function poll() {
+  try {
+    showState(await (await fetch("/api/v2/state")).json());
+  } finally {
+    setTimeout(poll, 2000);
+  }
+}
+poll();
+</script>
+</body>
+</html>
+""".encode("utf-8")
+INDEX_PAGE_ETAG = '"{}"'.format(hashlib.sha1(INDEX_PAGE).hexdigest())
+
+
+class RibbaPiHttpServer(ThreadingHTTPServer):
+    """Every connection is served by a thread of its own, so a slow client
+    does not hold up the others, and is closed after HTTP_TIMEOUT seconds
+    without progress. Handlers only set attributes of ribbapi or queue
+    work for it, the mainloop never waits for them."""
+    daemon_threads = True
+    block_on_close = False
+    request_queue_size = 64  # connections opened at once are not refused
+
+    def __init__(self, ribbapi, port=HTTP_PORT,
+                 max_connections=MAX_CONNECTIONS):
+        super().__init__(('', port), RibbaPiHttpHandler)
         self.ribbapi = ribbapi
+        self.library = control_api.LibraryCache()
+        self.connections = threading.BoundedSemaphore(max_connections)
+        self.rejected = 0
+
+    def process_request(self, request, client_address):
+        if not self.connections.acquire(blocking=False):
+            self.rejected += 1
+            self.shutdown_request(request)
+            return
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.connections.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connections.release()
 
 
 class RibbaPiHttpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections alive
+    timeout = HTTP_TIMEOUT
+    wbufsize = -1  # headers and body leave in one piece
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        self.connection.settimeout(IDLE_TIMEOUT)
+        super().handle_one_request()
+
+    def parse_request(self):
+        # the head has arrived, the body and the response may take longer
+        result = super().parse_request()
+        self.connection.settimeout(self.timeout)
+        return result
+
     def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
+        self.buffered(self.handle_get)
+
+    def do_POST(self):
+        self.post_data = self.read_body()
+        if self.post_data is not None:
+            self.buffered(self.handle_post)
+
+    def read_body(self):
+        """The body of the request or None if an error was sent"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            return None
+        if length > MAX_BODY_SIZE:
+            self.send_error(413)
+            return None
+        return self.rfile.read(length)
+
+    def buffered(self, handler):
+        """Run handler, which sets the response and writes the body to a
+        buffer, and send the response in one piece with its length, so the
+        connection can be kept alive"""
+        self.status = None
+        self.response_headers = []
+        self.body = []
+        try:
+            handler()
+        except Exception:
+            self.send_error(500)
+            raise
+        if self.status is None:
+            self.respond(404)
+            self.write("<html><body>Not found</body></html>".encode("utf-8"))
+        body = b"".join(self.body)
+        self.send_response(self.status)
+        for name, value in self.response_headers:
+            self.send_header(name, value)
+        if self.status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        try:
             self.end_headers()
-            self.wfile.write("""<html>
+            self.wfile.write(body)
+            self.wfile.flush()
+        except ConnectionError:
+            # the client went away, nobody is left to tell
+            self.close_connection = True
+
+    def respond(self, status, content_type='text/html; charset=utf-8'):
+        self.status = status
+        self.response_headers = [('Content-type', content_type)]
+
+    def respond_json(self, status, value):
+        self.respond(status, 'application/json')
+        self.response_headers.append(('Cache-Control', 'no-store'))
+        self.write(control_api.encode(value))
+
+    def respond_cached(self, body, etag, content_type):
+        """Answer 304 if the client has the current version"""
+        tags = self.headers.get('If-None-Match', '')
+        if tags.strip() == '*' or etag in (tag.strip().replace('W/', '', 1)
+                                           for tag in tags.split(',')):
+            self.status = 304
+            self.response_headers = []
+        else:
+            self.respond(200, content_type)
+            self.write(body)
+        self.response_headers += [('ETag', etag),
+                                  ('Cache-Control', 'no-cache')]
+
+    def redirect(self, location):
+        self.status = 303
+        self.response_headers = [('Location', location)]
+
+    def write(self, data):
+        self.body.append(data)
+
+    def handle_get(self):
+        if self.path == '/':
+            self.respond_cached(INDEX_PAGE, INDEX_PAGE_ETAG,
+                                'text/html; charset=utf-8')
+        if self.path == '/api/v2/state':
+            self.respond_json(200, control_api.state(self.server.ribbapi))
+        if self.path == '/api/v2/library':
+            body, etag = self.server.library.get(self.server.ribbapi)
+            self.respond_cached(body, etag, 'application/json')
+        if self.path == '/v1':
+            self.respond(200)
+            self.write("""<html>
             <head><title>RibbaPi Control</title><meta charset="UTF-8"></head>
             <body>
             <h1>RibbaPi</h1>
@@ -41,37 +353,117 @@ class RibbaPiHttpHandler(BaseHTTPRequestHandler):
             <form action="api/v1/displaytext" method="post">
             <fieldset>
             <legend>Enter text to be displayed on RibbaPi</legend>
-            <input type="text" name="message"><br>
+            <input type="text" name="message"><br>""".encode("utf-8"))
+            self.write("<select name=\"font\"><option value=\"\">Default font</option>".encode("utf-8"))
+            for font in self.server.ribbapi.text_fonts:
+                self.write("<option value=\"{0}\">{0}</option>".format(html.escape(font)).encode("utf-8"))
+            self.write("""</select>
+            <input type="color" name="color" value="#ffffff"> Color<br>
+            <input type="number" name="priority" value="0"> Priority<br>
+            <input type="number" name="ttl" min="0" step="any" placeholder="default"> Seconds to wait at most<br>
             <input type="submit" value="Submit">
             </fieldset>
             </form>""".encode("utf-8"))
 
-            self.wfile.write("""
+            stats = self.server.ribbapi.text_queue.stats()
+            self.write("<p>Text queue: {depth}/{capacity} pending "
+                             "(max {max_depth}), {delivered} shown, "
+                             "{coalesced} merged, {dropped_capacity} dropped "
+                             "(full), {dropped_expired} expired, wait mean "
+                             "{mean_wait:.1f}s max {max_wait:.1f}s</p>"
+                             "".format(**stats).encode("utf-8"))
+
+            for server in self.server.ribbapi.stream_servers:
+                for source in server.stats():
+                    self.write("<p>{input} {source}: {packets} "
+                                     "packets, {frames} frames, {malformed} "
+                                     "malformed, {gaps} gaps</p>"
+                                     "".format(**source).encode("utf-8"))
+                if server.jitter_buffer is not None and \
+                        server.jitter_buffer.received:
+                    self.write("<p>{} jitter buffer: {delay:.3f}s "
+                                     "delay, {fps:.1f} fps, {late} late, "
+                                     "{dropped} dropped, {duplicated} "
+                                     "duplicated</p>".format(
+                                         server.name,
+                                         **server.jitter_buffer.stats()
+                                     ).encode("utf-8"))
+            if self.server.ribbapi.sync is not None:
+                for node in self.server.ribbapi.sync.stats():
+                    if "frames" in node:
+                        self.write("<p>Sync follower {}: skew median "
+                                         "{median:+.1f}ms p95 {p95:.1f}ms "
+                                         "max {max:.1f}ms over {frames} "
+                                         "frames</p>".format(
+                                             html.escape(node["node"]),
+                                             **node).encode("utf-8"))
+                    else:
+                        self.write("<p>Sync leader {}: clock offset "
+                                         "{}</p>".format(
+                                             node["leader"],
+                                             "unknown" if node["offset"] is
+                                             None else "{:+.4f}s".format(
+                                                 node["offset"])
+                                         ).encode("utf-8"))
+            if self.server.ribbapi.stream_output is not None:
+                for target in self.server.ribbapi.stream_output.stats():
+                    self.write("<p>Output to {target}: {fps:.1f} fps, "
+                                     "{packets} packets, {lost} lost, "
+                                     "{skipped} frames skipped</p>".format(
+                                         **target).encode("utf-8"))
+            recording = self.server.ribbapi.stream_recorder.stats()
+            if recording["path"]:
+                self.write("<p>Recording {}: {frames} frames, {bytes} "
+                                 "bytes, {dropped} dropped</p>".format(html.escape(
+                                     recording["path"]), **recording
+                                 ).encode("utf-8"))
+
+            self.write("""
             <h2>Configuration</h2>
             <form action="api/v1/updateconfiguration" method="post">
             <fieldset>
             <legend>Configuration of RibbaPi</legend>""".encode("utf-8"))
 
-            self.wfile.write("<input name=\"brightness\" type=\"range\" min=\"0.0\" max=\"1.0\" step=\"0.02\" value=\"{}\"/> Brightness level<br>".format(self.server.ribbapi.display.brightness).encode("utf-8"))
+            self.write("<input name=\"brightness\" type=\"range\" min=\"0.0\" max=\"1.0\" step=\"0.02\" value=\"{}\"/> Brightness level<br>".format(self.server.ribbapi.display.brightness).encode("utf-8"))
 
             checkbox = "<input type=\"checkbox\" name=\"gameframe_activated\" value=\"1\" checked>Gameframe Animations<br>" if self.server.ribbapi.gameframe_activated else "<input type=\"checkbox\" name=\"gameframe_activated\" value=\"0\">Gameframe Animations<br>"
-            self.wfile.write(checkbox.encode("utf-8"))
+            self.write(checkbox.encode("utf-8"))
 
             checkbox = "<input type=\"checkbox\" name=\"blm_activated\" value=\"1\" checked>Blinkenlights Animations<br>" if self.server.ribbapi.blm_activated else "<input type=\"checkbox\" name=\"blm_activated\" value=\"0\">Blinkenlights Animations<br>"
-            self.wfile.write(checkbox.encode("utf-8"))
+            self.write(checkbox.encode("utf-8"))
+
+            checkbox = "<input type=\"checkbox\" name=\"gif_activated\" value=\"1\" checked>GIF Animations<br>" if self.server.ribbapi.gif_activated else "<input type=\"checkbox\" name=\"gif_activated\" value=\"0\">GIF Animations<br>"
+            self.write(checkbox.encode("utf-8"))
+
+            checkbox = "<input type=\"checkbox\" name=\"sprite_activated\" value=\"1\" checked>Sprite Sheet Animations<br>" if self.server.ribbapi.sprite_activated else "<input type=\"checkbox\" name=\"sprite_activated\" value=\"0\">Sprite Sheet Animations<br>"
+            self.write(checkbox.encode("utf-8"))
+
+            checkbox = "<input type=\"checkbox\" name=\"video_activated\" value=\"1\" checked>Videos<br>" if self.server.ribbapi.video_activated else "<input type=\"checkbox\" name=\"video_activated\" value=\"0\">Videos<br>"
+            self.write(checkbox.encode("utf-8"))
+
+            checkbox = "<input type=\"checkbox\" name=\"recording_activated\" value=\"1\" checked>Stream Recordings<br>" if self.server.ribbapi.recording_activated else "<input type=\"checkbox\" name=\"recording_activated\" value=\"0\">Stream Recordings<br>"
+            self.write(checkbox.encode("utf-8"))
+
+            checkbox = "<input type=\"checkbox\" name=\"record_streams\" value=\"1\" checked>Record Streams<br>" if self.server.ribbapi.stream_recorder.enabled else "<input type=\"checkbox\" name=\"record_streams\" value=\"0\">Record Streams<br>"
+            self.write(checkbox.encode("utf-8"))
 
             checkbox = "<input type=\"checkbox\" name=\"clock_activated\" value=\"1\" checked>Clock Animation<br>" if self.server.ribbapi.clock_activated else "<input type=\"checkbox\" name=\"clock_activated\" value=\"0\">Clock Animations<br>"
-            self.wfile.write(checkbox.encode("utf-8"))
+            self.write(checkbox.encode("utf-8"))
 
             checkbox = "<input type=\"checkbox\" name=\"moodlight_activated\" value=\"1\" checked>Moodlight<br>" if self.server.ribbapi.moodlight_activated else "<input type=\"checkbox\" name=\"moodlight_activated\" value=\"0\">Moodlight<br>"
-            self.wfile.write(checkbox.encode("utf-8"))
+            self.write(checkbox.encode("utf-8"))
+
+            self.write("<select name=\"moodlight_mode\">".encode("utf-8"))
+            for mode in MOODLIGHT_MODES:
+                self.write("<option value=\"{0}\"{1}>{0}</option>".format(mode, " selected" if mode == self.server.ribbapi.moodlight_mode else "").encode("utf-8"))
+            self.write("</select> Moodlight mode<br>".encode("utf-8"))
 
-            self.wfile.write("""
+            self.write("""
             <input type="submit" value="Update Configuration">
             </fieldset>
             </form>""".encode("utf-8"))
 
-            self.wfile.write("""<h2>Animations</h2>
+            self.write("""<h2>Animations</h2>
 
             <form>
             <button formaction="api/v1/next_animation" formmethod="post">Next animation!</button>
@@ -81,48 +473,68 @@ class RibbaPiHttpHandler(BaseHTTPRequestHandler):
             <fieldset>
             <legend>Choose gameframe animations to display</legend>""".encode("utf-8"))
             for animation in self.server.ribbapi.gameframe_animations:
-                self.wfile.write("""<input type="checkbox"
+                self.write("""<input type="checkbox"
                                             name="animations"
                                             value="{}" {}> <a href="{}">{}</a><br>""".format(
                                             animation,
                                             "checked" if animation in self.server.ribbapi.gameframe_selected else "",
                                             "playnext/" + animation,
                                             animation).encode("utf-8"))
-            self.wfile.write("""<input type="submit" value="Submit">
+            self.write("""<input type="submit" value="Submit">
             </fieldset>
             </form>""".encode("utf-8"))
-            self.wfile.write("</body></html>".encode("utf-8"))
-        print(self.path)
+            self.write("</body></html>".encode("utf-8"))
         if self.path.startswith("/playnext"):
             self.server.ribbapi.set_next_animation(self.path[len("/playnext/"):])
             self.server.ribbapi.stop_current_animation()
-            self.send_response(303)
-            self.send_header('Location', '/')
-            self.end_headers()
+            self.redirect('/v1')
 
 
-    def do_POST(self):
+    def handle_post(self):
+        if self.path == "/api/v2/batch":
+            try:
+                operations = json.loads(self.post_data)
+                results = control_api.apply_batch(self.server.ribbapi,
+                                                  operations)
+            except ValueError as e:  # includes invalid JSON
+                self.respond_json(400, {"error": str(e)})
+            else:
+                self.respond_json(200, {"results": results,
+                                        "state": control_api.state(
+                                            self.server.ribbapi)})
         if self.path.startswith("/api/v1/next_animation"):
             self.server.ribbapi.stop_current_animation()
-            self.send_response(303)
-            self.send_header('Location', '/')
-            self.end_headers()
+            self.redirect('/v1')
         if self.path.startswith("/api/v1/displaytext"):
-            content_length = int(self.headers['Content-Length'])
             if self.headers['Content-Type'] == "application/x-www-form-urlencoded":
-                post_data = self.rfile.read(content_length)
+                post_data = self.post_data
                 post_data = str(post_data, 'utf-8')
                 post_data_dict = urllib.parse.parse_qs(post_data)
                 post_data_dict = html.unescape(post_data_dict)
                 message = post_data_dict["message"][0]
-                self.server.ribbapi.text_queue.put(message)
-                self.send_response(303)
-                self.send_header('Location', '/')
-                self.end_headers()
+                options = {}
+                if "font" in post_data_dict and \
+                        post_data_dict["font"][0] in self.server.ribbapi.text_fonts:
+                    options["text_font"] = post_data_dict["font"][0]
+                if "color" in post_data_dict:
+                    colors = parse_colors(post_data_dict["color"][0])
+                    if colors:
+                        options["color"] = colors
+                for field, parse, check in (
+                        ("priority", int, control_api.text_priority),
+                        ("ttl", float, control_api.text_ttl)):
+                    if field in post_data_dict:
+                        try:
+                            options[field] = check(parse(post_data_dict[field][0]))
+                        except ValueError:
+                            # an invalid field is ignored on its own
+                            pass
+                self.server.ribbapi.display_text(message, **options)
+                self.redirect('/v1')
                 # self.send_response(200)
                 # self.send_header('Content-type', 'text/html')
                 # self.end_headers()
-                # self.wfile.write("""<html>
+                # self.write("""<html>
                 # <body>Message is now displayed on RibbaPi<br><br>
                 # <script>
                 # document.write('<a href="' + document.referrer + '">Go Back</a>');
@@ -130,19 +542,17 @@ class RibbaPiHttpHandler(BaseHTTPRequestHandler):
                 # </body>
                 # </html>""".encode("utf-8"))
         if self.path.startswith("/api/v1/setgameframe"):
-            content_length = int(self.headers['Content-Length'])
             if self.headers['Content-Type'] == "application/x-www-form-urlencoded":
-                post_data = self.rfile.read(content_length)
+                post_data = self.post_data
                 post_data = str(post_data, 'utf-8')
                 post_data_dict = urllib.parse.parse_qs(post_data)
                 if "animations" in post_data_dict:
                     selected_animations = post_data_dict["animations"]
                     selected_animations = html.unescape(selected_animations)
                     self.server.ribbapi.gameframe_selected = selected_animations
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    self.wfile.write("""<html>
+                    self.server.ribbapi.library_version += 1
+                    self.respond(200)
+                    self.write("""<html>
                     <body>Gameframe animations set<br><br>
                     <script>
                     document.write('<a href="' + document.referrer + '">Go Back</a>');
@@ -151,10 +561,9 @@ class RibbaPiHttpHandler(BaseHTTPRequestHandler):
                     </html>""".encode("utf-8"))
                 else:
                     self.server.ribbapi.gameframe_selected = []
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    self.wfile.write("""<html>
+                    self.server.ribbapi.library_version += 1
+                    self.respond(200)
+                    self.write("""<html>
                     <body>Gameframe animations set<br><br>
                     <script>
                     document.write('<a href="' + document.referrer + '">Go Back</a>');
@@ -162,25 +571,153 @@ class RibbaPiHttpHandler(BaseHTTPRequestHandler):
                     </body>
                     </html>""".encode("utf-8"))
         if self.path.startswith("/api/v1/updateconfiguration"):
-            content_length = int(self.headers['Content-Length'])
             if self.headers['Content-Type'] == "application/x-www-form-urlencoded":
-                post_data = self.rfile.read(content_length)
+                post_data = self.post_data
                 post_data = str(post_data, 'utf-8')
                 post_data_dict = urllib.parse.parse_qs(post_data)
                 if "brightness" in post_data_dict:
                     self.server.ribbapi.display.brightness = float(post_data_dict["brightness"][0])
                 self.server.ribbapi.gameframe_activated = True if "gameframe_activated" in post_data_dict else False
                 self.server.ribbapi.blm_activated = True if "blm_activated" in post_data_dict else False
+                self.server.ribbapi.gif_activated = True if "gif_activated" in post_data_dict else False
+                self.server.ribbapi.sprite_activated = True if "sprite_activated" in post_data_dict else False
+                self.server.ribbapi.video_activated = True if "video_activated" in post_data_dict else False
+                self.server.ribbapi.recording_activated = True if "recording_activated" in post_data_dict else False
+                if "record_streams" in post_data_dict:
+                    self.server.ribbapi.stream_recorder.enabled = True
+                else:
+                    self.server.ribbapi.stream_recorder.stop()
                 self.server.ribbapi.clock_activated = True if "clock_activated" in post_data_dict else False
                 self.server.ribbapi.moodlight_activated = True if "moodlight_activated" in post_data_dict else False
+                if post_data_dict.get("moodlight_mode", [None])[0] in MOODLIGHT_MODES:
+                    self.server.ribbapi.moodlight_mode = post_data_dict["moodlight_mode"][0]
 
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write("""<html>
+                self.respond(200)
+                self.write("""<html>
                 <body>RibbaPi configuration updated!<br><br>
                 <script>
                 document.write('<a href="' + document.referrer + '">Go Back</a>');
                 </script>
                 </body>
                 </html>""".encode("utf-8"))
+
+
+def run_benchmark(clients=8, requests=200, stalled=0, threaded=True,
+                  stall_timeout=2, paths=("/v1",), library=50):
+    """Latency of a visit of the control page (a GET of each of paths,
+    revalidated with the ETag of the previous answer) with clients visiting
+    it at the same time over keep-alive connections, while stalled
+    connections never finish their request. threaded=False runs the former
+    single threaded HTTP/1.0 server for comparison (its handler gets
+    stall_timeout, without it a stalled client blocks it for good)."""
+    import http.client
+    import socket
+    import time
+    from http.server import HTTPServer
+    from types import SimpleNamespace
+
+    import numpy as np
+
+    stats = {"depth": 0, "capacity": 16, "max_depth": 0, "delivered": 0,
+             "coalesced": 0, "dropped_capacity": 0, "dropped_expired": 0,
+             "mean_wait": 0.0, "max_wait": 0.0}
+    ribbapi = SimpleNamespace(
+        text_fonts=["resources/fonts/{}.ttf".format(i) for i in range(5)],
+        text_queue=SimpleNamespace(stats=lambda: stats),
+        stream_servers=[], sync=None, stream_output=None,
+        stream_recorder=SimpleNamespace(enabled=False,
+                                        stats=lambda: {"path": None}),
+        display=SimpleNamespace(brightness=0.5),
+        current_animation=None, receiving_data=threading.Event(),
+        clock_activated=True, clock_duration=10, clock_show_every=600,
+        moodlight_activated=False, moodlight_mode=MOODLIGHT_MODES[0],
+        play_random=True, library_version=1)
+    for kind in control_api.LIBRARY_KINDS:
+        animations = ["resources/animations/{}/{}".format(kind, i)
+                      for i in range(library if kind == "gameframe" else 0)]
+        setattr(ribbapi, kind + "_animations", animations)
+        setattr(ribbapi, kind + "_selected", animations)
+        setattr(ribbapi, kind + "_activated", kind == "gameframe")
+        setattr(ribbapi, kind + "_repeat", -1)
+        setattr(ribbapi, kind + "_duration", 60)
+
+    if threaded:
+        server = RibbaPiHttpServer(ribbapi, port=0)
+        server.RequestHandlerClass = type(
+            "QuietHandler", (RibbaPiHttpHandler,),
+            {"timeout": stall_timeout,
+             "log_message": lambda *args: None})
+    else:
+        server = HTTPServer(('', 0), type(
+            "SingleThreadedHandler", (RibbaPiHttpHandler,),
+            {"protocol_version": "HTTP/1.0", "timeout": stall_timeout,
+             "log_message": lambda *args: None}))
+        server.ribbapi = ribbapi
+        server.library = control_api.LibraryCache()
+    port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    stalls = []
+    for _ in range(stalled):
+        stall = socket.create_connection(("127.0.0.1", port))
+        stall.sendall(b"GET / HTTP/1.1\r\nHost: ribbapi\r\n")
+        stalls.append(stall)
+    time.sleep(0.1)
+
+    latencies = [[] for _ in range(clients)]
+
+    def client(i):
+        connection = http.client.HTTPConnection("127.0.0.1", port,
+                                                timeout=30)
+        etags = {}
+        for _ in range(requests):
+            start = time.perf_counter()
+            for path in paths:
+                headers = {}
+                if path in etags:
+                    headers["If-None-Match"] = etags[path]
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.getheader("ETag"):
+                    etags[path] = response.getheader("ETag")
+                if response.will_close:
+                    connection.close()
+            latencies[i].append(time.perf_counter() - start)
+        connection.close()
+
+    workers = [threading.Thread(target=client, args=(i,))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    for stall in stalls:
+        stall.close()
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    latencies = np.array([latency for per_client in latencies
+                          for latency in per_client]) * 1000
+    print("{:15} {} {} animations, {} clients, {} stalled: {:.0f} visits/s, "
+          "latency median {:.1f}ms p95 {:.1f}ms max {:.1f}ms".format(
+              "threaded" if threaded else "single threaded",
+              " ".join(paths), library, clients,
+              stalled, len(latencies) / elapsed, np.median(latencies),
+              np.percentile(latencies, 95), latencies.max()))
+
+
+if __name__ == "__main__":
+    # python3 -m server.ribbapi_http
+    for library in (50, 2000):
+        run_benchmark(8, 100, paths=("/v1",), library=library)
+        run_benchmark(8, 100, library=library,
+                      paths=("/", "/api/v2/state", "/api/v2/library"))
+    run_benchmark(1, 500)
+    run_benchmark(8, 200)
+    run_benchmark(8, 200, stalled=4)
+    run_benchmark(1, 500, threaded=False)
+    run_benchmark(8, 20, stalled=1, threaded=False)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Frame input for renderers running on the same machine.
+
+RibbaPi creates a block of shared memory holding a ring of frame slots and
+listens on a unix datagram socket. A renderer writes a frame directly into
+the next free slot and sends the number of the frame (8 bytes) to the
+socket; RibbaPi presents the slot as it is, without copying it.
+
+    writer = SharedFrameWriter()
+    frame = writer.acquire()  # (height, width, 3) uint8 view into the slot
+    frame[:] = ...
+    writer.publish()
+
+Memory layout, all counters uint64:
+
+    magic, version, width, height, slots, in_use, published, 0,
+    sequence of every slot,
+    slots frames of (height, width, 3) uint8
+
+in_use is the number of the oldest frame RibbaPi may still use: the one
+the display shows or the one waiting for the mainloop. It only advances
+once the mainloop has taken a newer frame, or a frame was dropped. That
+frame and the ones after it must not be overwritten, so a writer can be
+at most slots - 1 frames ahead of it. published is the number of the last
+frame a writer published, a new writer continues after it.
+"""
+
+from multiprocessing import shared_memory
+import os
+import socket
+import time
+
+import numpy as np
+
+from server.stream import StreamProtocol, StreamServer
+
+SHARED_FRAMES_NAME = "ribbapi_frames"
+SHARED_FRAMES_SOCKET = "/tmp/ribbapi_frames.sock"
+SHARED_FRAMES_SLOTS = 4
+MAGIC = 0x52494242415049  # "RIBBAPI"
+VERSION = 1
+HEADER_FIELDS = 8
+IN_USE = 5
+PUBLISHED = 6
+
+
+class SharedFrameRing():
+    """numpy views of the ring in a shared memory block"""
+    def __init__(self, shm, width=None, height=None, slots=None):
+        self.shm = shm
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=shm.buf)
+        if width is not None:
+            header[:] = (MAGIC, VERSION, width, height, slots, 0, 0, 0)
+        elif header[0] != MAGIC or header[1] != VERSION:
+            raise ValueError("{} is no RibbaPi frame ring".format(shm.name))
+        self.width, self.height, self.slots = (int(v) for v in header[2:5])
+        self.header = header
+        self.sequences = np.ndarray((self.slots,), dtype=np.uint64,
+                                    buffer=shm.buf, offset=header.nbytes)
+        self.frames = np.ndarray((self.slots, self.height, self.width, 3),
+                                 dtype=np.uint8, buffer=shm.buf,
+                                 offset=self.frames_offset(self.slots))
+
+    @staticmethod
+    def frames_offset(slots):
+        # frames start on a cache line
+        return -(-(HEADER_FIELDS + slots) * 8 // 64) * 64
+
+    @classmethod
+    def size(cls, width, height, slots):
+        return cls.frames_offset(slots) + slots * height * width * 3
+
+    def release(self):
+        """Drop the views, the shared memory can only be closed without
+        them"""
+        self.header = self.sequences = self.frames = None
+
+
+class SharedFrameServer(StreamServer):
+    name = "shared memory"
+
+    def __init__(self, ribbapi, name=SHARED_FRAMES_NAME,
+                 socket_path=SHARED_FRAMES_SOCKET, slots=SHARED_FRAMES_SLOTS):
+        super().__init__(ribbapi)
+        if slots < 2:
+            raise ValueError("a frame ring needs at least 2 slots")
+        width, height = ribbapi.display.width, ribbapi.display.height
+        try:
+            # left over from a previous run
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(
+            name, create=True, size=SharedFrameRing.size(width, height, slots))
+        self.ring = SharedFrameRing(self.shm, width, height, slots)
+        # frames are handed out as these views, so taken frames are known
+        self.views = list(self.ring.frames)
+        self.view_slots = {id(view): slot
+                           for slot, view in enumerate(self.views)}
+        self.newest = None  # number of the newest frame received
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(socket_path)
+        self.socket.setblocking(False)
+        self.server_address = socket_path
+        self.transport = None
+        self.last_sequence = None
+        self.packets = 0
+        self.frames = 0
+        self.malformed = 0
+        self.gaps = 0
+
+    async def create_endpoint(self):
+        self.transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: StreamProtocol(self), sock=self.socket)
+
+    def close_endpoint(self):
+        self.transport.close()
+
+    def server_close(self):
+        self.socket.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.views = self.view_slots = None
+        self.shown_frame = self.waiting_frame = None
+        self.ring.release()
+        try:
+            self.shm.close()
+        except BufferError:
+            # the display still shows a frame of the ring
+            pass
+        self.shm.unlink()
+        super().server_close()
+
+    def process_packet(self, data, addr=None):
+        self.packets += 1
+        if len(data) != 8:
+            self.malformed += 1
+            return
+        sequence = int.from_bytes(data, "little")
+        slot = sequence % self.ring.slots
+        if self.ring.sequences[slot] != sequence:
+            # overwritten already or never written
+            self.malformed += 1
+            return
+        if self.last_sequence is not None and \
+                sequence != self.last_sequence + 1:
+            self.gaps += 1
+        self.last_sequence = sequence
+        self.newest = sequence
+        self.frames += 1
+        self.stream_started()
+        self.update_time()
+        self.present(self.views[slot])
+        # unless it waits for the mainloop now, the slot is free again
+        self.release_slots()
+
+    def take_frame(self):
+        frame = super().take_frame()
+        if frame is not None:
+            self.release_slots()
+        return frame
+
+    def release_slots(self):
+        """Let writers go on up to slots - 1 frames past the oldest frame
+        still in use (shown or waiting, not copied by the jitter buffer)"""
+        with self.frame_lock:
+            if self.newest is None:
+                return
+            in_use = [int(self.ring.sequences[self.view_slots[id(frame)]])
+                      for frame in (self.shown_frame, self.waiting_frame)
+                      if frame is not None and id(frame) in self.view_slots]
+            self.ring.header[IN_USE] = min(in_use, default=self.newest + 1)
+
+    def check_for_timeout(self):
+        super().check_for_timeout()
+        if self.last_time_received is None:
+            self.last_sequence = None
+
+    def stats(self):
+        if self.last_sequence is None and not self.packets:
+            return []
+        return [{"input": self.name, "source": self.socket_path,
+                 "packets": self.packets, "frames": self.frames,
+                 "malformed": self.malformed, "gaps": self.gaps,
+                 "last_seen": None}]
+
+
+def attach(name, track=False):
+    """Open an existing shared memory block. Unless track is set the
+    resource tracker of this process does not remove it when the process
+    ends; set it only when the block was created in this process."""
+    if track:
+        return shared_memory.SharedMemory(name)
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before python 3.13
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedFrameWriter():
+    """Client helper for renderers: write frames into the ring of a running
+    RibbaPi"""
+    def __init__(self, name=SHARED_FRAMES_NAME,
+                 socket_path=SHARED_FRAMES_SOCKET, track=False):
+        self.shm = attach(name, track)
+        self.ring = SharedFrameRing(self.shm)
+        self.width, self.height = self.ring.width, self.ring.height
+        self.socket_path = socket_path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # continue after the frames of a previous writer
+        self.sequence = int(self.ring.header[PUBLISHED]) + 1
+        self.acquired = None
+
+    def acquire(self, timeout=None):
+        """View of the slot of the next frame, waiting until RibbaPi has
+        released it. Returns None if that takes longer than timeout."""
+        start = time.perf_counter()
+        while self.sequence - int(self.ring.header[IN_USE]) > \
+                self.ring.slots - 1:
+            waited = time.perf_counter() - start
+            if timeout is not None and waited > timeout:
+                return None
+            # RibbaPi usually takes a frame within microseconds
+            time.sleep(0 if waited < 0.001 else 0.0005)
+        self.acquired = self.sequence % self.ring.slots
+        return self.ring.frames[self.acquired]
+
+    def publish(self):
+        """Hand the acquired frame to RibbaPi"""
+        if self.acquired is None:
+            raise RuntimeError("no frame acquired")
+        self.ring.sequences[self.acquired] = self.sequence
+        self.ring.header[PUBLISHED] = self.sequence
+        self.acquired = None
+        try:
+            self.socket.sendto(self.sequence.to_bytes(8, "little"),
+                               self.socket_path)
+        finally:
+            self.sequence += 1
+
+    def write(self, frame, timeout=None):
+        """Copy frame into the ring and publish it. Returns False if no slot
+        became free within timeout."""
+        slot = self.acquire(timeout)
+        if slot is None:
+            return False
+        slot[:] = frame
+        self.publish()
+        return True
+
+    def close(self):
+        self.socket.close()
+        self.ring.release()
+        self.shm.close()
+
+
+def run_benchmark(width=16, height=16, frames=5000):
+    """Latency (one frame in flight) and throughput of the shared memory
+    ring compared to tpm2.net over loopback. The writer runs in this
+    process, but goes through the same syscalls as a separate one. Both
+    include waking up a thread standing in for the mainloop and taking the
+    frame."""
+    import threading
+    from types import SimpleNamespace
+    from server.tpm2_net import Tpm2NetServer, TPM2_START, TPM2_DATA, \
+        TPM2_END
+
+    def ribbapi():
+        return SimpleNamespace(
+            display=SimpleNamespace(width=width, height=height),
+            receiving_data=threading.Event(), wake=None,
+            current_animation=None)
+
+    def measure(label, server, send):
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        # the mainloop takes the newest frame whenever it is woken up
+        woken = threading.Event()
+        taken = threading.Event()
+        running = True
+        server.ribbapi.wake = woken.set
+
+        def mainloop():
+            while running:
+                woken.wait(0.01)
+                woken.clear()
+                if server.take_frame() is not None:
+                    taken.set()
+
+        mainloop_thread = threading.Thread(target=mainloop, daemon=True)
+        mainloop_thread.start()
+        latencies = np.empty((frames // 5,))
+        for i in range(len(latencies)):
+            taken.clear()
+            start = time.perf_counter()
+            send()
+            taken.wait()
+            latencies[i] = time.perf_counter() - start
+        sent = server_frames(server)
+        start = time.perf_counter()
+        for i in range(frames):
+            send()
+            sent += 1
+            # do not overrun the receive buffer of the server
+            while sent - server_frames(server) > 64:
+                time.sleep(0)
+        while server_frames(server) < sent and \
+                time.perf_counter() - start < 30:
+            time.sleep(0)
+        elapsed = time.perf_counter() - start
+        running = False
+        mainloop_thread.join()
+        server.shutdown()
+        thread.join()
+        print("{:14} {}x{}: latency mean {:.0f}us p99 {:.0f}us, {:.0f} "
+              "frames/s".format(label, width, height,
+                                latencies.mean() * 1e6,
+                                np.percentile(latencies, 99) * 1e6,
+                                frames / elapsed))
+
+    def server_frames(server):
+        if isinstance(server, SharedFrameServer):
+            return server.frames
+        return sum(s["frames"] for s in server.stats())
+
+    image = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+
+    server = SharedFrameServer(ribbapi(), name="ribbapi_benchmark",
+                               socket_path="/tmp/ribbapi_benchmark.sock")
+    writer = SharedFrameWriter("ribbapi_benchmark",
+                               "/tmp/ribbapi_benchmark.sock", track=True)
+    measure("shared memory", server, lambda: writer.write(image))
+    writer.close()
+    server.server_close()
+
+    server = Tpm2NetServer(ribbapi(), port=0)
+    payload = image.tobytes()
+    packet = bytes((TPM2_START, TPM2_DATA, len(payload) >> 8,
+                    len(payload) & 0xFF, 1, 1)) + payload + bytes((TPM2_END,))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = ("127.0.0.1", server.server_address[1])
+    measure("tpm2.net", server, lambda: client.sendto(packet, address))
+    client.close()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    # python3 -m server.shared_frames
+    run_benchmark(16, 16)
+    run_benchmark(32, 32)
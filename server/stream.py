@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Common parts of the network stream inputs (tpm2.net, Art-Net, E1.31,
+Open Pixel Control).
+
+A stream server receives data on its own asyncio event loop, assembles
+frames per source and hands completed frames to the mainloop, which takes
+the newest one when it is woken up; the event loop never waits for the
+display. While any stream
+is active ribbapi.receiving_data is set, which stops animations and texts;
+it is cleared once every stream has been quiet for its timeout. A recorder
+(server.recorder) can keep the frames of the streams.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import numpy as np
+
+from server.jitter_buffer import JitterBuffer
+
+# bytes, bursts of packets wait here while the loop is busy. The kernel
+# limits this to net.core.rmem_max.
+RECEIVE_BUFFER = 256 * 1024
+MAX_SOURCES = 16
+
+_active_streams = set()
+_active_lock = threading.Lock()
+
+
+class FrameRing():
+    """Preallocated frame buffers that frames are assembled in.
+
+    A completed frame is handed out as is and the next frame is assembled
+    in another buffer, so no frame is copied. in_use returns the frames the
+    mainloop shows or has not taken yet, their buffers are skipped. With
+    four buffers one is always free: the frame shown, the one waiting, the
+    one just completed and the next."""
+    def __init__(self, width, height, buffers=4, in_use=tuple):
+        self.buffers = [np.zeros((height, width, 3), dtype=np.uint8)
+                        for _ in range(buffers)]
+        self.index = 0
+        self.flat = self.buffers[0].reshape(-1)  # view, writes go through
+        self.in_use = in_use
+
+    def write(self, offset, data, data_offset, count):
+        """Copy count bytes of data starting at data_offset to offset of the
+        current frame, clipped to the frame"""
+        count = max(0, min(count, self.flat.size - offset))
+        if count:
+            self.flat[offset:offset + count] = np.frombuffer(
+                data, dtype=np.uint8, count=count, offset=data_offset)
+
+    def complete(self):
+        """Hand out the current frame and continue in the next free
+        buffer"""
+        frame = self.buffers[self.index]
+        in_use = self.in_use()
+        for step in range(1, len(self.buffers)):
+            index = (self.index + step) % len(self.buffers)
+            if not any(self.buffers[index] is used for used in in_use):
+                break
+        self.index = index
+        self.flat = self.buffers[self.index].reshape(-1)
+        return frame
+
+
+class StreamAssembler():
+    """Turns the packets of one source into frames. Subclasses implement
+    process_packet."""
+    def __init__(self, width, height):
+        self.ring = FrameRing(width, height)
+        self.packets = 0  # packets with data for the display
+        self.frames = 0
+        self.malformed = 0
+        self.gaps = 0  # packets that did not follow the one before
+
+    def reset(self):
+        """Forget the state of the stream, called when it timed out"""
+
+    def process_packet(self, data):
+        """Process one datagram. Returns the completed frame if this packet
+        completed one, otherwise None. Raises ValueError if data is no
+        packet this assembler understands."""
+        raise NotImplementedError
+
+
+class StreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.process_packet(data, addr)
+
+    def error_received(self, exc):
+        print("{}: {}".format(self.server.name, exc))
+
+
+class StreamServer():
+    """Stream receiver running on its own asyncio event loop.
+
+    serve_forever, shutdown and server_close work like those of a
+    socketserver, so it is run in a thread the same way. Every source gets
+    its own assembler and statistics. The stream timeout is a single
+    callback scheduled on the loop. Subclasses create the endpoint."""
+    name = "stream"
+
+    def __init__(self, ribbapi):
+        self.ribbapi = ribbapi
+        self.timeout = 3  # seconds
+        self.last_time_received = None
+        self.timeout_handle = None
+        self.sources = {}  # (host, port) -> StreamAssembler
+        self.last_seen = {}  # (host, port) -> time.time()
+        self.loop = asyncio.new_event_loop()
+        self.server_address = None
+        self.jitter_buffer = None
+        self.recorder = None  # server.recorder.StreamRecorder
+        self.frame_lock = threading.Lock()
+        self.waiting_frame = None  # not taken by the mainloop yet
+        self.shown_frame = None  # taken last by the mainloop
+
+    async def create_endpoint(self):
+        raise NotImplementedError
+
+    def close_endpoint(self):
+        raise NotImplementedError
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.create_endpoint())
+        try:
+            self.loop.run_forever()
+        finally:
+            if self.jitter_buffer is not None:
+                self.jitter_buffer.close()
+            self.close_endpoint()
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        if not self.loop.is_running():
+            self.loop.close()
+        self.stream_stopped()
+
+    def stream_started(self):
+        # tell ribbapi that stream data is received
+        with _active_lock:
+            _active_streams.add(self)
+            if self.ribbapi.receiving_data.is_set():
+                return
+            self.ribbapi.receiving_data.set()
+        self.ribbapi.wake()
+
+    def stream_stopped(self):
+        with _active_lock:
+            _active_streams.discard(self)
+            if _active_streams or not self.ribbapi.receiving_data.is_set():
+                return
+            self.ribbapi.receiving_data.clear()
+        self.ribbapi.wake()
+        if self.recorder is not None:
+            self.recorder.finish()
+
+    def update_time(self):
+        # to detect timeout store current time
+        self.last_time_received = self.loop.time()
+        if self.timeout_handle is None:
+            self.timeout_handle = self.loop.call_later(self.timeout,
+                                                       self.check_for_timeout)
+
+    def check_for_timeout(self):
+        remaining = self.last_time_received + self.timeout - self.loop.time()
+        if remaining > 0:
+            self.timeout_handle = self.loop.call_later(remaining,
+                                                       self.check_for_timeout)
+            return
+        self.timeout_handle = None
+        self.last_time_received = None
+        for assembler in self.sources.values():
+            assembler.reset()
+        self.stream_stopped()
+
+    def enable_jitter_buffer(self, delay, max_frames=16):
+        """Release frames at the rate of the source, delay seconds after
+        they arrived, instead of as soon as they are complete"""
+        self.jitter_buffer = JitterBuffer(self.loop, self.present_now, delay,
+                                          max_frames)
+
+    def present(self, frame):
+        if self.recorder is not None:
+            self.recorder.record(frame)
+        if self.jitter_buffer is not None:
+            self.jitter_buffer.push(frame)
+        else:
+            self.present_now(frame)
+
+    def present_now(self, frame):
+        """Hand frame to the mainloop, replacing one it has not taken yet"""
+        if self.ribbapi.current_animation:
+            return
+        with self.frame_lock:
+            self.waiting_frame = frame
+        self.ribbapi.wake()
+
+    def take_frame(self):
+        """The newest frame or None, called by the mainloop. The frame stays
+        in use until the next one is taken."""
+        with self.frame_lock:
+            frame = self.waiting_frame
+            if frame is not None:
+                self.shown_frame, self.waiting_frame = frame, None
+        return frame
+
+    def frames_in_use(self):
+        """Frames that must not be overwritten"""
+        with self.frame_lock:
+            return self.shown_frame, self.waiting_frame
+
+    def stats(self):
+        """Statistics of every source seen recently, from one snapshot of
+        the sources the loop thread changes meanwhile"""
+        return [self.source_stats(addr, assembler)
+                for addr, assembler in list(self.sources.items())]
+
+    def source_stats(self, addr, assembler):
+        return {"input": self.name,
+                "source": "{}:{}".format(*addr) if addr else "-",
+                "packets": assembler.packets,
+                "frames": assembler.frames,
+                "malformed": assembler.malformed,
+                "gaps": assembler.gaps,
+                "last_seen": self.last_seen.get(addr)}
+
+
+class UdpStreamServer(StreamServer):
+    """Receiver of a datagram stream, one assembler per source address"""
+    def __init__(self, ribbapi, port, receive_buffer=RECEIVE_BUFFER):
+        super().__init__(ribbapi)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if receive_buffer:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   receive_buffer)
+        self.receive_buffer = self.socket.getsockopt(socket.SOL_SOCKET,
+                                                     socket.SO_RCVBUF)
+        self.socket.bind(('', port))
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.transport = None
+
+    def create_assembler(self):
+        raise NotImplementedError
+
+    async def create_endpoint(self):
+        self.transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: StreamProtocol(self), sock=self.socket)
+
+    def close_endpoint(self):
+        self.transport.close()
+
+    def server_close(self):
+        self.socket.close()
+        super().server_close()
+
+    def assembler(self, addr):
+        assembler = self.sources.get(addr)
+        if assembler is None:
+            if len(self.sources) >= MAX_SOURCES:
+                oldest = min(self.last_seen, key=self.last_seen.get)
+                del self.sources[oldest]
+                del self.last_seen[oldest]
+            assembler = self.create_assembler()
+            assembler.ring.in_use = self.frames_in_use
+            self.sources[addr] = assembler
+        self.last_seen[addr] = time.time()
+        return assembler
+
+    def process_packet(self, data, addr=None):
+        assembler = self.assembler(addr)
+        packets = assembler.packets
+        try:
+            frame = assembler.process_packet(data)
+        except ValueError:
+            return
+        if frame is None and assembler.packets == packets:
+            # no data for the display, e.g. a broadcast sync packet of a
+            # controller driving other fixtures
+            return
+        self.stream_started()
+        self.update_time()
+        if frame is not None:
+            self.present(frame)
+
+
+class UniverseFrameAssembler(StreamAssembler):
+    """Assembles frames from DMX universes (Art-Net, E1.31).
+
+    The display buffer is split into universes of channels_per_universe
+    channels, starting at first_universe. 510 channels (170 rgb pixels) per
+    universe keep pixels from being split between universes. The position
+    of every universe in the frame is computed once. A frame is complete
+    once every universe has arrived; if the sender synchronizes its
+    universes, it is handed out only with the following sync packet."""
+    def __init__(self, width, height, first_universe,
+                 channels_per_universe=510):
+        super().__init__(width, height)
+        frame_bytes = width * height * 3
+        self.first_universe = first_universe
+        self.channels_per_universe = channels_per_universe
+        self.universe_count = -(-frame_bytes // channels_per_universe)
+        self.offsets = [i * channels_per_universe
+                        for i in range(self.universe_count)]
+        self.lengths = [min(channels_per_universe, frame_bytes - offset)
+                        for offset in self.offsets]
+        self.all_received = (1 << self.universe_count) - 1
+        self.reset()
+
+    def reset(self):
+        self.received = 0  # bit mask of the universes of the current frame
+        self.sequences = [None] * self.universe_count
+        self.synchronized = False  # the sender sends sync packets
+        self.ready = False  # a complete frame waits for the sync packet
+
+    def universe_index(self, universe):
+        """Index of universe in the frame. Raises ValueError if it is not
+        displayed."""
+        i = universe - self.first_universe
+        if not 0 <= i < self.universe_count:
+            raise ValueError("universe {} is not displayed".format(universe))
+        return i
+
+    def universe_data(self, i, data, data_offset, length, sequence=None):
+        """Store the channels of the ith universe. Returns the frame if it is
+        complete and not synchronized, otherwise None."""
+        self.packets += 1
+        if sequence is not None:
+            previous = self.sequences[i]
+            if previous is not None and sequence != (previous + 1) & 0xFF:
+                self.gaps += 1
+            self.sequences[i] = sequence
+        self.ring.write(self.offsets[i], data, data_offset,
+                        min(length, self.lengths[i]))
+        self.received |= 1 << i
+        if self.received != self.all_received:
+            return None
+        self.received = 0
+        if self.synchronized:
+            self.ready = True
+            return None
+        self.frames += 1
+        return self.ring.complete()
+
+    def sync(self):
+        """Sync packet received. Returns the frame waiting for it or None."""
+        self.synchronized = True
+        if not self.ready:
+            return None
+        self.ready = False
+        self.frames += 1
+        return self.ring.complete()
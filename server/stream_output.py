@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stream output: send what the display shows to other devices.
+
+Every frame shown is handed to StreamOutput, which sends it as tpm2.net or
+Art-Net to a list of targets (unicast, broadcast or multicast addresses)
+from a thread of its own. The packets of a protocol are preallocated; the
+pixels of a frame are copied into them once and the same packets go to
+every target of that protocol. Frames are sent at most fps times per
+second, a frame that is replaced before its turn is skipped. While the
+display does not change, the last frame is repeated every keepalive
+seconds so that receivers do not time out.
+
+    output = StreamOutput(16, 16, [("tpm2.net", "192.168.1.23"),
+                                   ("artnet", "239.255.0.1:6454")])
+    output.start()
+    output.submit(frame)
+
+Failed sends are counted per target as lost packets (a full socket buffer
+drops the packet instead of delaying the following frames).
+"""
+
+from collections import deque
+import socket
+import threading
+import time
+
+import numpy as np
+
+from server.artnet import ARTNET_PORT, ARTNET_ID, ARTNET_OP_DMX, \
+    ARTNET_OP_SYNC, ARTNET_DMX_HEADER_SIZE
+from server.tpm2_net import TPM2_NET_PORT, TPM2_START, TPM2_END, TPM2_DATA, \
+    TPM2_HEADER_SIZE
+
+TPM2_MAX_PAYLOAD = 1490  # bytes of pixel data per tpm2.net packet
+ARTNET_PROTOCOL_VERSION = 14
+OUTPUT_PROTOCOLS = ("tpm2.net", "artnet")
+SEND_BUFFER = 256 * 1024
+
+
+class Tpm2NetPacketizer():
+    port = TPM2_NET_PORT
+
+    def __init__(self, frame_bytes, max_payload=TPM2_MAX_PAYLOAD):
+        count = -(-frame_bytes // max_payload)
+        self.packets = []
+        self.slices = []  # (offset in the frame, bytes) of every packet
+        for i in range(count):
+            offset = i * max_payload
+            size = min(max_payload, frame_bytes - offset)
+            packet = bytearray(TPM2_HEADER_SIZE + size + 1)
+            packet[:TPM2_HEADER_SIZE] = bytes((TPM2_START, TPM2_DATA,
+                                               size >> 8, size & 0xFF,
+                                               i + 1, count))
+            packet[-1] = TPM2_END
+            self.packets.append(packet)
+            self.slices.append((offset, size))
+
+    def packetize(self, data):
+        """Copy the pixels of a frame (flat uint8 memoryview) into the
+        packets and return them"""
+        for packet, (offset, size) in zip(self.packets, self.slices):
+            packet[TPM2_HEADER_SIZE:TPM2_HEADER_SIZE + size] = \
+                data[offset:offset + size]
+        return self.packets
+
+
+class ArtNetPacketizer():
+    """One OpDmx packet per universe, followed by an OpSync if the frame
+    spans several universes so that receivers show them together"""
+    port = ARTNET_PORT
+
+    def __init__(self, frame_bytes, first_universe=0,
+                 channels_per_universe=510):
+        self.packets = []
+        self.slices = []
+        self.sequence = 0
+        for i in range(-(-frame_bytes // channels_per_universe)):
+            offset = i * channels_per_universe
+            size = min(channels_per_universe, frame_bytes - offset)
+            length = size + size % 2  # the length must be even
+            universe = first_universe + i
+            packet = bytearray(ARTNET_DMX_HEADER_SIZE + length)
+            packet[:ARTNET_DMX_HEADER_SIZE] = ARTNET_ID + bytes((
+                ARTNET_OP_DMX & 0xFF, ARTNET_OP_DMX >> 8,
+                0, ARTNET_PROTOCOL_VERSION, 0, 0,
+                universe & 0xFF, (universe >> 8) & 0x7F,
+                length >> 8, length & 0xFF))
+            self.packets.append(packet)
+            self.slices.append((offset, size))
+        self.all_packets = self.packets
+        if len(self.packets) > 1:
+            self.all_packets = self.packets + [ARTNET_ID + bytes((
+                ARTNET_OP_SYNC & 0xFF, ARTNET_OP_SYNC >> 8,
+                0, ARTNET_PROTOCOL_VERSION, 0, 0))]
+
+    def packetize(self, data):
+        # 1 to 255, 0 means that sequence numbers are not used
+        self.sequence = self.sequence % 255 + 1
+        for packet, (offset, size) in zip(self.packets, self.slices):
+            packet[12] = self.sequence
+            packet[ARTNET_DMX_HEADER_SIZE:ARTNET_DMX_HEADER_SIZE + size] = \
+                data[offset:offset + size]
+        return self.all_packets
+
+
+class OutputTarget():
+    def __init__(self, protocol, address):
+        self.protocol = protocol
+        self.address = address  # (host, port)
+        self.packets = 0
+        self.bytes = 0
+        self.lost = 0  # packets that could not be sent
+
+    def __str__(self):
+        return "{} {}:{}".format(self.protocol, *self.address)
+
+
+def parse_target(target, port):
+    """(host, port) of "host" or "host:port" """
+    host, _, target_port = target.partition(":")
+    return socket.gethostbyname(host), int(target_port) if target_port \
+        else port
+
+
+class StreamOutput():
+    def __init__(self, width, height, targets, fps=60, keepalive=1.0,
+                 first_universe=0, channels_per_universe=510,
+                 send_buffer=SEND_BUFFER):
+        """targets is a list of (protocol, "host[:port]"), protocol one of
+        OUTPUT_PROTOCOLS"""
+        frame_bytes = width * height * 3
+        self.packetizers = {}
+        self.targets = []
+        for protocol, target in targets:
+            if protocol not in OUTPUT_PROTOCOLS:
+                raise ValueError("Unknown output protocol {}".format(
+                    protocol))
+            if protocol not in self.packetizers:
+                self.packetizers[protocol] = \
+                    Tpm2NetPacketizer(frame_bytes) \
+                    if protocol == "tpm2.net" else \
+                    ArtNetPacketizer(frame_bytes, first_universe,
+                                     channels_per_universe)
+            port = self.packetizers[protocol].port
+            self.targets.append(OutputTarget(
+                protocol, parse_target(target, port)))
+        self.interval = 1 / fps
+        self.keepalive = keepalive
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if send_buffer:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                   send_buffer)
+        self.socket.setblocking(False)
+
+        # submit copies into incoming, the thread swaps it with outgoing
+        self.incoming = np.zeros((height, width, 3), dtype=np.uint8)
+        self.outgoing = np.zeros((height, width, 3), dtype=np.uint8)
+        self.pending = False
+        self.sent_any = False
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+        self.frames = 0  # frames sent, keepalives included
+        self.skipped = 0  # frames replaced before they were sent
+        self.send_times = deque(maxlen=120)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, frame):
+        """Send frame soon. Called with every frame shown; the frame is
+        copied, it may change afterwards."""
+        with self.condition:
+            if self.pending:
+                self.skipped += 1
+            np.copyto(self.incoming, frame)
+            self.pending = True
+            self.condition.notify()
+
+    def run(self):
+        next_send = time.monotonic()
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.pending or self.stopped, self.keepalive)
+                if self.stopped and not self.pending:
+                    break
+            # pace, a frame submitted meanwhile replaces the one waiting
+            delay = next_send - time.monotonic()
+            if delay > 0 and not self.stopped:
+                time.sleep(delay)
+            with self.condition:
+                if self.pending:
+                    self.incoming, self.outgoing = \
+                        self.outgoing, self.incoming
+                    self.pending = False
+                elif not self.sent_any:
+                    continue
+            self.send_frame()
+            next_send = max(next_send + self.interval,
+                            time.monotonic() - self.interval)
+
+    def send_frame(self):
+        data = self.outgoing.reshape(-1).data
+        packets = {protocol: packetizer.packetize(data)
+                   for protocol, packetizer in self.packetizers.items()}
+        for target in self.targets:
+            for packet in packets[target.protocol]:
+                try:
+                    self.socket.sendto(packet, target.address)
+                except OSError:
+                    # buffer full, network unreachable, ...
+                    target.lost += 1
+                else:
+                    target.packets += 1
+                    target.bytes += len(packet)
+        self.sent_any = True
+        self.frames += 1
+        self.send_times.append(time.monotonic())
+
+    def close(self):
+        """Send the frame submitted last and stop"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.socket.close()
+
+    def fps(self):
+        times = list(self.send_times)
+        if len(times) < 2 or time.monotonic() - times[-1] > self.keepalive:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def stats(self):
+        fps = self.fps()
+        return [{"target": str(target), "packets": target.packets,
+                 "bytes": target.bytes, "lost": target.lost,
+                 "frames": self.frames, "skipped": self.skipped,
+                 "fps": fps}
+                for target in self.targets]
+
+
+def run_benchmark(width=16, height=16, targets=4, fps=60, seconds=3):
+    """Frames submitted much faster than fps to targets on the loopback
+    interface: the rate achieved, the packets that arrived and the time it
+    takes to packetize and send one frame"""
+    import select
+
+    receivers = []
+    target_list = []
+    for i in range(targets):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            1024 * 1024)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.setblocking(False)
+        receivers.append(receiver)
+        protocol = OUTPUT_PROTOCOLS[i % len(OUTPUT_PROTOCOLS)]
+        target_list.append((protocol, "127.0.0.1:{}".format(
+            receiver.getsockname()[1])))
+    output = StreamOutput(width, height, target_list, fps=fps)
+    received = [0]
+    draining = threading.Event()
+
+    def drain():
+        # the receivers run out of buffer space unless they are read
+        while not draining.is_set():
+            ready, _, _ = select.select(receivers, [], [], 0.05)
+            for receiver in ready:
+                while True:
+                    try:
+                        receiver.recv(65536)
+                    except BlockingIOError:
+                        break
+                    received[0] += 1
+
+    drainer = threading.Thread(target=drain, daemon=True)
+    drainer.start()
+    output.start()
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    submitted = 0
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    while time.perf_counter() - start < seconds:
+        frame[:] = submitted % 256
+        output.submit(frame)
+        submitted += 1
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    submit = time.thread_time() - cpu
+    output.close()
+    frames, skipped = output.frames, output.skipped
+    time.sleep(0.1)
+    draining.set()
+    drainer.join()
+    received = received[0]
+    stats = output.stats()
+
+    # the work of the send thread per frame, without pacing
+    output = StreamOutput(width, height, target_list, fps=fps)
+    start = time.perf_counter()
+    for _ in range(1000):
+        output.send_frame()
+    send = (time.perf_counter() - start) / 1000
+    output.close()
+    for receiver in receivers:
+        receiver.close()
+
+    sent = sum(target["packets"] for target in stats)
+    lost = sum(target["lost"] for target in stats)
+    print("{}x{} to {} targets at {} fps: {} frames submitted, {} sent "
+          "({:.1f}/s), {} skipped, {} packets sent, {} lost, {} received; "
+          "submit {:.1f}us, send {:.1f}us per frame".format(
+              width, height, targets, fps, submitted, frames,
+              frames / elapsed, skipped, sent, lost, received,
+              submit / submitted * 1e6, send * 1e6))
+
+
+if __name__ == "__main__":
+    # python3 -m server.stream_output
+    run_benchmark(16, 16)
+    run_benchmark(32, 32)
+    run_benchmark(64, 64)
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# RibbaPi - APA102 LED matrix controlled by Raspberry Pi in python
+# Copyright (C) 2016  Christoph Stahl
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synchronized playback on several displays.
+
+One RibbaPi is the leader. It picks the animations as usual and broadcasts
+every choice together with the time its first frame is due, on the clock
+of the leader, a moment ahead so that the followers receive it in time.
+Followers play nothing but what the leader announced. They estimate the
+offset between their clock and the one of the leader the way NTP does,
+from the round trip of pings, and start the animation at that time on
+their own clock. From then on frame_deadline keeps the displays together.
+
+Followers report when they showed every frame, the leader compares that
+with when it showed the same frame and keeps the skew per follower.
+
+Messages are JSON datagrams. Plays are broadcast to SYNC_PORT, everything
+else goes between the unicast sockets of the nodes:
+
+    leader  leader to all        sent while no animation is announced
+    play    leader to all        id, animation (class name), kwargs, start
+    ping    follower to leader   t1 (follower clock when sent)
+    pong    leader to follower   t1, t2 and t3 (leader clock when received
+                                 and when sent)
+    report  follower to leader   node, offset, round trip, frames (id,
+                                 number, leader time shown)
+
+Run python3 -m server.sync [followers [seconds]] to play on a leader and
+followers in separate processes on this host and print the skew.
+"""
+
+import asyncio
+from collections import deque
+import json
+from pathlib import Path
+import random
+import socket
+import threading
+import time
+
+import numpy as np
+
+SYNC_PORT = 65508
+SYNC_ROLES = ("leader", "follower")
+SYNC_LEAD = 0.25  # seconds between the announcement and the first frame
+ANNOUNCE_INTERVAL = 1.0  # seconds between plays, pings and reports
+OFFSET_SAMPLES = 8  # pings the offset is estimated from
+SKEW_SAMPLES = 1000  # frames the skew statistics are computed from
+SHOWN_FRAMES = 4096  # frames of the leader kept to compare reports with
+REPORT_FRAMES = 256  # most frames in one report
+
+
+def _plain(value):
+    """value as JSON or None if it has no JSON representation"""
+    if isinstance(value, Path):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        values = [_plain(v) for v in value]
+        return None if None in values else values
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return None
+
+
+class SyncProtocol(asyncio.DatagramProtocol):
+    def __init__(self, node):
+        self.node = node
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            return
+        if isinstance(message, dict):
+            self.node.message_received(message, addr)
+
+    def error_received(self, exc):
+        print("sync: {}".format(exc))
+
+
+class SyncNode():
+    """Leader or follower of synchronized playback, running on its own
+    asyncio event loop like the stream servers. clock is the clock of this
+    node, it only differs from time.time() in tests."""
+    name = "sync"
+
+    def __init__(self, ribbapi, role, address="255.255.255.255",
+                 port=SYNC_PORT, node=None, clock=time.time):
+        if role not in SYNC_ROLES:
+            raise ValueError("Unknown sync role {}".format(role))
+        self.ribbapi = ribbapi
+        self.role = role
+        self.broadcast_address = (address, port)
+        self.node = node or socket.gethostname()
+        self.clock = clock
+        self.loop = asyncio.new_event_loop()
+        self.lock = threading.Lock()
+
+        # plays arrive on the shared port, everything else on our own one
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.socket.bind(('', 0))
+        self.socket.setblocking(False)
+        self.broadcast_socket = None
+        if role == "follower":
+            self.broadcast_socket = socket.socket(socket.AF_INET,
+                                                  socket.SOCK_DGRAM)
+            self.broadcast_socket.setsockopt(socket.SOL_SOCKET,
+                                             socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                # several followers on one host
+                self.broadcast_socket.setsockopt(socket.SOL_SOCKET,
+                                                 socket.SO_REUSEPORT, 1)
+            self.broadcast_socket.bind(('', port))
+            self.broadcast_socket.setblocking(False)
+        self.transports = []
+        self.handle = None
+
+        self.playing = None  # id of the animation playing
+        self.animation = None
+        self.frame_number = 0
+        self.presented = deque()  # (id, number, leader time) to report
+
+        # leader
+        self.sequence = random.getrandbits(31)
+        self.play = None  # the play message of the current animation
+        self.shown = {}  # (id, number) -> leader time shown
+        self.shown_order = deque()
+        self.followers = {}  # node -> statistics of the follower
+
+        # follower
+        self.leader = None  # address of the leader
+        self.samples = deque(maxlen=OFFSET_SAMPLES)  # (round trip, offset)
+        self.offset = None  # leader clock - our clock, seconds
+        self.round_trip = None
+        self.pending = None  # play message waiting to be started
+
+    async def create_endpoint(self):
+        for sock in (self.socket, self.broadcast_socket):
+            if sock is not None:
+                transport, _ = await self.loop.create_datagram_endpoint(
+                    lambda: SyncProtocol(self), sock=sock)
+                self.transports.append(transport)
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.create_endpoint())
+        self.handle = self.loop.call_soon(self.tick)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.handle.cancel()
+            for transport in self.transports:
+                transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def server_close(self):
+        if not self.loop.is_running():
+            self.loop.close()
+        self.socket.close()
+        if self.broadcast_socket is not None:
+            self.broadcast_socket.close()
+
+    def send(self, message, addr):
+        try:
+            self.socket.sendto(json.dumps(message).encode("utf-8"), addr)
+        except OSError as e:
+            print("sync: could not send to {}: {}".format(addr, e))
+
+    # time on the clock of the leader and the time.time() of this process
+    def to_leader(self, local):
+        return local + self.clock() - time.time() + (self.offset or 0)
+
+    def to_local(self, leader):
+        return leader - (self.offset or 0) - self.clock() + time.time()
+
+    def tick(self):
+        if self.role == "leader":
+            # followers that started late or missed the play catch up
+            self.send(self.play or {"type": "leader"},
+                      self.broadcast_address)
+        elif self.leader is not None:
+            self.send({"type": "ping", "t1": self.clock()}, self.leader)
+            self.report()
+        self.handle = self.loop.call_later(ANNOUNCE_INTERVAL, self.tick)
+
+    def message_received(self, message, addr):
+        kind = message.get("type")
+        try:
+            if self.role == "leader":
+                if kind == "ping":
+                    t2 = self.clock()
+                    self.send({"type": "pong", "t1": message["t1"], "t2": t2,
+                               "t3": self.clock()}, addr)
+                elif kind == "report":
+                    self.report_received(message)
+            elif kind == "leader":
+                self.leader = addr
+            elif kind == "play":
+                self.play_received(message, addr)
+            elif kind == "pong":
+                self.pong_received(message)
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    # leader
+    def announce(self, animation):
+        """Called by the mainloop of the leader before it starts animation:
+        let it begin SYNC_LEAD from now and tell the followers"""
+        kwargs = {key: _plain(value)
+                  for key, value in animation.kwargs.items()
+                  if key not in ("width", "height", "frame_queue")}
+        start = self.clock() + SYNC_LEAD
+        animation.start_at = self.to_local(start)
+        self.sequence += 1
+        self.started(self.sequence, animation)
+        self.play = {"type": "play", "id": self.sequence,
+                     "animation": type(animation).__name__,
+                     "kwargs": kwargs, "start": start}
+        self.loop.call_soon_threadsafe(self.send, self.play,
+                                       self.broadcast_address)
+
+    def report_received(self, message):
+        follower = self.followers.get(message["node"])
+        if follower is None:
+            follower = self.followers[message["node"]] = {
+                "skews": deque(maxlen=SKEW_SAMPLES), "unmatched": 0}
+        follower["offset"] = message["offset"]
+        follower["round_trip"] = message["round_trip"]
+        follower["last_seen"] = time.time()
+        for play_id, number, shown in message["frames"]:
+            reference = self.shown.get((play_id, number))
+            if reference is None:
+                follower["unmatched"] += 1
+            else:
+                follower["skews"].append(shown - reference)
+
+    # follower
+    def play_received(self, message, addr):
+        self.leader = addr
+        if self.offset is None:
+            # the first pong tells when to start
+            self.send({"type": "ping", "t1": self.clock()}, self.leader)
+            return
+        with self.lock:
+            if message["id"] == self.playing or self.pending is not None \
+                    and self.pending["id"] == message["id"]:
+                return
+            message["local_start"] = self.to_local(message["start"])
+            self.pending = message
+        self.ribbapi.wake()
+
+    def pong_received(self, message):
+        t4 = self.clock()
+        round_trip = (t4 - message["t1"]) - (message["t3"] - message["t2"])
+        offset = ((message["t2"] - message["t1"]) +
+                  (message["t3"] - t4)) / 2
+        self.samples.append((round_trip, offset))
+        # the fastest round trip was delayed least on one of the ways
+        self.round_trip, self.offset = min(self.samples)
+
+    def take_pending(self):
+        """The play message to start now, if any"""
+        with self.lock:
+            message, self.pending = self.pending, None
+        return message
+
+    def report(self):
+        frames = []
+        while self.presented and len(frames) < REPORT_FRAMES:
+            frames.append(self.presented.popleft())
+        self.send({"type": "report", "node": self.node,
+                   "offset": self.offset, "round_trip": self.round_trip,
+                   "frames": frames}, self.leader)
+
+    # both
+    def started(self, play_id, animation):
+        """animation of the play play_id is started"""
+        self.playing = play_id
+        self.animation = animation
+        self.frame_number = 0
+
+    def frame_presented(self, animation):
+        """Called by the mainloop after it has shown a frame of animation"""
+        if animation is None or animation is not self.animation:
+            return
+        self.frame_number += 1
+        shown = self.to_leader(time.time())
+        if self.role == "leader":
+            key = (self.playing, self.frame_number)
+            self.shown[key] = shown
+            self.shown_order.append(key)
+            if len(self.shown_order) > SHOWN_FRAMES:
+                self.shown.pop(self.shown_order.popleft(), None)
+        elif self.leader is not None:
+            self.presented.append((self.playing, self.frame_number, shown))
+            if len(self.presented) > SHOWN_FRAMES:
+                self.presented.popleft()
+
+    def stats(self):
+        """Skew of every follower in milliseconds (positive: the follower
+        is late) on the leader, the clock estimate on a follower"""
+        if self.role == "follower":
+            return [{"node": self.node,
+                     "leader": "{}:{}".format(*self.leader)
+                     if self.leader else None,
+                     "offset": self.offset, "round_trip": self.round_trip}]
+        stats = []
+        for node, follower in sorted(self.followers.items()):
+            skews = np.array(follower["skews"]) * 1000
+            entry = {"node": node, "frames": len(skews),
+                     "unmatched": follower["unmatched"],
+                     "offset": follower["offset"],
+                     "round_trip": follower["round_trip"],
+                     "mean": 0.0, "median": 0.0, "p95": 0.0, "max": 0.0}
+            if len(skews):
+                entry.update({"mean": skews.mean(),
+                              "median": np.median(skews),
+                              "p95": np.percentile(np.abs(skews), 95),
+                              "max": np.abs(skews).max()})
+            stats.append(entry)
+        return stats
+
+
+def run_node(role, node, seconds, port, clock_error=0.0, results=None,
+             switch_every=4.0):
+    """One display without hardware, frames are shown as soon as they are
+    taken from the frame queue. The leader switches animations every
+    switch_every seconds."""
+    import queue
+    from types import SimpleNamespace
+    from animation.moodlight import MoodlightAnimation
+
+    frame_queue = queue.Queue(maxsize=1)
+
+    def wake():
+        try:
+            frame_queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    ribbapi = SimpleNamespace(wake=wake)
+    sync = SyncNode(ribbapi, role, "127.255.255.255", port, node,
+                    clock=lambda: time.time() + clock_error)
+    thread = threading.Thread(target=sync.serve_forever, daemon=True)
+    thread.start()
+    modes = ("plasma", "colorwheel", "ripple", "noise")
+    animation = None
+    played = 0
+    # give the followers time to estimate their offset
+    switched = time.time() - switch_every + 2 * ANNOUNCE_INTERVAL
+    end = time.time() + seconds
+    while time.time() < end:
+        if role == "leader" and time.time() - switched > switch_every:
+            if animation is not None:
+                animation.stop()
+            animation = MoodlightAnimation(16, 16, frame_queue,
+                                           mode=modes[played % len(modes)])
+            played += 1
+            switched = time.time()
+            sync.announce(animation)
+            animation.start()
+        message = sync.take_pending() if role == "follower" else None
+        if message is not None:
+            if animation is not None:
+                animation.stop()
+            animation = MoodlightAnimation(16, 16, frame_queue,
+                                           **message["kwargs"])
+            animation.start_at = message["local_start"]
+            sync.started(message["id"], animation)
+            animation.start()
+        try:
+            frame = frame_queue.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        if frame is not None:
+            sync.frame_presented(animation)
+    if animation is not None:
+        animation.stop()
+    if results is not None:
+        results.put((node, clock_error, sync.stats()))
+    sync.shutdown()
+    thread.join()
+    sync.server_close()
+
+
+def run_demo(followers=3, seconds=20):
+    """Start a leader and followers with clocks that are off by up to half a
+    second as separate processes and print the skew between them"""
+    import multiprocessing
+
+    port = random.randint(40000, 60000)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=run_node, args=("leader", "leader", seconds + 2, port, 0.0,
+                               results))]
+    for i in range(followers):
+        clock_error = round(random.uniform(-0.5, 0.5), 3)
+        processes.append(multiprocessing.Process(
+            target=run_node, args=("follower", "follower{}".format(i + 1),
+                                   seconds, port, clock_error, results)))
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    errors = {node: error for node, error, _ in collected}
+    for node, _, stats in collected:
+        if node != "leader":
+            continue
+        for entry in stats:
+            # offset is leader - follower, the follower clock is off by
+            # -offset
+            print("{node}: clock off by {error:+.3f}s, estimated "
+                  "{estimate:+.4f}s (round trip {round_trip:.2f}ms), "
+                  "{frames} frames, skew mean {mean:+.2f}ms median "
+                  "{median:+.2f}ms p95 {p95:.2f}ms max {max:.2f}ms, "
+                  "{unmatched} unmatched".format(
+                      error=errors[entry["node"]],
+                      estimate=-(entry["offset"] or 0),
+                      **dict(entry, round_trip=(entry["round_trip"] or 0) *
+                             1000)))
+
+
+if __name__ == "__main__":
+    # python3 -m server.sync [followers [seconds]]
+    import sys
+    run_demo(*(int(arg) for arg in sys.argv[1:3]))
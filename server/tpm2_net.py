@@ -19,91 +19,169 @@
 # Protocol Reference
 # https://gist.github.com/jblang/89e24e2655be6c463c56
 
-import socketserver
+import socket
 import time
-from threading import Timer
 import numpy as np
 
+from server.stream import StreamAssembler, UdpStreamServer, RECEIVE_BUFFER
 
-class Tpm2NetServer(socketserver.UDPServer):
-    def __init__(self, ribbapi):
-        super().__init__(('', 65506), Tpm2NetHandler, bind_and_activate=True)
-        self.ribbapi = ribbapi
-        self.tmp_buffer = np.zeros((self.ribbapi.display.height,
-                                    self.ribbapi.display.width,
-                                    3), dtype=np.uint8)
-        self.tmp_buffer_index = 0
-        self.timeout = 3  # seconds
-        self.last_time_received = None
-        self.timeout_timer = None
+TPM2_NET_PORT = 65506
+
+TPM2_START = 0x9C
+TPM2_END = 0x36
+TPM2_DATA = 0xDA
+TPM2_COMMAND = 0xC0
+TPM2_RESPONSE = 0xAA
+TPM2_HEADER_SIZE = 6
+
+
+class Tpm2NetFrameAssembler(StreamAssembler):
+    """Collects the payloads of tpm2.net data packets into frames, written
+    straight from the datagram into the frame ring."""
+    def __init__(self, width, height):
+        super().__init__(width, height)
+        self.offset = 0
         # glediator is ok
         # but pixelcontroller is counting the packets wrong.
         # when detected that the stream is misheaving then count also wrong
         self.misbehaving = False
+        self.expected = None  # number of the next packet
 
-    def update_time(self):
-        if not self.last_time_received:
-            # start a timer if there is None
-            if not self.timeout_timer:
-                self.timeout_timer = Timer(0.5, self.check_for_timeout)
-                self.timeout_timer.start()
-        # to detect timeout store current time
-        self.last_time_received = time.time()
-
-    def check_for_timeout(self):
-        if self.last_time_received:
-            if self.last_time_received + self.timeout < time.time():
-                self.ribbapi.receiving_data.clear()
-                self.last_time_received = None
-                self.timeout_timer = None
-                self.misbehaving = False
-            else:
-                # restart a timer
-                self.timeout_timer = None
-                self.timeout_timer = Timer(0.5, self.check_for_timeout)
-                self.timeout_timer.start()
-
-
-class Tpm2NetHandler(socketserver.BaseRequestHandler):
-    def handle(self):
-        data = self.request[0].strip()
-        data_length = len(data)
-        # check packet start byte 0x9C
-        if not data_length >= 8 and data[0] == 0x9c:
-            return
-        packet_type = data[1]
+    def reset(self):
+        self.offset = 0
+        self.misbehaving = False
+        self.expected = None
+
+    @staticmethod
+    def parse_header(data):
+        """(packet_type, frame_size, packet_number, number_of_packets) of a
+        valid tpm2.net packet or None"""
+        if len(data) < TPM2_HEADER_SIZE + 1 or data[0] != TPM2_START or \
+                data[-1] != TPM2_END:
+            return None
         frame_size = (data[2] << 8) + data[3]
-        # check consistency of length and proper frame ending
-        if not (data_length - 7 == frame_size) and data[-1] == 0x36:
-            return
-
-        packet_number = data[4]
-        number_of_packets = data[5]
-
-        if packet_type == 0xDA:  # data frame
-            # tell ribbapi that tpm2_net data is received
-            self.server.ribbapi.receiving_data.set()
-            self.server.update_time()
-
-            if packet_number == 0:
-                self.server.misbehaving = True
-            if packet_number == (1 if not self.server.misbehaving else 0):
-                self.server.tmp_buffer_index = 0
-
-            upper = min(self.server.tmp_buffer.size,
-                        self.server.tmp_buffer_index + frame_size)
-            arange = np.arange(self.server.tmp_buffer_index,
-                               upper)
-            np.put(self.server.tmp_buffer, arange, list(data[6:-1]))
-            self.server.tmp_buffer_index = self.server.tmp_buffer_index + frame_size
-            if packet_number == (number_of_packets if not self.server.misbehaving else number_of_packets - 1):
-                if not self.server.ribbapi.current_animation:
-                    self.server.ribbapi.frame_queue.put(self.server.tmp_buffer.copy())
-        elif data[1] == 0xC0:  # command
-            # NOT IMPLEMENTED
-            return
-        elif data[1] == 0xAA:  # request response
-            # NOT IMPLEMENTED
-            return
-        else:  # no valid tmp2 packet type
-            return
+        if len(data) != TPM2_HEADER_SIZE + frame_size + 1:
+            return None
+        return data[1], frame_size, data[4], data[5]
+
+    def process_packet(self, data):
+        header = self.parse_header(data)
+        if header is None or header[0] != TPM2_DATA:
+            # commands and request responses are not implemented
+            self.malformed += 1
+            raise ValueError("no tpm2.net data packet")
+        packet_type, frame_size, packet_number, number_of_packets = header
+        self.packets += 1
+
+        if packet_number == 0:
+            self.misbehaving = True
+        first = 1 if not self.misbehaving else 0
+        if self.expected is not None and packet_number != self.expected:
+            self.gaps += 1
+        if packet_number == first:
+            self.offset = 0
+
+        self.ring.write(self.offset, data, TPM2_HEADER_SIZE, frame_size)
+        self.offset += frame_size
+
+        last = number_of_packets if not self.misbehaving \
+            else number_of_packets - 1
+        if packet_number != last:
+            self.expected = packet_number + 1
+            return None
+        self.expected = first
+        self.offset = 0
+        self.frames += 1
+        return self.ring.complete()
+
+
+class Tpm2NetServer(UdpStreamServer):
+    name = "tpm2.net"
+
+    def __init__(self, ribbapi, port=TPM2_NET_PORT,
+                 receive_buffer=RECEIVE_BUFFER):
+        super().__init__(ribbapi, port, receive_buffer)
+
+    def create_assembler(self):
+        return Tpm2NetFrameAssembler(self.ribbapi.display.width,
+                                     self.ribbapi.display.height)
+
+
+def run_benchmark(width=16, height=16, packets_per_frame=1, frames=20000):
+    """Packets per second and time per packet of the frame assembly"""
+    assembler = Tpm2NetFrameAssembler(width, height)
+    frame_bytes = width * height * 3
+    size = -(-frame_bytes // packets_per_frame)
+    stream = []
+    for number in range(1, packets_per_frame + 1):
+        payload = bytes(np.random.randint(0, 256, size=min(
+            size, frame_bytes - (number - 1) * size), dtype=np.uint8))
+        stream.append(bytes((TPM2_START, TPM2_DATA, len(payload) >> 8,
+                             len(payload) & 0xFF, number,
+                             packets_per_frame)) + payload +
+                      bytes((TPM2_END,)))
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(frames):
+        for packet in stream:
+            assembler.process_packet(packet)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+    count = frames * packets_per_frame
+    print("{}x{}, {} packets per frame: {:.0f} packets/s, {:.2f}us CPU per "
+          "packet, {} frames".format(width, height, packets_per_frame,
+                                     count / elapsed, cpu / count * 1e6,
+                                     assembler.frames))
+
+
+def run_socket_benchmark(width=16, height=16, frames=20000):
+    """Frames per second through the event loop over the loopback
+    interface, sent as fast as possible by one client"""
+    import threading
+    from types import SimpleNamespace
+
+    ribbapi = SimpleNamespace(
+        display=SimpleNamespace(width=width, height=height),
+        receiving_data=threading.Event(), wake=lambda: None,
+        current_animation=None)
+    server = Tpm2NetServer(ribbapi, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    payload = bytes(width * height * 3)
+    packet = bytes((TPM2_START, TPM2_DATA, len(payload) >> 8,
+                    len(payload) & 0xFF, 1, 1)) + payload + bytes((TPM2_END,))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = ("127.0.0.1", server.server_address[1])
+
+    def received():
+        return sum(source["frames"] for source in server.stats())
+
+    start = time.perf_counter()
+    for i in range(frames):
+        client.sendto(packet, address)
+        # do not overrun the receive buffer of the server
+        while i - received() > 64:
+            time.sleep(0)
+    while received() < frames and \
+            time.perf_counter() - start < 30:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    count = received()
+    threads = threading.active_count()
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    client.close()
+    print("{}x{} over udp: {:.0f} frames/s, {} of {} received, receive "
+          "buffer {} bytes, {} threads running".format(
+              width, height, count / elapsed, count, frames,
+              server.receive_buffer, threads))
+
+
+if __name__ == "__main__":
+    # python3 -m server.tpm2_net
+    run_benchmark(16, 16, 1)
+    run_benchmark(32, 32, 1)
+    run_benchmark(32, 32, 4)
+    run_socket_benchmark(16, 16)
+    run_socket_benchmark(32, 32)